@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Deterministic synthetic short-text corpus, one ``label<TAB>text`` line
+per document as read by :meth:`tgrocery.Grocery.train`.
+
+Words are strings of 1-3 CJK characters drawn from a Zipf distribution
+over a vocabulary of *nr_word* words. Each label has its own slice of
+topic words, from which a share *topic_ratio* of its words are drawn,
+so that the labels can be learned. The same arguments always give the
+same corpus.
+
+    python benchmarks/corpus.py output [number of documents] [vocabulary size]
+                                       [number of labels] [words per text] [seed]
+"""
+import bisect
+import random
+import sys
+
+# common CJK unified ideographs
+_FIRST_CHAR, _NR_CHAR = 0x4e00, 0x5000
+
+
+def _vocabulary(nr_word, rand):
+    words, seen = [], set()
+    while len(words) < nr_word:
+        word = u''.join(unichr(_FIRST_CHAR + rand.randrange(_NR_CHAR)) for _ in range(rand.choice((1, 2, 2, 3))))
+        if word not in seen:
+            seen.add(word)
+            words.append(word.encode('utf-8'))
+    return words
+
+
+def _zipf_cdf(n, exponent):
+    cdf, total = [], 0.0
+    for rank in range(1, n + 1):
+        total += rank ** -exponent
+        cdf.append(total)
+    return [c / total for c in cdf]
+
+
+def generate_corpus(nr_doc, nr_word=20000, nr_label=20, length=12, seed=0, topic_ratio=0.3, exponent=1.1):
+    """
+    Yield *nr_doc* ``(label, text)`` pairs of *length* words on average.
+    """
+    rand = random.Random(seed)
+    # the vocabulary only depends on nr_word, so that corpora of other
+    # seeds, e.g. a test set, share it
+    words = _vocabulary(nr_word, random.Random(nr_word))
+    cdf = _zipf_cdf(nr_word, exponent)
+    topic_size = max(1, nr_word // (2 * nr_label))
+    topic_cdf = _zipf_cdf(topic_size, exponent)
+    labels = ['label%d' % k for k in range(nr_label)]
+    for _ in xrange(nr_doc):
+        k = rand.randrange(nr_label)
+        # topic words are taken from the rarer half of the vocabulary
+        topic_start = nr_word // 2 + k * topic_size
+        text = []
+        for _ in xrange(max(1, int(rand.gauss(length, length / 4.0)))):
+            if rand.random() < topic_ratio:
+                text.append(words[min(nr_word - 1, topic_start + bisect.bisect(topic_cdf, rand.random()))])
+            else:
+                text.append(words[min(nr_word - 1, bisect.bisect(cdf, rand.random()))])
+        yield labels[k], ''.join(text)
+
+
+def write_corpus(path, nr_doc=100000, nr_word=20000, nr_label=20, length=12, seed=0):
+    with open(path, 'w') as fout:
+        for label, text in generate_corpus(nr_doc, nr_word, nr_label, length, seed):
+            fout.write('%s\t%s\n' % (label, text))
+
+
+def main(argv):
+    args = [int(arg) for arg in argv[2:7]]
+    write_corpus(argv[1], *args)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Per-call latency of normalizing one test instance, as done by
+:func:`tgrocery.learner.predict_one`.
+
+``python`` is the element-by-element ctypes loop that
+``LearnerProblem.normalize_one`` used to run; ``c`` is the current
+``util.normalize_one`` entry point.
+
+    python benchmarks/normalize_one.py [number of features] [number of calls]
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tgrocery.learner import LearnerParameter
+from tgrocery.learner.learner import LearnerProblem, liblinear
+
+
+def python_normalize_one(xi, learner_param, idf):
+    norm = 0
+    word_count = 0
+    i = 0
+    while xi[i].index != -1:
+        idx = xi[i].index-1
+        if learner_param.binary_feature:
+            xi[i].value = xi[i].value != 0
+
+        word_count += abs(xi[i].value)
+
+        if learner_param.inverse_document_frequency and idx < len(idf):
+            xi[i].value *= idf[idx]
+
+        norm += xi[i].value * xi[i].value
+        i += 1
+
+    norm **= .5
+
+    if learner_param.term_frequency:
+        i = 0
+        while xi[i].index != -1:
+            xi[i].value /= word_count
+            i += 1
+
+    if learner_param.inst_normalization:
+        i = 0
+        while xi[i].index != -1:
+            xi[i].value /= norm
+            i += 1
+
+
+def main(argv):
+    nr_feature = int(argv[1]) if len(argv) > 1 else 30
+    number = int(argv[2]) if len(argv) > 2 else 100000
+    rand = random.Random(0)
+    xi = liblinear.gen_feature_nodearray(
+        dict((j, rand.randint(1, 3)) for j in rand.sample(range(1, 100000), nr_feature)))[0]
+    learner_param = LearnerParameter('', '-s 4')
+
+    print('features per instance: %d, calls: %d' % (nr_feature, number))
+    for name, func in [('python', python_normalize_one), ('c', LearnerProblem.normalize_one)]:
+        seconds = min(timeit.repeat(lambda: func(xi, learner_param, None), repeat=3, number=number))
+        print('%-8s %8.3f us/call' % (name, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Throughput of ``util.read_problem`` on a synthetic LIBSVM-format file.
+
+The file is built by repeating a block of random instances until it
+reaches the requested size (default 100 MB). It is written to a temporary
+directory and removed afterwards, unless *file path* is given, in which
+case it is kept and reused by later runs.
+
+    python benchmarks/read_problem.py [size in MB] [file path]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tgrocery.learner.learner import read_SVMProblem
+
+
+def write_synthetic(path, size, nr_feature=30, nr_index=1000000):
+    rand = random.Random(0)
+    lines = []
+    for i in range(10000):
+        index = sorted(rand.sample(xrange(1, nr_index), nr_feature))
+        lines.append('%d %s\n' % (rand.randint(1, 20), ' '.join(
+            '%d:%s' % (j, rand.choice(['1', '2', '3', '%.6g' % rand.random()])) for j in index)))
+    block = ''.join(lines)
+    with open(path, 'w') as fout:
+        written = 0
+        while written < size:
+            fout.write(block)
+            written += len(block)
+
+
+def main(argv):
+    size = int(argv[1]) * 2 ** 20 if len(argv) > 1 else 100 * 2 ** 20
+    tmp_dir = None
+    if len(argv) > 2:
+        path = argv[2]
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'read_problem.svm')
+    try:
+        if not os.path.exists(path) or os.path.getsize(path) < size:
+            write_synthetic(path, size)
+        size = os.path.getsize(path)
+
+        start = time.time()
+        svmprob = read_SVMProblem(path)
+        seconds = time.time() - start
+        print('%s: %.1f MB, %d instances' % (path, size / 2. ** 20, svmprob.prob.l))
+        print('%.2f s, %.1f MB/s' % (seconds, size / 2. ** 20 / seconds))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Load generator for ``python -m tgrocery.serve``: *concurrency* client
+threads post single texts to ``/predict`` back to back, each on its own
+keep-alive connection, and the client-side latency percentiles and
+throughput are printed along with the server's ``/stats``.
+
+The texts are the lines of *text file*, or synthetic ones if not given.
+
+    python benchmarks/serve_load.py [--host H --port P | --unix-socket PATH]
+                                    [--concurrency 32] [--requests 10000]
+                                    [text file]
+"""
+import argparse
+import httplib
+import json
+import random
+import socket
+import threading
+import time
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def synthetic_texts(n, nr_word=5000, length=15):
+    rand = random.Random(0)
+    vocab = ['w%d' % i for i in xrange(nr_word)]
+    return [' '.join(rand.choice(vocab) for _ in xrange(length)) for _ in xrange(n)]
+
+
+def request(conn, method, path, body=None):
+    conn.request(method, path, body, {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def client(connect, texts, latencies, errors):
+    conn = connect()
+    for text in texts:
+        start = time.time()
+        status, _ = request(conn, 'POST', '/predict', json.dumps({'text': text}))
+        latencies.append(time.time() - start)
+        if status != 200:
+            errors.append(status)
+    conn.close()
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('text_file', nargs='?')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.text_file:
+        with open(args.text_file) as fin:
+            texts = [line.rstrip('\n').split('\t')[-1] for line in fin]
+        texts = [texts[i % len(texts)] for i in xrange(args.requests)]
+    else:
+        texts = synthetic_texts(args.requests)
+    if args.unix_socket:
+        connect = lambda: UnixHTTPConnection(args.unix_socket)
+    else:
+        connect = lambda: httplib.HTTPConnection(args.host, args.port)
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(connect, texts[i::args.concurrency], latencies, errors))
+               for i in xrange(args.concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+
+    latencies.sort()
+    print('%d requests, %d errors, %d clients: %.2f s, %.0f requests/s' % (
+        len(latencies), len(errors), args.concurrency, seconds, len(latencies) / seconds))
+    print('client p50 %.2f ms, p99 %.2f ms' % (percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+    print('server %s' % json.dumps(request(connect(), 'GET', '/stats')[1], sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Startup cost of a fresh process: ``import tgrocery``, loading a saved
+model, and the first and second predictions, each timed in a new
+interpreter. The first prediction pays for jieba's import and
+dictionary unless :func:`tgrocery.warmup` ran before it.
+
+A small model is trained and saved as *model name* if it does not exist.
+
+    python benchmarks/startup.py [--runs 3] [--jieba-cache PATH] [model name]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = r'''# coding: utf-8
+import json, sys, time
+sys.path.insert(0, %(root)r)
+start = time.time()
+import tgrocery
+times = {'import': time.time() - start}
+if %(warmup)r:
+    start = time.time()
+    tgrocery.warmup(%(jieba_cache)r)
+    times['warmup'] = time.time() - start
+elif %(jieba_cache)r:
+    tgrocery.set_jieba_cache(%(jieba_cache)r)
+start = time.time()
+grocery = tgrocery.Grocery(%(model_name)r)
+grocery.load()
+times['load'] = time.time() - start
+for name in ('first_predict', 'second_predict'):
+    start = time.time()
+    grocery.predict('考生必读：新托福写作考试评分标准')
+    times[name] = time.time() - start
+sys.stdout.write(json.dumps(times))
+'''
+
+
+def train_model(model_name):
+    sys.path.insert(0, ROOT)
+    from tgrocery import Grocery
+    train_src = [
+        ('education', '名师指导托福语法技巧：名词的复数形式'),
+        ('education', '中国高考成绩海外认可 是“狼来了”吗？'),
+        ('sports', '图文：法网孟菲尔斯苦战进16强 孟菲尔斯怒吼'),
+        ('sports', '四川丹棱举行全国长距登山挑战赛 近万人参与'),
+    ]
+    grocery = Grocery(model_name)
+    grocery.train(train_src)
+    grocery.save(binary=True)
+
+
+def run_child(model_name, warmup, jieba_cache):
+    code = CHILD % {'root': ROOT, 'model_name': model_name, 'warmup': warmup, 'jieba_cache': jieba_cache}
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.check_output([sys.executable, '-c', code], stderr=devnull)
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_name', nargs='?', default='startup_model')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--jieba-cache')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model_name):
+        train_model(args.model_name)
+    for warmup in (False, True):
+        runs = [run_child(args.model_name, warmup, args.jieba_cache) for _ in range(args.runs)]
+        print('%s (best of %d, ms):' % ('with warmup()' if warmup else 'lazy', args.runs))
+        for name in ('import', 'warmup', 'load', 'first_predict', 'second_predict'):
+            if name in runs[0]:
+                print('  %-15s %8.1f' % (name, min(run[name] for run in runs) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+Throughput of the main stages of tgrocery on a synthetic corpus from
+:mod:`corpus`: text conversion, reading LIBSVM files, training,
+single-text and file-based prediction, testing, and model save/load.
+
+Each benchmark runs in a fresh interpreter, so that its peak RSS is its
+own. The results are printed and, with ``--output``, written as JSON,
+which ``--compare`` reads back to print the speedup of each benchmark.
+
+    python benchmarks/suite.py [--docs 100000] [--vocabulary 20000] [--labels 20]
+                               [--length 12] [--work-dir DIR] [--output FILE]
+                               [--compare FILE] [benchmark ...]
+
+The corpus and the models benchmarks depend on are built once in
+*work dir* (default ``bench_work``) and reused while the corpus
+parameters stay the same.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import write_corpus
+
+
+def _count_lines(src):
+    with open(src) as fin:
+        return sum(1 for _ in fin)
+
+
+def _read_texts(src):
+    with open(src) as fin:
+        return [line.rstrip('\n').split('\t', 1)[1] for line in fin]
+
+
+# Each benchmark returns the number of documents it processed, or None,
+# and the seconds spent in the measured part only.
+
+def bench_convert_text(work, args):
+    from tgrocery import GroceryTextConverter
+    output = os.path.join(work, 'convert_text.svm')
+    start = time.time()
+    GroceryTextConverter().convert_text(os.path.join(work, 'train.txt'), '\t', output=output, n_jobs=args.n_jobs)
+    seconds = time.time() - start
+    os.remove(output)
+    return _count_lines(os.path.join(work, 'train.txt')), seconds
+
+
+def bench_read_problem(work, args):
+    from tgrocery.learner.learner import read_SVMProblem
+    start = time.time()
+    svmprob = read_SVMProblem(os.path.join(work, 'train.svm'))
+    return svmprob.prob.l, time.time() - start
+
+
+def bench_train(work, args):
+    from tgrocery.learner import train
+    start = time.time()
+    train(os.path.join(work, 'train.svm'), '', args.liblinear_opts)
+    return _count_lines(os.path.join(work, 'train.svm')), time.time() - start
+
+
+def bench_predict_text(work, args):
+    from tgrocery import Grocery, warmup
+    texts = _read_texts(os.path.join(work, 'test.txt'))
+    grocery = Grocery(os.path.join(work, 'model'))
+    grocery.load()
+    warmup()
+    start = time.time()
+    for text in texts:
+        grocery.predict(text)
+    return len(texts), time.time() - start
+
+
+def bench_predict(work, args):
+    from tgrocery.learner import LearnerModel, predict
+    m = LearnerModel(os.path.join(work, 'learner'))
+    start = time.time()
+    predicted_y = predict(os.path.join(work, 'test.svm'), m)[0]
+    return len(predicted_y), time.time() - start
+
+
+def bench_test(work, args):
+    from tgrocery import Grocery, warmup
+    grocery = Grocery(os.path.join(work, 'model'))
+    grocery.load()
+    warmup()
+    start = time.time()
+    grocery.test(os.path.join(work, 'test.txt'), n_jobs=args.n_jobs)
+    return _count_lines(os.path.join(work, 'test.txt')), time.time() - start
+
+
+def bench_save(work, args):
+    from tgrocery import Grocery
+    grocery = Grocery(os.path.join(work, 'model'))
+    grocery.load()
+    grocery.name = os.path.join(work, 'model_save')
+    start = time.time()
+    grocery.save(binary=args.binary)
+    seconds = time.time() - start
+    shutil.rmtree(grocery.name)
+    return None, seconds
+
+
+def bench_load(work, args):
+    from tgrocery import Grocery
+    model = os.path.join(work, 'model_binary' if args.binary else 'model')
+    start = time.time()
+    Grocery(model).load()
+    return None, time.time() - start
+
+
+BENCHMARKS = OrderedDict([
+    ('convert_text', bench_convert_text),
+    ('read_problem', bench_read_problem),
+    ('train', bench_train),
+    ('predict_text', bench_predict_text),
+    ('predict', bench_predict),
+    ('test', bench_test),
+    ('save', bench_save),
+    ('load', bench_load),
+])
+
+
+def _corpus_config(args):
+    return {'docs': args.docs, 'vocabulary': args.vocabulary, 'labels': args.labels, 'length': args.length,
+            'liblinear_opts': args.liblinear_opts}
+
+
+def prepare(work, args):
+    """
+    Build the corpus, its LIBSVM files and the models in *work*, unless
+    they were built with the same parameters.
+    """
+    config_file = os.path.join(work, 'config.json')
+    config = _corpus_config(args)
+    if os.path.exists(config_file):
+        with open(config_file) as fin:
+            if json.load(fin) == config:
+                return
+        shutil.rmtree(work)
+    os.makedirs(work)
+
+    from tgrocery import Grocery
+    from tgrocery.learner import train
+    train_txt, test_txt = os.path.join(work, 'train.txt'), os.path.join(work, 'test.txt')
+    write_corpus(train_txt, args.docs, args.vocabulary, args.labels, args.length, seed=0)
+    write_corpus(test_txt, max(1, args.docs // 5), args.vocabulary, args.labels, args.length, seed=1)
+
+    grocery = Grocery(os.path.join(work, 'model'))
+    grocery.train(train_txt, liblinear_opts=args.liblinear_opts, n_jobs=args.n_jobs)
+    grocery.save()
+    grocery.name = os.path.join(work, 'model_binary')
+    grocery.save(binary=True)
+    text_converter = grocery.model.text_converter
+    text_converter.convert_text(train_txt, '\t', output=os.path.join(work, 'train.svm'), n_jobs=args.n_jobs)
+    text_converter.convert_text(test_txt, '\t', output=os.path.join(work, 'test.svm'), n_jobs=args.n_jobs)
+    train(os.path.join(work, 'train.svm'), '', args.liblinear_opts).save(os.path.join(work, 'learner'))
+
+    with open(config_file, 'w') as fout:
+        json.dump(config, fout)
+
+
+def _peak_rss_kb():
+    # ru_maxrss survives execve on Linux, so a child would report the peak
+    # of its parent; VmHWM is that of this process only
+    try:
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    # kilobytes, but bytes on OS X
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def run_child(args):
+    # run in this interpreter, see run_benchmark
+    nr_doc, seconds = BENCHMARKS[args.child](args.work_dir, args)
+    sys.stdout.write('\n' + json.dumps({'docs': nr_doc, 'seconds': seconds, 'peak_rss_mb': _peak_rss_kb() / 1024.0}))
+
+
+def run_benchmark(name, argv):
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', name] + argv,
+                                         stderr=devnull)
+    # LIBLINEAR prints to stdout while training, the result is the last line
+    result = json.loads(output.splitlines()[-1])
+    result['wall_seconds'] = time.time() - start
+    result['docs_per_sec'] = result['docs'] / result['seconds'] if result['docs'] and result['seconds'] else None
+    return result
+
+
+def show(results, baseline=None):
+    print('%-14s %10s %12s %10s %10s %12s%s' % ('benchmark', 'docs', 'docs/sec', 'seconds', 'wall', 'peak RSS MB',
+                                               '  speedup' if baseline else ''))
+    for name, result in results.items():
+        line = '%-14s %10s %12s %10.3f %10.3f %12.1f' % (
+            name, result['docs'] if result['docs'] is not None else '-',
+            '%.0f' % result['docs_per_sec'] if result['docs_per_sec'] else '-',
+            result['seconds'], result['wall_seconds'], result['peak_rss_mb'])
+        if baseline and name in baseline and result['seconds']:
+            line += '  %7.2fx' % (baseline[name]['seconds'] / result['seconds'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*', help='default: all of %s' % ', '.join(BENCHMARKS))
+    parser.add_argument('--docs', type=int, default=100000, help='training documents; the test set has a fifth')
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--labels', type=int, default=20)
+    parser.add_argument('--length', type=int, default=12, help='mean words per text')
+    parser.add_argument('--liblinear-opts', default='-s 4')
+    parser.add_argument('--n-jobs', type=int, default=1)
+    parser.add_argument('--binary', action='store_true', help='save and load binary models')
+    parser.add_argument('--work-dir', default='bench_work')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args)
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmarks: %s' % ', '.join(unknown))
+    args.work_dir = os.path.abspath(args.work_dir)
+    prepare(args.work_dir, args)
+
+    argv = ['--work-dir', args.work_dir, '--liblinear-opts', args.liblinear_opts, '--n-jobs', str(args.n_jobs)]
+    if args.binary:
+        argv.append('--binary')
+    results = OrderedDict((name, run_benchmark(name, argv)) for name in names)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)['results']
+    show(results, baseline)
+    if args.output:
+        report = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': dict(_corpus_config(args), n_jobs=args.n_jobs, binary=args.binary),
+            'results': results,
+        }
+        with open(args.output, 'w') as fout:
+            json.dump(report, fout, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,14 @@
 import unittest
 import os
 import shutil
+import struct
+import threading
 
 from tgrocery import Grocery
+from tgrocery.base import GroceryPredictCache
+from tgrocery.classifier import GroceryTest
+from tgrocery.converter import GroceryNgramIndex, GroceryTextConverter
+from tgrocery.learner import LearnerProblemBuffer, train
 
 
 class GroceryTestCase(unittest.TestCase):
@@ -29,6 +35,375 @@ class GroceryTestCase(unittest.TestCase):
         if self.grocery_name and os.path.exists(self.grocery_name):
             shutil.rmtree(self.grocery_name)
 
+    def test_predict_batch(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src)
+        texts = ['考生必读：新托福写作考试评分标准', '法网孟菲尔斯苦战']
+        result = grocery.predict_batch(texts, dec_values=True)
+        assert len(result) == len(texts)
+        for i, text in enumerate(texts):
+            single = grocery.predict(text)
+            assert result[i].predicted_y == single.predicted_y
+            assert result[i].dec_values == single.dec_values
+        assert list(grocery.predict_batch(texts)) == result.predicted_y
+
+    def test_bad_instances(self):
+        self.assertRaises(ValueError, LearnerProblemBuffer().append, {0: 1.0}, 1)
+        from tgrocery.learner.learner import build_SVMProblem
+        for i in range(100):
+            buf = LearnerProblemBuffer()
+            buf.append({1: 1.0, 2: 1.0}, 1)
+            buf.index[1] = 1
+            self.assertRaises(ValueError, build_SVMProblem, buf)
+        # the bias term keeps rows sorted by index, before unseen features
+        buf = LearnerProblemBuffer()
+        buf.append({1: 1.0, 5: 1.0}, 1)
+        buf.append({2: 1.0}, 1)
+        svmprob = build_SVMProblem(buf, bias=1, bias_index=3)
+        assert [node.index for node in svmprob.prob.x[0][:4]] == [1, 3, 5, -1]
+        assert [node.index for node in svmprob.prob.x[1][:3]] == [2, 3, -1]
+        assert svmprob.prob.n == 5
+
+    def test_predict_file_idf(self):
+        from tgrocery.learner import predict, predict_batch
+        buf = LearnerProblemBuffer()
+        for i in range(20):
+            buf.append({1 + i % 3: 1.0, 4 + i % 2: 2.0}, i % 2)
+        m = train(buf, '-I 1', '-s 1 -q')
+        xs = [{1: 1.0, 9: 3.0}, {2: 1.0, 5: 1.0, 700: 2.0}]
+        # features unseen in training are beyond the idf of the model
+        test_file = '%s_idf.svm' % self.grocery_name
+        with open(test_file, 'w') as fout:
+            for x in xs:
+                fout.write('0 %s\n' % ' '.join('%d:%s' % (j, x[j]) for j in sorted(x)))
+        labels, dec_values = predict_batch(xs, m, dec_values=True)
+        predicted_y, _, file_dec_values, _ = predict(test_file, m)
+        assert predicted_y == list(labels)
+        for i in range(len(xs)):
+            for k in range(m.nr_class):
+                self.assertAlmostEqual(file_dec_values[i][k], dec_values[i * m.nr_class + k])
+        os.remove(test_file)
+
+    def test_train_svm_file(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src, svm_file=True)
+        assert os.path.exists(grocery.train_svm_file)
+        in_memory = Grocery(self.grocery_name)
+        in_memory.train(self.train_src)
+        assert in_memory.train_svm_file is None
+        text = '考生必读：新托福写作考试评分标准'
+        assert grocery.predict(text).predicted_y == in_memory.predict(text).predicted_y
+
+    def test_n_jobs(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src)
+        parallel = Grocery(self.grocery_name)
+        parallel.train(self.train_src, n_jobs=2)
+        assert parallel.model.text_converter.text_prep.tok2idx == grocery.model.text_converter.text_prep.tok2idx
+        assert list(parallel.model.text_converter.feat_gen.ngram2fidx.iteritems()) == \
+            list(grocery.model.text_converter.feat_gen.ngram2fidx.iteritems())
+        assert parallel.test(self.train_src, n_jobs=2).accuracy_overall == grocery.test(self.train_src).accuracy_overall
+
+    def test_concurrent_train(self):
+        groceries = [Grocery('%s_%d' % (self.grocery_name, i)) for i in range(4)]
+        threads = [threading.Thread(target=g.train, args=(self.train_src,), kwargs={'svm_file': True})
+                for g in groceries]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src)
+        for label, text in self.train_src:
+            for g in groceries:
+                assert g.predict(text).predicted_y == grocery.predict(text).predicted_y
+
+    def test_streaming(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src)
+        test_src = self.train_src * 3 + [('sports', '考生必读：新托福写作考试评分标准')]
+        result = grocery.test(test_src)
+        streaming = GroceryTest(grocery.model).test(test_src, '\t', streaming=True, chunk_size=2)
+        assert streaming.true_y is None and streaming.predicted_y is None
+        assert streaming.accuracy_overall == result.accuracy_overall
+        assert streaming.accuracy_labels == result.accuracy_labels
+        assert streaming.recall_labels == result.recall_labels
+
+    def test_metrics(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src)
+        result = grocery.test(self.train_src + [('sports', '考生必读：新托福写作考试评分标准')], top_k=2)
+        matrix = result.confusion_matrix
+        assert matrix.nr_instance() == 5 and matrix['sports', 'education'] == 1
+        assert result.recall_labels['sports'] == 2 / 3.
+        assert result.f1_labels['sports'] == 0.8
+        assert result.top_k_accuracy(1) == result.accuracy_overall == matrix.micro_average()[0]
+        assert result.top_k_accuracy(2) == 1
+
+    def test_nr_thread(self):
+        buf = LearnerProblemBuffer()
+        for i in range(60):
+            buf.append({i % 3 * 10 + 1: 1, i % 7 + 40: 1, i % 5 + 50: 1}, i % 3)
+        for liblinear_opts in ('-s 0', '-s 1'):
+            serial = train(buf, '', liblinear_opts + ' -q')
+            parallel = train(buf, '', liblinear_opts + ' -q -n 3')
+            size = serial.nr_feature * serial.nr_class
+            assert serial.w[:size] == parallel.w[:size]
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src, liblinear_opts='-s 1 -n 3')
+        assert grocery.model.svm_model.learner_param.nr_thread == 3
+        grocery.train(self.train_src, liblinear_opts='-s 1 -n 3', nr_thread=2)
+        assert grocery.model.svm_model.learner_param.nr_thread == 2
+
+    def test_predict_topk(self):
+        grocery = Grocery(self.grocery_name)
+        texts = ['考生必读：新托福写作考试评分标准', '法网孟菲尔斯苦战', '全新词汇']
+        # two classes, where an all-unseen text is a tie, and three
+        for train_src in (self.train_src, self.train_src + [('finance', '央行宣布降息 股市应声上涨')]):
+            for liblinear_opts in ('-s 4', '-s 1'):
+                grocery.train(train_src, liblinear_opts=liblinear_opts)
+                result = grocery.predict_batch(texts, dec_values=True)
+                topk = grocery.predict_topk(texts, k=2)
+                for i, text in enumerate(texts):
+                    dec_values = result[i].dec_values
+                    best = sorted(dec_values.values(), reverse=True)[:2]
+                    for (label, score), best_score in zip(topk[i], best):
+                        self.assertAlmostEqual(score, best_score)
+                        self.assertAlmostEqual(score, dec_values[label])
+                    assert topk[i][0][0] == result.predicted_y[i]
+                    assert grocery.predict(text).predicted_y == result.predicted_y[i]
+
+    def test_quantize(self):
+        texts = ['考生必读：新托福写作考试评分标准', '法网孟菲尔斯苦战', '全新词汇']
+        for liblinear_opts in ('-s 4', '-s 1 -B 1'):
+            grocery = Grocery(self.grocery_name)
+            grocery.train(self.train_src, liblinear_opts=liblinear_opts)
+            expected = grocery.predict_batch(texts, dec_values=True)
+            for weights in ('float32', 'int8'):
+                grocery.train(self.train_src, liblinear_opts=liblinear_opts)
+                report = grocery.quantize(weights, test_src=self.train_src)
+                assert report.agreement == 1 and report.accuracy_delta == 0
+                grocery.save()
+                grocery = Grocery(self.grocery_name)
+                grocery.load()
+                assert grocery.model.svm_model.quantized.kind == weights
+                result = grocery.predict_batch(texts, dec_values=True)
+                assert result.predicted_y == expected.predicted_y
+                assert grocery.predict(texts[1]).predicted_y == expected.predicted_y[1]
+                for a, b in zip(result.dec_values, expected.dec_values):
+                    self.assertAlmostEqual(a, b, places=1)
+        # cleanup
+        if self.grocery_name and os.path.exists(self.grocery_name):
+            shutil.rmtree(self.grocery_name)
+
+    def test_predict_cache(self):
+        texts = ['考生必读：新托福写作考试评分标准', '法网孟菲尔斯苦战', u'法网孟菲尔斯苦战']
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src)
+        expected = grocery.predict_batch(texts, dec_values=True)
+        grocery = Grocery(self.grocery_name, cache_size=2)
+        grocery.train(self.train_src)
+        result = grocery.predict_batch(texts, dec_values=True)
+        assert result.predicted_y == expected.predicted_y
+        assert list(result.dec_values) == list(expected.dec_values)
+        assert grocery.predict(texts[1]).predicted_y == expected.predicted_y[1]
+        assert grocery.cache_stats()['hits'] == 1 and grocery.cache_stats()['misses'] == 3
+        grocery.predict('全新词汇')
+        assert grocery.cache_stats()['evictions'] == 1 and grocery.cache_stats()['size'] == 2
+        grocery.save()
+        grocery.load()
+        assert grocery.cache_stats()['size'] == 0
+        assert grocery.predict(texts[0]).predicted_y == expected.predicted_y[0]
+        # the least recently used entry is evicted first
+        cache = GroceryPredictCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+        # cleanup
+        if self.grocery_name and os.path.exists(self.grocery_name):
+            shutil.rmtree(self.grocery_name)
+
+    def test_grid_search(self):
+        grocery = Grocery(self.grocery_name)
+        train_src = self.train_src * 3
+        result = grocery.cross_validate(train_src, nr_fold=3)
+        assert len(result.fold_accuracy) == len(result.fold_seconds) == 3
+        assert 0 <= result.accuracy <= 1 and grocery.model is None
+        results = grocery.grid_search(train_src, ['-s 4', '-s 1 -c 0.5', '-s 1 -B 1'], nr_fold=3, nr_thread=3)
+        assert results[0].fold_accuracy == result.fold_accuracy
+        assert [r.liblinear_opts for r in results] == ['-s 4', '-s 1 -c 0.5', '-s 1 -B 1']
+
+    def test_warm_start(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src, liblinear_opts='-s 2')
+        grocery.save(binary=True)
+        grocery = Grocery(self.grocery_name)
+        grocery.load()
+        tok2idx = dict(grocery.model.text_converter.text_prep.tok2idx.iteritems())
+        old_model = grocery.model
+        nr_ngram = len(old_model.text_converter.feat_gen.ngram2fidx)
+        train_src = self.train_src + [('finance', '央行宣布降息 股市应声上涨')]
+        self.assertRaises(ValueError, grocery.train, train_src, liblinear_opts='-s 99', warm_start=True)
+        assert grocery.model is old_model
+        grocery.train(train_src, liblinear_opts='-s 2', warm_start=True)
+        text_prep = grocery.model.text_converter.text_prep
+        assert all(text_prep.tok2idx[tok] == idx for tok, idx in tok2idx.iteritems())
+        # the previous model is left frozen and unchanged
+        assert old_model.text_converter.text_prep.frozen
+        assert len(old_model.text_converter.text_prep.tok2idx) == len(tok2idx)
+        assert len(old_model.text_converter.feat_gen.ngram2fidx) == nr_ngram
+        assert old_model.text_converter.text_prep.idx2tok is None
+        assert old_model.text_converter.feat_gen.fidx2ngram is None
+        assert grocery.predict('法网孟菲尔斯苦战').predicted_y == 'sports'
+        assert grocery.predict('央行降息').predicted_y == 'finance'
+        # cleanup
+        if self.grocery_name and os.path.exists(self.grocery_name):
+            shutil.rmtree(self.grocery_name)
+
+    def test_warm_start_pruning(self):
+        grocery = Grocery(self.grocery_name)
+        train_src = self.train_src + [('finance', '央行宣布降息 股市应声上涨')]
+        grocery.train(train_src, liblinear_opts='-s 2')
+        old_model = grocery.model
+        old_ids = dict(old_model.text_converter.feat_gen.ngram2fidx.iteritems())
+        # the weights of known n-grams follow their new ids
+        train_src = train_src * 2 + [('finance', '央行降息')]
+        text_converter = old_model.text_converter.copy().freeze(False)
+        text_converter, _, remap = grocery._convert(train_src, '\t', False, 1, text_converter, {'min_df': 3})
+        max_fidx = text_converter.feat_gen.max_fidx
+        init_model = old_model.svm_model.remap_features(remap, max_fidx)
+        nr_moved = 0
+        for ngram, fidx in text_converter.feat_gen.ngram2fidx.iteritems():
+            old_fidx = old_ids.get(ngram, 0)
+            if fidx <= max_fidx and 0 < old_fidx <= old_model.svm_model.nr_feature:
+                nr_moved += fidx != old_fidx
+                for k in init_model.get_labels():
+                    assert init_model.get_weight(fidx, k) == old_model.svm_model.get_weight(old_fidx, k)
+        assert nr_moved > 0
+        grocery.train(train_src, liblinear_opts='-s 2', warm_start=True, min_df=3)
+        assert grocery.predict('央行降息').predicted_y == 'finance'
+        assert old_model.predict_text('央行降息').predicted_y == 'finance'
+
+    def test_train_online(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train_online(self.train_src, batch_size=3)
+        assert grocery.predict('名师指导托福语法技巧').predicted_y == 'education'
+        assert grocery.predict('法网孟菲尔斯苦战').predicted_y == 'sports'
+        grocery.save()
+        grocery = Grocery(self.grocery_name)
+        grocery.load()
+        grocery.train_online([('finance', '央行宣布降息 股市应声上涨')], warm_start=True)
+        assert grocery.predict('央行降息').predicted_y == 'finance'
+        assert grocery.predict('法网孟菲尔斯苦战').predicted_y == 'sports'
+        # cleanup
+        if self.grocery_name and os.path.exists(self.grocery_name):
+            shutil.rmtree(self.grocery_name)
+
+    def test_hashing(self):
+        grocery = Grocery(self.grocery_name, hash_bits=10)
+        grocery.train(self.train_src)
+        text_converter = grocery.model.text_converter
+        assert len(text_converter.text_prep.tok2idx) == 1
+        assert all(0 < f <= 2 ** 10 for f in text_converter.to_svm('从未见过的全新词汇组合'))
+        stats = grocery.hashing_stats()
+        assert 0 < stats['nr_bucket_used'] <= stats['nr_ngram'] and 0 <= stats['collision_rate'] < 1
+        texts = ['考生必读：新托福写作考试评分标准', '法网孟菲尔斯苦战']
+        for binary in (False, True):
+            grocery.save(binary=binary)
+            assert not os.path.exists(os.path.join(self.grocery_name, 'converter', 'text_prep.config.pickle'))
+            new_grocery = Grocery(self.grocery_name)
+            new_grocery.load()
+            assert new_grocery.model.text_converter.hash_bits == 10
+            assert new_grocery.hashing_stats() == stats
+            for text in texts:
+                dec_values, new_dec_values = grocery.predict(text).dec_values, new_grocery.predict(text).dec_values
+                for label in dec_values:
+                    self.assertAlmostEqual(dec_values[label], new_dec_values[label])
+        # cleanup
+        if self.grocery_name and os.path.exists(self.grocery_name):
+            shutil.rmtree(self.grocery_name)
+
+    def test_pruning(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src * 2 + [('sports', '法网 孟菲尔斯')], min_df=3, max_features=10)
+        feat_gen = grocery.model.text_converter.feat_gen
+        assert grocery.model.svm_model.nr_feature <= feat_gen.max_fidx <= 10
+        assert grocery.predict('法网孟菲尔斯').predicted_y == 'sports'
+        feat = grocery.model.text_converter.to_svm('法网孟菲尔斯')
+        assert feat and all(f <= feat_gen.max_fidx for f in feat)
+        grocery.save()
+        new_grocery = Grocery(self.grocery_name)
+        new_grocery.load()
+        assert new_grocery.model.text_converter.to_svm('法网孟菲尔斯') == feat
+        # cleanup
+        if self.grocery_name and os.path.exists(self.grocery_name):
+            shutil.rmtree(self.grocery_name)
+
+    def test_ngram_orders(self):
+        text = '法网孟菲尔斯苦战'
+        bigram = GroceryTextConverter().to_svm(text)
+        converter = GroceryTextConverter(ngram_order=3, char_order=2)
+        feat = converter.to_svm(text)
+        assert len(feat) > len(bigram)
+        # with 2 hashed ids words and characters collide, and their counts add up
+        converter = GroceryTextConverter(hash_bits=1, char_order=2)
+        tokens, chars = converter.analyze(text, None, 2)
+        words, chars = converter._ngrams(tokens, 2), converter._ngrams(chars, 2)
+        feat = converter.to_svm(text)
+        assert all(feat[j] == words.get(j, 0) + chars.get(j, 0) for j in set(words) | set(chars))
+        # -1, the id of unseen tokens, is also the key of empty slots
+        ngram_index = GroceryNgramIndex()
+        ngram_index[(5,)] = 1
+        assert ngram_index.get((-1, 5)) is None and ngram_index.get((5,)) == 1
+        self.assertRaises(KeyError, ngram_index.__setitem__, (-1,), 2)
+        # a tuple of tokens is tokens, not (tokens, chars)
+        assert converter.tokens_to_svm(('法网', '孟菲尔斯')) == converter.tokens_to_svm(['法网', '孟菲尔斯'])
+        grocery = Grocery(self.grocery_name, ngram_order=3, char_order=2)
+        grocery.train(self.train_src)
+        assert grocery.predict(text).predicted_y == 'sports'
+        grocery.save()
+        new_grocery = Grocery(self.grocery_name)
+        new_grocery.load()
+        new_converter = new_grocery.model.text_converter
+        assert (new_converter.ngram_order, new_converter.char_order) == (3, 2)
+        assert new_converter.to_svm(text) == grocery.model.text_converter.to_svm(text)
+        # cleanup
+        if self.grocery_name and os.path.exists(self.grocery_name):
+            shutil.rmtree(self.grocery_name)
+
+    def test_frozen_vocabulary(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src)
+        text_converter = grocery.model.text_converter
+        n_tok = len(text_converter.text_prep.tok2idx)
+        n_ngram = len(text_converter.feat_gen.ngram2fidx)
+        grocery.predict('考生必读：新托福写作考试评分标准')
+        assert len(text_converter.text_prep.tok2idx) == n_tok
+        assert len(text_converter.feat_gen.ngram2fidx) == n_ngram
+        assert all(f < n_ngram for f in text_converter.to_svm('从未见过的全新词汇组合'))
+
+    def test_binary_model(self):
+        grocery = Grocery(self.grocery_name)
+        grocery.train(self.train_src)
+        grocery.save(binary=True)
+        new_grocery = Grocery(self.grocery_name)
+        new_grocery.load()
+        for text in ('考生必读：新托福写作考试评分标准', '法网孟菲尔斯苦战', '全新词汇'):
+            result, new_result = grocery.predict(text), new_grocery.predict(text)
+            assert result.predicted_y == new_result.predicted_y
+            assert result.dec_values == new_result.dec_values
+        # a file of another version is refused, whatever arrays it holds
+        feat_gen = os.path.join(self.grocery_name, 'converter', 'feat_gen.bin')
+        with open(feat_gen, 'r+b') as f:
+            f.seek(8)
+            f.write(struct.pack('=q', 0))
+        self.assertRaises(ValueError, Grocery(self.grocery_name).load)
+        # cleanup
+        if self.grocery_name and os.path.exists(self.grocery_name):
+            shutil.rmtree(self.grocery_name)
+
 
 if __name__ == 'main':
     unittest.main()
\ No newline at end of file
@@ -1,7 +1,8 @@
 from converter import *
 from classifier import *
+from .learner.learner import print_debug
 
-__all__ = ['Grocery']
+__all__ = ['Grocery', 'warmup', 'set_jieba_cache']
 
 
 class GroceryException(Exception):
@@ -14,45 +15,228 @@ class GroceryNotTrainException(GroceryException):
 
 
 class Grocery(object):
-    def __init__(self, name, custom_tokenize=None):
+    def __init__(self, name, custom_tokenize=None, hash_bits=0, ngram_order=2, char_order=0, cache_size=0,
+                 cache_ttl=None):
+        """
+        If *hash_bits* is positive, models are trained in hashing mode:
+        n-grams are hashed to 2^*hash_bits* features and no vocabulary is
+        kept, so memory and model size are bounded ahead of time. How many
+        n-grams share a feature is returned by :meth:`hashing_stats`.
+
+        Models are trained on word 1..*ngram_order*-grams and, if
+        *char_order* is positive, character 1..*char_order*-grams, see
+        :class:`GroceryTextConverter`.
+
+        If *cache_size* is positive, the predictions of up to *cache_size*
+        texts are kept in a :class:`GroceryPredictCache`, for at most
+        *cache_ttl* seconds if given. It is cleared whenever the model is
+        trained, loaded or quantized.
+        """
         self.name = name
         if custom_tokenize is not None and not hasattr(custom_tokenize, '__call__'):
             raise GroceryException('Tokenize func must be callable.')
         self.custom_tokenize = custom_tokenize
+        self.hash_bits = hash_bits
+        self.ngram_order = ngram_order
+        self.char_order = char_order
         self.model = None
+        self.cache = GroceryPredictCache(cache_size, cache_ttl) if cache_size > 0 else None
         self.classifier = None
         self.train_svm_file = None
 
     def get_load_status(self):
         return self.model is not None and isinstance(self.model, GroceryTextModel)
 
-    def train(self, train_src, delimiter='\t'):
-        text_converter = GroceryTextConverter(custom_tokenize=self.custom_tokenize)
-        self.train_svm_file = '%s_train.svm' % self.name
-        text_converter.convert_text(train_src, output=self.train_svm_file, delimiter=delimiter)
-        # default parameter
-        model = train(self.train_svm_file, '', '-s 4')
-        self.model = GroceryTextModel(text_converter, model)
+    def _set_model(self, model):
+        model.cache = self.cache
+        if self.cache is not None:
+            self.cache.clear()
+        self.model = model
+
+    def _new_converter(self):
+        return GroceryTextConverter(custom_tokenize=self.custom_tokenize, hash_bits=self.hash_bits,
+                                    ngram_order=self.ngram_order, char_order=self.char_order)
+
+    def _convert(self, train_src, delimiter, svm_file, n_jobs, text_converter=None, pruning=None):
+        # also return the renumbering of the features by pruning, if any
+        if text_converter is None:
+            text_converter = self._new_converter()
+        if pruning and text_converter.hash_bits:
+            raise GroceryException('Features can not be pruned in hashing mode.')
+        if svm_file and not pruning:
+            # keep the LIBSVM-format data on disk, mainly for debugging
+            self.train_svm_file = '%s_train.svm' % self.name
+            text_converter.convert_text(train_src, output=self.train_svm_file, delimiter=delimiter, n_jobs=n_jobs)
+            return text_converter, self.train_svm_file, None
+        train_data = LearnerProblemBuffer()
+        for feat, label in text_converter.iter_svm(train_src, delimiter, n_jobs):
+            train_data.append(feat, label)
+        remap = None
+        if pruning:
+            # document frequencies are only known after a whole pass
+            remap = text_converter.feat_gen.prune(train_data, **pruning)
+            if svm_file:
+                self.train_svm_file = '%s_train.svm' % self.name
+                train_data.save(self.train_svm_file)
+                train_data = self.train_svm_file
+        return text_converter, train_data, remap
+
+    @staticmethod
+    def _report_hashing(text_converter):
+        if not text_converter.hash_bits:
+            return
+        stats = text_converter.feat_gen.collision_stats()
+        print_debug('Feature hashing: {0} of {1} ids used by ~{2:.0f} n-grams, collision rate {3:.2%}'.format(
+            stats['nr_bucket_used'], stats['nr_bucket'], stats['nr_ngram'], stats['collision_rate']))
+
+    def train(self, train_src, delimiter='\t', svm_file=False, n_jobs=1, nr_thread=None, liblinear_opts='-s 4',
+              warm_start=False, min_df=1, max_df=1.0, max_features=None):
+        """
+        Train a model on *train_src*.
+
+        The classes of the one-vs-rest solvers are trained in *nr_thread*
+        threads, which if given overrides any ``-n`` in *liblinear_opts*.
+        Crammer-Singer (``-s 4``, the default) optimizes all classes
+        jointly, as does any solver with two classes, and runs in a single
+        thread whatever *nr_thread*.
+
+        Features whose document frequencies are below *min_df* or above
+        *max_df*, and beyond the *max_features* most frequent ones, are
+        pruned before training, see
+        :meth:`tgrocery.converter.GroceryFeatureGenerator.prune`.
+
+        With *warm_start*, the trained or loaded model is retrained on
+        *train_src*, which should be the whole updated corpus: the ids of
+        known tokens, n-grams and classes are kept, new ones are appended
+        (pruning then renumbers the n-grams, and the previous weights with
+        them), and the primal solvers (``-s 0``, ``-s 2`` and ``-s 11``)
+        start from the previous weights so that they converge in fewer
+        iterations.
+        The other solvers keep the ids but train from scratch.
+        """
+        text_converter = init_model = None
+        if warm_start and self.get_load_status():
+            # the current model keeps predicting with its own converter
+            text_converter = self.model.text_converter.copy().freeze(False)
+            init_model = self.model.svm_model
+        pruning = None
+        if (min_df, max_df, max_features) != (1, 1.0, None):
+            pruning = {'min_df': min_df, 'max_df': max_df, 'max_features': max_features}
+        text_converter, train_data, remap = self._convert(train_src, delimiter, svm_file, n_jobs, text_converter,
+                                                          pruning)
+        if init_model is not None and remap is not None:
+            # pruning renumbers known n-grams too
+            init_model = init_model.remap_features(remap, text_converter.feat_gen.max_fidx)
+        self._report_hashing(text_converter)
+        if nr_thread is not None:
+            liblinear_opts = '%s -n %d' % (liblinear_opts, nr_thread)
+        model = train(train_data, '', liblinear_opts, init_model)
+        self._set_model(GroceryTextModel(text_converter.freeze(), model))
         return self
 
+    def train_online(self, train_src, delimiter='\t', n_jobs=1, liblinear_opts='', batch_size=10000,
+                     warm_start=False):
+        """
+        Train a model on *train_src* by one pass of online passive-aggressive
+        updates, see :class:`tgrocery.learner.LearnerOnlineTrainer`. The
+        texts are streamed *batch_size* at a time, so the corpus does not
+        have to fit in memory.
+
+        With *warm_start*, the trained or loaded model is updated with
+        *train_src* only, which must have been trained online as well.
+        """
+        text_converter = self._new_converter()
+        init_model = None
+        if warm_start and self.get_load_status():
+            # the current model keeps predicting with its own converter
+            text_converter = self.model.text_converter.copy().freeze(False)
+            init_model = self.model.svm_model
+        instances = text_converter.iter_svm(train_src, delimiter, n_jobs)
+        model = train_online(instances, '', liblinear_opts, init_model, batch_size)
+        self._report_hashing(text_converter)
+        self._set_model(GroceryTextModel(text_converter.freeze(), model))
+        return self
+
+    def cross_validate(self, train_src, nr_fold=5, delimiter='\t', n_jobs=1, nr_thread=1, liblinear_opts='-s 4'):
+        return self.grid_search(train_src, [liblinear_opts], nr_fold, delimiter, n_jobs, nr_thread)[0]
+
+    def grid_search(self, train_src, liblinear_opts_list, nr_fold=5, delimiter='\t', n_jobs=1, nr_thread=1):
+        """
+        Cross validate each of the LIBLINEAR parameters in *liblinear_opts_list*,
+        e.g. ``['-s 4 -c %g' % c for c in (0.1, 1, 10)]``, and return a
+        :class:`GroceryCrossValidationResult` for each. *train_src* is
+        converted once, and the folds of all settings are trained in
+        *nr_thread* threads. The trained model, if any, is left as is.
+        """
+        text_converter, train_data, _ = self._convert(train_src, delimiter, False, n_jobs)
+        results = grid_search(train_data, '', liblinear_opts_list, nr_fold, nr_thread)
+        return [GroceryCrossValidationResult(liblinear_opts, *zip(*folds))
+                for liblinear_opts, folds in zip(liblinear_opts_list, results)]
+
+    def quantize(self, weights='int8', test_src=None, delimiter='\t', n_jobs=1):
+        """
+        Store the weights of the model as *weights*, ``'float32'`` or
+        ``'int8'`` scaled per label, which takes 2 or 8 times less memory
+        and disk space; :meth:`save` then always writes a binary model.
+
+        If *test_src* is given, return a :class:`GroceryQuantizationResult`
+        comparing the predictions on it before and after.
+        """
+        if not self.get_load_status():
+            raise GroceryNotTrainException()
+        model = self.model.quantize(weights)
+        result = None
+        if test_src is not None:
+            reference = GroceryTest(self.model).test(test_src, delimiter, n_jobs)
+            result = GroceryQuantizationResult(reference, GroceryTest(model).test(test_src, delimiter, n_jobs))
+        self._set_model(model)
+        return result
+
+    def hashing_stats(self):
+        """
+        Return the collision statistics of a model trained in hashing mode,
+        see :meth:`tgrocery.converter.GroceryFeatureHasher.collision_stats`,
+        or ``None`` for other models or if they are unknown.
+        """
+        if not self.get_load_status() or not self.model.text_converter.hash_bits:
+            return None
+        return self.model.text_converter.feat_gen.collision_stats()
+
+    def cache_stats(self):
+        """
+        Return the hit, miss and eviction counts of the prediction cache,
+        see :meth:`GroceryPredictCache.stats`, or ``None`` without a cache.
+        """
+        return self.cache.stats() if self.cache is not None else None
+
     def predict(self, single_text):
         if not self.get_load_status():
             raise GroceryNotTrainException()
         return self.model.predict_text(single_text)
 
-    def test(self, text_src, delimiter='\t'):
+    def predict_batch(self, texts, dec_values=False):
+        if not self.get_load_status():
+            raise GroceryNotTrainException()
+        return self.model.predict_texts(texts, dec_values)
+
+    def predict_topk(self, texts, k=3):
+        if not self.get_load_status():
+            raise GroceryNotTrainException()
+        return self.model.predict_texts_topk(texts, k)
+
+    def test(self, text_src, delimiter='\t', n_jobs=1, streaming=False, top_k=0):
         if not self.get_load_status():
             raise GroceryNotTrainException()
-        return GroceryTest(self.model).test(text_src, delimiter)
+        return GroceryTest(self.model).test(text_src, delimiter, n_jobs, streaming, top_k=top_k)
 
-    def save(self):
+    def save(self, binary=False):
         if not self.get_load_status():
             raise GroceryNotTrainException()
-        self.model.save(self.name, force=True)
+        self.model.save(self.name, force=True, binary=binary)
 
     def load(self):
         text_converter = GroceryTextConverter(custom_tokenize=self.custom_tokenize)
-        self.model = GroceryTextModel(text_converter)
+        self._set_model(GroceryTextModel(text_converter))
         self.model.load(self.name)
 
     def __del__(self):
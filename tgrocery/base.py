@@ -1,46 +1,137 @@
+import threading
+import time
+
+from metrics import GroceryConfusionMatrix
+
+
+def _iter_lines(file_name, delimiter):
+    with open(file_name, 'r') as f:
+        for line in f:
+            yield line.split(delimiter)
+
+
 def read_text_src(text_src, delimiter):
+    # a file is read lazily, line by line
     if isinstance(text_src, str):
-        with open(text_src, 'r') as f:
-            text_src = [line.split(delimiter) for line in f]
+        text_src = _iter_lines(text_src, delimiter)
     elif not isinstance(text_src, list):
         raise TypeError('text_src should be list or str')
     return text_src
 
 
+class GroceryPredictCache(object):
+    def __init__(self, max_size=10000, ttl=None):
+        """
+        A thread-safe LRU cache of at most *max_size* entries, which also
+        expire *ttl* seconds after being put if *ttl* is given.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> [prev, next, key, value, expire time], linked from the least
+        # to the most recently used around the sentinel self.root
+        self.entries = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, None]
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def _unlink(self, link):
+        link[0][1], link[1][0] = link[1], link[0]
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0], link[1] = last, self.root
+        last[1] = self.root[0] = link
+
+    def get(self, key):
+        """
+        Return the value of *key*, or ``None`` if it is not cached.
+        """
+        with self.lock:
+            link = self.entries.get(key)
+            if link is not None and self.ttl is not None and link[4] < time.time():
+                self._unlink(link)
+                del self.entries[key]
+                self.expirations += 1
+                link = None
+            if link is None:
+                self.misses += 1
+                return None
+            # moved to the most recently used end
+            self._unlink(link)
+            self._append(link)
+            self.hits += 1
+            return link[3]
+
+    def put(self, key, value):
+        with self.lock:
+            link = self.entries.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+            expire_time = time.time() + self.ttl if self.ttl is not None else None
+            link = self.entries[key] = [None, None, key, value, expire_time]
+            self._append(link)
+            while len(self.entries) > self.max_size:
+                oldest = self.root[1]
+                self._unlink(oldest)
+                del self.entries[oldest[2]]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.root[:] = [self.root, self.root, None, None, None]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class GroceryTestResult(object):
-    def __init__(self, true_y, predicted_y):
+    def __init__(self, true_y=None, predicted_y=None, top_k=0):
+        """
+        A result built without *true_y* and *predicted_y* only keeps
+        a confusion matrix, which :meth:`update` adds to chunk by chunk.
+        """
         self.true_y = true_y
         self.predicted_y = predicted_y
-        self._compute_accuracy_overall()
-        self._compute_accuracy_recall_labels()
-
-    def _compute_accuracy_overall(self):
-        l = len(self.true_y)
-        self.accuracy_overall = sum([self.true_y[i] == self.predicted_y[i] for i in range(l)]) / float(l)
-
-    def _compute_accuracy_recall_labels(self):
-        labels = {}
-        for idx, predicted_label in enumerate(self.predicted_y):
-            true_label = self.true_y[idx]
-            if predicted_label not in labels:
-                labels[predicted_label] = [0, 0, 0]
-            if true_label not in labels:
-                labels[true_label] = [0, 0, 0]
-            if predicted_label == true_label:
-                labels[predicted_label][0] += 1
-            labels[predicted_label][1] += 1
-            labels[true_label][2] += 1
-        self.accuracy_labels = {}
-        self.recall_labels = {}
-        for key, val in labels.iteritems():
-            try:
-                self.accuracy_labels[key] = float(val[0]) / val[1]
-            except ZeroDivisionError:
-                self.accuracy_labels[key] = float(0)
-            try:
-                self.recall_labels[key] = float(val[0]) / val[2]
-            except ZeroDivisionError:
-                self.recall_labels[key] = float(0)
+        self.confusion_matrix = GroceryConfusionMatrix(top_k=top_k)
+        if true_y is not None:
+            self.update(true_y, predicted_y)
+
+    def update(self, true_y, predicted_y, ranks=None):
+        self.confusion_matrix.update(true_y, predicted_y, ranks)
+        return self
+
+    @property
+    def accuracy_overall(self):
+        return self.confusion_matrix.accuracy()
+
+    @property
+    def accuracy_labels(self):
+        return self.confusion_matrix.precision()
+
+    @property
+    def recall_labels(self):
+        return self.confusion_matrix.recall()
+
+    @property
+    def f1_labels(self):
+        return self.confusion_matrix.f1()
+
+    def top_k_accuracy(self, k):
+        return self.confusion_matrix.top_k_accuracy(k)
 
     @staticmethod
     def draw_table(data, row_labels, column_labels):
@@ -51,19 +142,59 @@ class GroceryTestResult(object):
         return table_string
 
     def show_result(self):
+        scores = (self.accuracy_labels, self.recall_labels, self.f1_labels)
+        labels = self.confusion_matrix.labels
         print self.draw_table(
-            zip(
-                ['%.2f%%' % (s * 100) for s in self.accuracy_labels.values()],
-                ['%.2f%%' % (s * 100) for s in self.recall_labels.values()]
-            ),
-            self.accuracy_labels.keys(),
-            ('accuracy', 'recall')
+            [['%.2f%%' % (score[label] * 100) for score in scores] for label in labels],
+            labels,
+            ('accuracy', 'recall', 'f1')
         )
 
     def __str__(self):
         return str(self.accuracy_overall)
 
 
+class GroceryQuantizationResult(object):
+    def __init__(self, reference, quantized):
+        """
+        Compare the :class:`GroceryTestResult` *quantized* of a quantized
+        model with *reference*, that of the original model on the same
+        texts, which must not have been tested in streaming mode.
+        """
+        self.reference = reference
+        self.quantized = quantized
+        self.accuracy_delta = quantized.accuracy_overall - reference.accuracy_overall
+        ref_f1, f1 = reference.f1_labels, quantized.f1_labels
+        self.f1_delta = dict((label, f1.get(label, 0.0) - ref_f1.get(label, 0.0))
+                             for label in set(ref_f1) | set(f1))
+        # fraction of texts predicted the same by both models
+        pairs = zip(reference.predicted_y, quantized.predicted_y)
+        self.agreement = float(sum(1 for a, b in pairs if a == b)) / (len(pairs) or 1)
+
+    def show_result(self):
+        print 'accuracy {0:.2%} -> {1:.2%} ({2:+.2%}), agreement {3:.2%}'.format(
+            self.reference.accuracy_overall, self.quantized.accuracy_overall, self.accuracy_delta, self.agreement)
+        labels = sorted(self.f1_delta)
+        print GroceryTestResult.draw_table([['%+.2f%%' % (self.f1_delta[label] * 100)] for label in labels],
+                                           labels, ('f1 delta',))
+
+    def __str__(self):
+        return str(self.accuracy_delta)
+
+
+class GroceryCrossValidationResult(object):
+    def __init__(self, liblinear_opts, fold_accuracy, fold_seconds):
+        self.liblinear_opts = liblinear_opts
+        self.fold_accuracy = list(fold_accuracy)
+        # wall time of training and predicting each fold
+        self.fold_seconds = list(fold_seconds)
+        self.accuracy = sum(self.fold_accuracy) / len(self.fold_accuracy)
+        self.seconds = sum(self.fold_seconds)
+
+    def __str__(self):
+        return str(self.accuracy)
+
+
 class GroceryPredictResult(object):
     def __init__(self, predicted_y=None, dec_values=None, labels=None):
         self.predicted_y = predicted_y
@@ -71,3 +202,24 @@ class GroceryPredictResult(object):
 
     def __str__(self):
         return self.predicted_y
+
+
+class GroceryBatchPredictResult(object):
+    def __init__(self, predicted_y=None, dec_values=None, labels=None):
+        self.predicted_y = predicted_y
+        # flat array, the decision value of text i and label k is at i * len(labels) + k
+        self.dec_values = dec_values
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.predicted_y)
+
+    def __iter__(self):
+        return iter(self.predicted_y)
+
+    def __getitem__(self, idx):
+        dec_values = []
+        if self.dec_values is not None:
+            nr_class = len(self.labels)
+            dec_values = self.dec_values[idx * nr_class:(idx + 1) * nr_class]
+        return GroceryPredictResult(predicted_y=self.predicted_y[idx], dec_values=dec_values, labels=self.labels)
@@ -8,17 +8,43 @@ from base import *
 
 
 class GroceryTextModel(object):
-    def __init__(self, text_converter=None, model=None):
+    def __init__(self, text_converter=None, model=None, cache=None):
+        """
+        If *cache* is a :class:`GroceryPredictCache`, the predictions of
+        :meth:`predict_text` and :meth:`predict_texts` are cached by text
+        and model id.
+        """
         if text_converter is not None and isinstance(text_converter, GroceryTextConverter):
             self.text_converter = text_converter
         else:
             self.text_converter = GroceryTextConverter()
         self.svm_model = model
+        self.cache = cache
         self._hashcode = str(uuid.uuid4())
+        self._cache_labels()
 
     def __str__(self):
         return 'TextModel instance ({0}, {1})'.format(self.text_converter, self.svm_model)
 
+    def quantize(self, weights='int8'):
+        """
+        Return a model predicting as this one with the weights stored as
+        *weights*, ``'float32'`` or ``'int8'``, see
+        :meth:`tgrocery.learner.LearnerModel.quantize`.
+        """
+        if self.svm_model is None:
+            raise Exception('This model can not be quantized because svm model is not given.')
+        return GroceryTextModel(self.text_converter, self.svm_model.quantize(weights), self.cache)
+
+    def _cache_labels(self):
+        # class names in the order of the decision values, and by label
+        self._labels = None
+        self._label_names = None
+        if self.svm_model is not None:
+            label_idx = self.svm_model.label[:self.svm_model.nr_class]
+            self._labels = [self.text_converter.get_class_name(k) for k in label_idx]
+            self._label_names = dict(zip(label_idx, self._labels))
+
     def get_labels(self):
         return [self.text_converter.get_class_name(k) for k in self.svm_model.get_labels()]
 
@@ -30,8 +56,11 @@ class GroceryTextModel(object):
             raise ValueError("The given model is invalid.")
         self.text_converter.load(model_name + '/converter')
         self.svm_model = LearnerModel(model_name + '/learner')
+        self._cache_labels()
+        if self.cache is not None:
+            self.cache.clear()
 
-    def save(self, model_name, force=False):
+    def save(self, model_name, force=False, binary=False):
         if self.svm_model is None:
             raise Exception('This model can not be saved because svm model is not given.')
         if os.path.exists(model_name) and force:
@@ -40,41 +69,136 @@ class GroceryTextModel(object):
             os.mkdir(model_name)
         except OSError as e:
             raise OSError(e, 'Please use force option to overwrite the existing files.')
-        self.text_converter.save(model_name + '/converter')
-        self.svm_model.save(model_name + '/learner', force)
+        self.text_converter.save(model_name + '/converter', binary)
+        self.svm_model.save(model_name + '/learner', force, binary)
 
         with open(model_name + '/id', 'w') as fout:
             fout.write(self._hashcode)
 
-    def predict_text(self, text):
-        if self.svm_model is None:
-            raise Exception('This model is not usable because svm model is not given')
+    @staticmethod
+    def _check_text(text):
         # process unicode type
         if isinstance(text, unicode):
             text = text.encode('utf-8')
         if not isinstance(text, str):
             raise TypeError('The argument should be plain text')
-        text = self.text_converter.to_svm(text)
-        y, dec = predict_one(text, self.svm_model)
-        y = self.text_converter.get_class_name(int(y))
-        labels = [self.text_converter.get_class_name(k) for k in
-                  self.svm_model.label[:self.svm_model.nr_class]]
-        return GroceryPredictResult(predicted_y=y, dec_values=dec[:self.svm_model.nr_class], labels=labels)
+        return text
+
+    def predict_text(self, text):
+        if self.svm_model is None:
+            raise Exception('This model is not usable because svm model is not given')
+        text = self._check_text(text)
+        entry = self.cache.get((text, self._hashcode)) if self.cache is not None else None
+        if entry is None:
+            y, dec = predict_one(self.text_converter.to_svm(text), self.svm_model)
+            entry = (self._label_names[int(y)], dec[:self.svm_model.nr_class])
+            if self.cache is not None:
+                self.cache.put((text, self._hashcode), entry)
+        return GroceryPredictResult(predicted_y=entry[0], dec_values=entry[1], labels=self._labels)
+
+    def predict_texts(self, texts, dec_values=False):
+        if self.svm_model is None:
+            raise Exception('This model is not usable because svm model is not given')
+        if self.cache is not None:
+            return self._predict_texts_cached(texts, dec_values)
+        buf = LearnerProblemBuffer()
+        for text in texts:
+            buf.append(self.text_converter.to_svm(self._check_text(text)))
+        return self.predict_svm(buf, dec_values)
+
+    def _predict_texts_cached(self, texts, dec_values):
+        # entries are (label, decision values), as in predict_text
+        texts = [self._check_text(text) for text in texts]
+        entries = [self.cache.get((text, self._hashcode)) for text in texts]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if missing:
+            buf = LearnerProblemBuffer()
+            for i in missing:
+                buf.append(self.text_converter.to_svm(texts[i]))
+            y, dec = predict_batch(buf, self.svm_model, True)
+            nr_class = self.svm_model.nr_class
+            for j, i in enumerate(missing):
+                entries[i] = (self._label_names[int(y[j])], dec[j * nr_class:(j + 1) * nr_class])
+                self.cache.put((texts[i], self._hashcode), entries[i])
+        dec = [d for entry in entries for d in entry[1]] if dec_values else None
+        return GroceryBatchPredictResult(predicted_y=[entry[0] for entry in entries], dec_values=dec,
+                                         labels=self._labels)
+
+    def predict_texts_topk(self, texts, k=3):
+        """
+        Return, for each of *texts*, the *k* best ``(label, decision value)``
+        pairs, best first. See :func:`tgrocery.learner.predict_topk`.
+        """
+        if self.svm_model is None:
+            raise Exception('This model is not usable because svm model is not given')
+        buf = LearnerProblemBuffer()
+        for text in texts:
+            buf.append(self.text_converter.to_svm(self._check_text(text)))
+        top_idx, top_val = predict_topk(buf, self.svm_model, k)
+        k = min(k, self.svm_model.nr_class)
+        names = self._label_names
+        return [[(names[top_idx[j]], top_val[j]) for j in xrange(i * k, (i + 1) * k)] for i in xrange(len(buf))]
+
+    def predict_svm(self, buf, dec_values=False):
+        y, dec = predict_batch(buf, self.svm_model, dec_values)
+        names = self._label_names
+        return GroceryBatchPredictResult(predicted_y=[names[int(k)] for k in y], dec_values=dec, labels=self._labels)
 
 
 class GroceryTest(object):
     def __init__(self, model):
         self.model = model
 
-    def test(self, text_src, delimiter):
-        text_src = read_text_src(text_src, delimiter)
-        true_y = []
-        predicted_y = []
-        for line in text_src:
-            try:
-                label, text = line
-            except ValueError:
+    def test(self, text_src, delimiter, n_jobs=1, streaming=False, chunk_size=10000, top_k=0):
+        """
+        If *streaming* is true, *text_src* is predicted *chunk_size* texts at
+        a time and only a confusion matrix is kept, so memory use does not
+        grow with the size of *text_src*. The result then has no
+        ``true_y``/``predicted_y`` lists.
+
+        If *top_k* is positive, the ranks of the true labels by decision
+        value are counted for ``top_k_accuracy(k)``, k <= *top_k*.
+        """
+        text_converter = self.model.text_converter
+        result = GroceryTestResult(top_k=top_k)
+        true_y, predicted_y = [], []
+        buf, chunk_y = LearnerProblemBuffer(), []
+        for label, tokens, chars in text_converter.iter_tokens(text_src, delimiter, n_jobs):
+            buf.append(text_converter.tokens_to_svm(tokens, chars=chars))
+            chunk_y.append(label)
+            if len(chunk_y) == chunk_size:
+                self._test_chunk(buf, chunk_y, result, true_y, predicted_y, streaming, top_k)
+                buf, chunk_y = LearnerProblemBuffer(), []
+        if chunk_y:
+            self._test_chunk(buf, chunk_y, result, true_y, predicted_y, streaming, top_k)
+        if not streaming:
+            result.true_y, result.predicted_y = true_y, predicted_y
+        return result
+
+    def _test_chunk(self, buf, chunk_y, result, true_y, predicted_y, streaming, top_k):
+        batch_result = self.model.predict_svm(buf, dec_values=top_k > 0)
+        ranks = None
+        if top_k > 0:
+            ranks = self._true_label_ranks(batch_result, chunk_y)
+        result.update(chunk_y, batch_result.predicted_y, ranks)
+        if not streaming:
+            true_y.extend(chunk_y)
+            predicted_y.extend(batch_result.predicted_y)
+
+    @staticmethod
+    def _true_label_ranks(batch_result, true_y):
+        # ties are broken by label order, as when predicting
+        labels = batch_result.labels
+        label2idx = dict((label, k) for k, label in enumerate(labels))
+        nr_class = len(labels)
+        dec_values = batch_result.dec_values
+        ranks = []
+        for i, true_label in enumerate(true_y):
+            t = label2idx.get(true_label)
+            if t is None:
+                # never ranked: a label unseen in training
+                ranks.append(nr_class + 1)
                 continue
-            predicted_y.append(self.model.predict_text(text).predicted_y)
-            true_y.append(label)
-        return GroceryTestResult(true_y, predicted_y)
+            dec = dec_values[i * nr_class:(i + 1) * nr_class]
+            ranks.append(1 + sum(1 for k, d in enumerate(dec) if d > dec[t] or (d == dec[t] and k < t)))
+        return ranks
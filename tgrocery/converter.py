@@ -1,11 +1,58 @@
-from collections import defaultdict
+from bisect import bisect_left
+from ctypes import Array, c_char, c_double, c_int64, c_ubyte, memset, pointer, sizeof, string_at
+from itertools import islice
+from multiprocessing import Pool, cpu_count
 import cPickle
+import math
+import mmap
 import os
+import struct
 
-import jieba
 from base import *
-
-__all__ = ['GroceryTextConverter']
+from .learner.learner import NgramIndex, util
+
+# jieba takes about as long to import as the rest of the package, and
+# seconds to build its dictionary, so both are left to the first
+# tokenization or to warmup()
+_jieba = None
+_jieba_cache_file = None
+
+
+def _get_jieba():
+    global _jieba
+    if _jieba is None:
+        import jieba
+        if _jieba_cache_file is not None:
+            jieba.dt.cache_file = _jieba_cache_file
+        _jieba = jieba
+    return _jieba
+
+
+def set_jieba_cache(cache_file):
+    """
+    Keep the dictionary cache of jieba, which otherwise lives in the
+    temporary directory, in *cache_file*, e.g. on a persistent volume.
+    It is written when jieba first builds its dictionary, then loaded.
+    """
+    global _jieba_cache_file
+    _jieba_cache_file = os.path.abspath(cache_file)
+    if not os.path.isdir(os.path.dirname(_jieba_cache_file)):
+        os.makedirs(os.path.dirname(_jieba_cache_file))
+    if _jieba is not None and not _jieba.dt.initialized:
+        _jieba.dt.cache_file = _jieba_cache_file
+
+
+def warmup(jieba_cache=None):
+    """
+    Import jieba and load its dictionary now rather than on the first
+    tokenization, e.g. before forking workers, which then share it. See
+    :func:`set_jieba_cache` for *jieba_cache*.
+    """
+    if jieba_cache is not None:
+        set_jieba_cache(jieba_cache)
+    _get_jieba().initialize()
+
+__all__ = ['GroceryTextConverter', 'warmup', 'set_jieba_cache']
 
 
 def _dict2list(d):
@@ -22,34 +69,336 @@ def _list2dict(l):
     return dict((v, k) for k, v in enumerate(l))
 
 
+_BINARY_MAGIC = 'TGROCERY'
+# bumped whenever the arrays a binary file holds change
+_BINARY_VERSION = 1
+_BINARY_TYPES = {'c': c_char, 'i': c_int64, 'd': c_double}
+
+
+def _is_binary(src_file):
+    with open(src_file, 'rb') as fin:
+        return fin.read(len(_BINARY_MAGIC)) == _BINARY_MAGIC
+
+
+def _save_arrays(dest_file, arrays):
+    # header, then each array 8-byte aligned so that it can be mapped as it is
+    with open(dest_file, 'wb') as fout:
+        fout.write(struct.pack('=8sqq', _BINARY_MAGIC, _BINARY_VERSION, len(arrays)))
+        for code, seq in arrays:
+            fout.write(struct.pack('=8sq', code, len(seq)))
+        for code, seq in arrays:
+            if code == 'c':
+                data = seq
+            elif isinstance(seq, Array):
+                data = string_at(seq, sizeof(seq))
+            else:
+                data = struct.pack('={0}{1}'.format(len(seq), 'q' if code == 'i' else 'd'), *seq)
+            fout.write(data)
+            fout.write('\0' * (-len(data) % 8))
+
+
+def _load_arrays(src_file):
+    # copy-on-write mapping: pages are shared between processes until written
+    with open(src_file, 'rb') as fin:
+        buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, n = struct.unpack_from('=8sqq', buf, 0)
+    if magic != _BINARY_MAGIC:
+        raise ValueError('{0} is not a binary model file.'.format(src_file))
+    if version != _BINARY_VERSION:
+        raise ValueError('{0} is a binary model file of version {1}, expected {2}.'.format(
+            src_file, version, _BINARY_VERSION))
+    offset = 24 + 16 * n
+    arrays = []
+    for i in range(n):
+        code, length = struct.unpack_from('=8sq', buf, 24 + 16 * i)
+        ctype = _BINARY_TYPES[code.rstrip('\0')]
+        arrays.append((ctype * length).from_buffer(buf, offset))
+        offset += sizeof(ctype) * length
+        offset += -offset % 8
+    return arrays
+
+
+def _encode(tok):
+    if isinstance(tok, unicode):
+        return tok.encode('utf-8')
+    return tok
+
+
+class _SortedStrings(object):
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.blob[self.offsets[idx]:self.offsets[idx + 1]]
+
+
+class _StringTable(object):
+    """
+    Read-only token to id mapping over a sorted string table, which is
+    memory-mapped from a binary model instead of being rebuilt as a dict.
+    """
+
+    def __init__(self, blob, offsets, ids, kinds):
+        self.strings = _SortedStrings(blob, offsets)
+        self.ids = ids
+        # 'u' for tokens that were unicode, so that iteritems gives them back
+        self.kinds = kinds
+
+    @staticmethod
+    def to_arrays(tok2idx):
+        items = sorted((_encode(tok), idx, 'u' if isinstance(tok, unicode) else 's')
+                       for tok, idx in tok2idx.iteritems())
+        offsets = [0]
+        for tok, idx, kind in items:
+            offsets.append(offsets[-1] + len(tok))
+        return [('c', ''.join(tok for tok, idx, kind in items)), ('i', offsets),
+                ('i', [idx for tok, idx, kind in items]), ('c', ''.join(kind for tok, idx, kind in items))]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, tok, default=None):
+        tok = _encode(tok)
+        pos = bisect_left(self.strings, tok)
+        if pos < len(self.ids) and self.strings[pos] == tok:
+            return self.ids[pos]
+        return default
+
+    def __contains__(self, tok):
+        return self.get(tok) is not None
+
+    def __getitem__(self, tok):
+        idx = self.get(tok)
+        if idx is None:
+            raise KeyError(tok)
+        return idx
+
+    def iteritems(self):
+        for pos in xrange(len(self.ids)):
+            tok = self.strings[pos]
+            if self.kinds[pos] == 'u':
+                tok = tok.decode('utf-8')
+            yield tok, self.ids[pos]
+
+
+_worker_tokenize = None
+
+
+_worker_char_order = 0
+
+
+def _init_tokenize_worker(custom_tokenize, char_order=0):
+    global _worker_tokenize, _worker_char_order
+    _worker_tokenize = custom_tokenize
+    _worker_char_order = char_order
+
+
+def _tokenize_worker(labelled_text):
+    label, text = labelled_text
+    tokens, chars = GroceryTextConverter.analyze(text, _worker_tokenize, _worker_char_order)
+    return label, tokens, chars
+
+
+class GroceryNgramIndex(object):
+    """
+    Mapping from n-grams (tuples of token ids) to feature ids, held in the
+    C open-addressing table of ``util.c``.
+
+    An n-gram ``g + (x,)`` is keyed by the 64-bit integer
+    ``fidx(g) << 32 | x`` with ``fidx(()) = 0``, so :meth:`features`
+    counts the n-grams of a text in one C call without building a tuple
+    per n-gram. Feature id 0 is reserved, and ``len()`` is the next
+    feature id as with the former ``{'>>dummy<<': 0, ...}`` dict.
+    """
+
+    def __init__(self, capacity=1024):
+        self.index = NgramIndex()
+        self._set_arrays((c_int64 * capacity)(), (c_int64 * capacity)())
+
+    def _set_arrays(self, keys, vals, size=0):
+        if size == 0:
+            memset(keys, -1, sizeof(keys))
+        self.keys = keys
+        self.vals = vals
+        self.index.keys = keys
+        self.index.vals = vals
+        self.index.capacity = len(keys)
+        self.index.size = size
+
+    def _reserve(self, n):
+        # keep the table at most half full
+        capacity = self.index.capacity
+        while (self.index.size + n) * 2 > capacity:
+            capacity *= 2
+        if capacity == self.index.capacity:
+            return
+        old_index = self.index
+        self.index = NgramIndex()
+        self._set_arrays((c_int64 * capacity)(), (c_int64 * capacity)())
+        util.ngram_index_rehash(old_index, self.index)
+
+    def __len__(self):
+        return self.index.size + 1
+
+    @staticmethod
+    def from_arrays(header, keys, vals):
+        ngram_index = GroceryNgramIndex(1)
+        ngram_index._set_arrays(keys, vals, header[1])
+        return ngram_index
+
+    def to_arrays(self):
+        return [('i', [self.index.capacity, self.index.size]), ('i', self.keys), ('i', self.vals)]
+
+    def copy(self):
+        header, keys, vals = [seq for code, seq in self.to_arrays()]
+        return GroceryNgramIndex.from_arrays(header, (c_int64 * len(keys)).from_buffer_copy(keys),
+                                             (c_int64 * len(vals)).from_buffer_copy(vals))
+
+    def features(self, tokens, order, frozen=False, max_fidx=0):
+        """
+        Return a :class:`dict` counting the 1..*order*-grams of the token ids
+        *tokens* by feature id. Unseen n-grams get new ids unless *frozen*.
+        If *max_fidx* is positive, larger ids are left out, see :meth:`prune`.
+        """
+        n = len(tokens)
+        if not frozen:
+            self._reserve(n * order)
+        toks = (c_int64 * n)(*tokens)
+        prefix = (c_int64 * n)()
+        feat_idx = (c_int64 * (n * order))()
+        feat_cnt = (c_int64 * (n * order))()
+        nr_feat = util.ngram_index_features(self.index, toks, n, order, frozen, max_fidx, prefix, feat_idx, feat_cnt)
+        return dict(zip(feat_idx[:nr_feat], feat_cnt[:nr_feat]))
+
+    def _key(self, ngram):
+        if any(x < 0 for x in ngram):
+            # -1 stands for unseen tokens, and is the key of empty slots
+            return None
+        fidx = 0
+        for x in ngram[:-1]:
+            fidx = util.ngram_index_get(self.index, fidx << 32 | x)
+            if fidx < 0:
+                return None
+        return fidx << 32 | ngram[-1]
+
+    def get(self, ngram, default=None):
+        key = self._key(ngram)
+        if key is None or key < 0:
+            return default
+        fidx = util.ngram_index_get(self.index, key)
+        return default if fidx < 0 else fidx
+
+    def __contains__(self, ngram):
+        return self.get(ngram) is not None
+
+    def __getitem__(self, ngram):
+        fidx = self.get(ngram)
+        if fidx is None:
+            raise KeyError(ngram)
+        return fidx
+
+    def __setitem__(self, ngram, fidx):
+        key = self._key(ngram)
+        if key is None:
+            raise KeyError('{0} has a negative token id or a prefix that is not indexed.'.format(ngram))
+        self._reserve(1)
+        util.ngram_index_set(self.index, key, fidx)
+
+    def iteritems(self):
+        keys = dict((self.vals[i], self.keys[i]) for i in xrange(self.index.capacity) if self.keys[i] != -1)
+        ngrams = {0: ()}
+
+        def ngram(fidx):
+            # a prefix may have a larger id than its extensions after prune
+            if fidx not in ngrams:
+                key = keys[fidx]
+                ngrams[fidx] = ngram(key >> 32) + (key & 0xffffffff,)
+            return ngrams[fidx]
+
+        for fidx in sorted(keys):
+            yield ngram(fidx), fidx
+
+    def prune(self, remap, nr_kept):
+        """
+        Return a new index of the n-grams with ``remap[fidx]`` in
+        ``1..nr_kept``, renumbered to it, and of the prefixes they need,
+        which are numbered from *nr_kept* + 1 in *remap*.
+        """
+        nr_ngram = util.ngram_index_prune_remap(self.index, remap, nr_kept)
+        if nr_ngram == -2:
+            raise MemoryError("Memory Exhausted. Try to restart python.")
+        capacity = 1024
+        while capacity < 2 * nr_ngram:
+            capacity *= 2
+        ngram_index = GroceryNgramIndex(capacity)
+        util.ngram_index_prune(self.index, ngram_index.index, remap)
+        return ngram_index
+
+
 class GroceryTextPreProcessor(object):
     def __init__(self):
         # index must start from 1
         self.tok2idx = {'>>dummy<<': 0}
         self.idx2tok = None
+        # a frozen vocabulary maps unseen tokens to -1 instead of growing
+        self.frozen = False
 
     @staticmethod
     def _default_tokenize(text):
-        return jieba.cut(text.strip(), cut_all=True)
+        return _get_jieba().cut(text.strip(), cut_all=True)
 
-    def preprocess(self, text, custom_tokenize):
+    @staticmethod
+    def tokenize(text, custom_tokenize):
         if custom_tokenize is not None:
-            tokens = custom_tokenize(text)
-        else:
-            tokens = self._default_tokenize(text)
+            return list(custom_tokenize(text))
+        return list(GroceryTextPreProcessor._default_tokenize(text))
+
+    @staticmethod
+    def chars(text):
+        if not isinstance(text, unicode):
+            text = text.decode('utf-8', 'ignore')
+        # marked, so that a character is not the word of the same spelling
+        return [u'\0' + ch for ch in text if not ch.isspace()]
+
+    def preprocess(self, text, custom_tokenize):
+        return self.index_tokens(self.tokenize(text, custom_tokenize))
+
+    def copy(self):
+        text_prep = GroceryTextPreProcessor()
+        text_prep.tok2idx = dict(self.tok2idx.iteritems())
+        text_prep.frozen = self.frozen
+        return text_prep
+
+    def index_tokens(self, tokens):
         ret = []
-        for idx, tok in enumerate(tokens):
-            if tok not in self.tok2idx:
-                self.tok2idx[tok] = len(self.tok2idx)
-            ret.append(self.tok2idx[tok])
+        for tok in tokens:
+            idx = self.tok2idx.get(tok)
+            if idx is None:
+                if self.frozen:
+                    # keep the position so that no n-gram spans an unseen token
+                    ret.append(-1)
+                    continue
+                idx = self.tok2idx[tok] = len(self.tok2idx)
+            ret.append(idx)
         return ret
 
-    def save(self, dest_file):
+    def save(self, dest_file, binary=False):
+        if binary:
+            _save_arrays(dest_file, _StringTable.to_arrays(self.tok2idx))
+            return
         self.idx2tok = _dict2list(self.tok2idx)
         config = {'idx2tok': self.idx2tok}
         cPickle.dump(config, open(dest_file, 'wb'), -1)
 
     def load(self, src_file):
+        if _is_binary(src_file):
+            self.idx2tok = None
+            self.tok2idx = _StringTable(*_load_arrays(src_file))
+            return self
         config = cPickle.load(open(src_file, 'rb'))
         self.idx2tok = config['idx2tok']
         self.tok2idx = _list2dict(self.idx2tok)
@@ -58,36 +407,190 @@ class GroceryTextPreProcessor(object):
 
 class GroceryFeatureGenerator(object):
     def __init__(self):
-        self.ngram2fidx = {'>>dummy<<': 0}
+        self.ngram2fidx = GroceryNgramIndex()
         self.fidx2ngram = None
+        # a frozen generator drops unseen n-grams instead of growing
+        self.frozen = False
+        # if positive, the number of features left by prune
+        self.max_fidx = 0
 
     def unigram(self, tokens):
-        feat = defaultdict(int)
-        NG = self.ngram2fidx
-        for x in tokens:
-            if (x,) not in NG:
-                NG[x,] = len(NG)
-            feat[NG[x,]] += 1
-        return feat
+        return self.ngrams(tokens, 1)
 
     def bigram(self, tokens):
-        feat = self.unigram(tokens)
-        NG = self.ngram2fidx
-        for x, y in zip(tokens[:-1], tokens[1:]):
-            if (x, y) not in NG:
-                NG[x, y] = len(NG)
-            feat[NG[x, y]] += 1
-        return feat
-
-    def save(self, dest_file):
-        self.fidx2ngram = _dict2list(self.ngram2fidx)
-        config = {'fidx2ngram': self.fidx2ngram}
+        return self.ngrams(tokens, 2)
+
+    def ngrams(self, tokens, order):
+        return self.ngram2fidx.features(tokens, order, self.frozen, self.max_fidx)
+
+    def copy(self):
+        feat_gen = GroceryFeatureGenerator()
+        feat_gen.ngram2fidx = self.ngram2fidx.copy()
+        feat_gen.frozen = self.frozen
+        feat_gen.max_fidx = self.max_fidx
+        return feat_gen
+
+    def prune(self, buf, min_df=1, max_df=1.0, max_features=None):
+        """
+        Keep the features of the instances in the
+        :class:`LearnerProblemBuffer` *buf* whose document frequencies are
+        within *min_df* and *max_df*, a number of instances if an
+        :class:`int` or a fraction of them if a :class:`float`, and of
+        those the *max_features* most frequent ones. The features kept are
+        renumbered densely in their order, both in *buf* and in the
+        n-gram index, and the others are dropped, leaving
+        :attr:`max_fidx` features.
+
+        Return the :class:`c_int64` array *remap*: feature fidx is now
+        feature ``remap[fidx]`` if that is in 1..:attr:`max_fidx`, and was
+        dropped otherwise, see
+        :meth:`tgrocery.learner.LearnerModel.remap_features`.
+        """
+        nr_doc = len(buf)
+        if isinstance(min_df, float):
+            min_df = math.ceil(min_df * nr_doc)
+        if isinstance(max_df, float):
+            max_df = math.floor(max_df * nr_doc)
+        size = self.ngram2fidx.index.size
+        df = (c_int64 * (size + 1))()
+        util.feature_df(buf.c_array('index'), len(buf.index), df)
+        df = df[:]
+        kept = [fidx for fidx in xrange(1, size + 1) if min_df <= df[fidx] <= max_df]
+        if max_features is not None and len(kept) > max_features:
+            # ties go to the smaller ids, as the sort is stable
+            kept = sorted(sorted(kept, key=df.__getitem__, reverse=True)[:max_features])
+
+        remap = (c_int64 * (size + 1))()
+        for new_fidx, fidx in enumerate(kept):
+            remap[fidx] = new_fidx + 1
+        self.ngram2fidx = self.ngram2fidx.prune(remap, len(kept))
+        self.max_fidx = len(kept)
+        nnz = util.remap_features(buf.c_array('row_ptr'), buf.c_array('index'), buf.c_array('value'), len(buf),
+                remap, len(kept))
+        del buf.index[nnz:]
+        del buf.value[nnz:]
+        return remap
+
+    def save(self, dest_file, binary=False):
+        if binary:
+            _save_arrays(dest_file, self.ngram2fidx.to_arrays() + [('i', [self.max_fidx])])
+            return
+        self.fidx2ngram = ['>>dummy<<'] + [''] * self.ngram2fidx.index.size
+        for ngram, fidx in self.ngram2fidx.iteritems():
+            self.fidx2ngram[fidx] = ngram
+        config = {'fidx2ngram': self.fidx2ngram, 'max_fidx': self.max_fidx}
         cPickle.dump(config, open(dest_file, 'wb'), -1)
 
     def load(self, src_file):
+        if _is_binary(src_file):
+            self.fidx2ngram = None
+            header, keys, vals, max_fidx = _load_arrays(src_file)
+            self.max_fidx = max_fidx[0]
+            self.ngram2fidx = GroceryNgramIndex.from_arrays(header, keys, vals)
+            return self
         config = cPickle.load(open(src_file, 'rb'))
         self.fidx2ngram = config['fidx2ngram']
-        self.ngram2fidx = _list2dict(self.fidx2ngram)
+        self.max_fidx = config.get('max_fidx', 0)
+        self.ngram2fidx = GroceryNgramIndex()
+        # prefixes first, as they key their extensions
+        ngrams = sorted((len(ngram), fidx, ngram) for fidx, ngram in enumerate(self.fidx2ngram)
+                        if isinstance(ngram, tuple))
+        for n, fidx, ngram in ngrams:
+            self.ngram2fidx[ngram] = fidx
+        return self
+
+
+class GroceryFeatureHasher(object):
+    """
+    Feature generator of the hashing mode: n-grams of token strings are
+    hashed to feature ids 1..2^*hash_bits* in C, see ``hash_features`` of
+    ``util.c``, so no vocabulary is kept and the feature space is fixed.
+
+    Unless frozen, the ids used are recorded in a bitmap of 2^*hash_bits*
+    bits for :meth:`collision_stats`. Only their number is saved, so a
+    loaded hasher reports the statistics of the data it was trained on,
+    and starts them afresh if trained further.
+    """
+
+    def __init__(self, hash_bits=20):
+        if not 0 < hash_bits <= 32:
+            raise ValueError('hash_bits should be in 1..32.')
+        self.hash_bits = hash_bits
+        self.frozen = False
+        self.seen = None
+        self.nr_used = c_int64()
+
+    def unigram(self, tokens):
+        return self.ngrams(tokens, 1)
+
+    def bigram(self, tokens):
+        return self.ngrams(tokens, 2)
+
+    def ngrams(self, tokens, order):
+        """
+        Return a :class:`dict` counting the 1..*order*-grams of the token
+        strings *tokens* by feature id.
+        """
+        tokens = [_encode(tok) for tok in tokens]
+        n = len(tokens)
+        offsets = (c_int64 * (n + 1))()
+        for i, tok in enumerate(tokens):
+            offsets[i + 1] = offsets[i] + len(tok)
+        seen = None
+        if not self.frozen:
+            if self.seen is None:
+                self.seen = (c_ubyte * max(2 ** self.hash_bits // 8, 1))()
+                self.nr_used = c_int64()
+            seen = self.seen
+        prefix = (c_int64 * n)()
+        feat_idx = (c_int64 * (n * order))()
+        feat_cnt = (c_int64 * (n * order))()
+        nr_feat = util.hash_features(''.join(tokens), offsets, n, order, self.hash_bits, seen,
+                pointer(self.nr_used), prefix, feat_idx, feat_cnt)
+        return dict(zip(feat_idx[:nr_feat], feat_cnt[:nr_feat]))
+
+    def copy(self):
+        feat_hash = GroceryFeatureHasher(self.hash_bits)
+        feat_hash.frozen = self.frozen
+        if self.seen is not None:
+            feat_hash.seen = (c_ubyte * len(self.seen)).from_buffer_copy(self.seen)
+        feat_hash.nr_used = c_int64(self.nr_used.value) if self.nr_used is not None else None
+        return feat_hash
+
+    def collision_stats(self):
+        """
+        Return a :class:`dict` of the number of feature ids
+        (``nr_bucket``), those used since training began
+        (``nr_bucket_used``), the number of distinct n-grams estimated from
+        them (``nr_ngram``), and the fraction of those n-grams that share
+        an id with another (``collision_rate``), or ``None`` if they are
+        unknown, e.g. for a hasher loaded from a file without them.
+        """
+        if self.nr_used is None:
+            return None
+        nr_bucket, nr_used = 2 ** self.hash_bits, self.nr_used.value
+        if nr_used < nr_bucket:
+            # linear counting: the expected number of ids hit by n keys is
+            # nr_bucket * (1 - exp(-n / nr_bucket))
+            nr_ngram = -nr_bucket * math.log(1 - float(nr_used) / nr_bucket)
+        else:
+            nr_ngram = float('inf')
+        return {
+            'nr_bucket': nr_bucket,
+            'nr_bucket_used': nr_used,
+            'nr_ngram': nr_ngram,
+            'collision_rate': 1 - nr_used / nr_ngram if nr_used else 0.0,
+        }
+
+    def save(self, dest_file, binary=False):
+        config = {'hash_bits': self.hash_bits, 'nr_used': self.nr_used.value if self.nr_used is not None else None}
+        cPickle.dump(config, open(dest_file, 'wb'), -1)
+
+    def load(self, src_file):
+        config = cPickle.load(open(src_file, 'rb'))
+        self.__init__(config['hash_bits'])
+        nr_used = config.get('nr_used')
+        self.nr_used = c_int64(nr_used) if nr_used is not None else None
         return self
 
 
@@ -102,8 +605,14 @@ class GroceryClassMapping(object):
 
         m = len(self.class2idx)
         self.class2idx[class_name] = m
+        self.idx2class = None
         return m
 
+    def copy(self):
+        class_map = GroceryClassMapping()
+        class_map.class2idx = dict(self.class2idx)
+        return class_map
+
     def to_class_name(self, idx):
         if self.idx2class is None:
             self.idx2class = _dict2list(self.class2idx)
@@ -127,11 +636,60 @@ class GroceryClassMapping(object):
 
 
 class GroceryTextConverter(object):
-    def __init__(self, custom_tokenize=None):
+    def __init__(self, custom_tokenize=None, hash_bits=0, ngram_order=2, char_order=0):
+        """
+        The features of a text are its word 1..*ngram_order*-grams and, if
+        *char_order* is positive, its character 1..*char_order*-grams
+        (whitespace left out). Both orders are saved with the converter.
+
+        If *hash_bits* is positive, n-grams are mapped to 2^*hash_bits*
+        features by hashing instead of through a vocabulary, see
+        :class:`GroceryFeatureHasher`.
+        """
+        if ngram_order < 1 or char_order < 0:
+            raise ValueError('ngram_order should be positive and char_order not negative.')
         self.text_prep = GroceryTextPreProcessor()
-        self.feat_gen = GroceryFeatureGenerator()
+        self.feat_gen = GroceryFeatureHasher(hash_bits) if hash_bits else GroceryFeatureGenerator()
         self.class_map = GroceryClassMapping()
         self.custom_tokenize = custom_tokenize
+        self.ngram_order = ngram_order
+        self.char_order = char_order
+
+    @property
+    def hash_bits(self):
+        return getattr(self.feat_gen, 'hash_bits', 0)
+
+    def freeze(self, frozen=True):
+        """
+        Stop (or with *frozen* ``False``, resume) growing the vocabulary.
+
+        A frozen converter only looks tokens and n-grams up, so unseen ones
+        are dropped from the features and memory stays flat while
+        predicting. Resuming keeps every id already assigned, so that a
+        loaded model can be retrained on more data.
+        """
+        if not frozen and isinstance(self.text_prep.tok2idx, _StringTable):
+            # the memory-mapped table is read-only
+            self.text_prep.tok2idx = dict(self.text_prep.tok2idx.iteritems())
+        if not frozen and getattr(self.feat_gen, 'max_fidx', 0):
+            # the prefixes kept by prune become features again
+            self.feat_gen.max_fidx = 0
+        self.text_prep.frozen = frozen
+        self.feat_gen.frozen = frozen
+        return self
+
+    def copy(self):
+        """
+        Return a copy of this converter that shares no tables with it, e.g.
+        to grow the vocabulary for retraining while this one keeps serving
+        predictions unchanged.
+        """
+        text_converter = GroceryTextConverter(custom_tokenize=self.custom_tokenize, ngram_order=self.ngram_order,
+                                              char_order=self.char_order)
+        text_converter.text_prep = self.text_prep.copy()
+        text_converter.feat_gen = self.feat_gen.copy()
+        text_converter.class_map = self.class_map.copy()
+        return text_converter
 
     def get_class_idx(self, class_name):
         return self.class_map.to_idx(class_name)
@@ -139,35 +697,116 @@ class GroceryTextConverter(object):
     def get_class_name(self, class_idx):
         return self.class_map.to_class_name(class_idx)
 
+    @staticmethod
+    def analyze(text, custom_tokenize, char_order=0):
+        """
+        Return ``(tokens, chars)``: the tokens of *text*, and its characters
+        if *char_order* is positive or else ``None``, which is what
+        :meth:`tokens_to_svm` takes.
+        """
+        tokens = GroceryTextPreProcessor.tokenize(text, custom_tokenize)
+        chars = GroceryTextPreProcessor.chars(text) if char_order else None
+        return tokens, chars
+
+    def _ngrams(self, tokens, order):
+        if self.hash_bits:
+            return self.feat_gen.ngrams(tokens, order)
+        return self.feat_gen.ngrams(self.text_prep.index_tokens(tokens), order)
+
     def to_svm(self, text, class_name=None):
-        feat = self.feat_gen.bigram(self.text_prep.preprocess(text, self.custom_tokenize))
+        tokens, chars = self.analyze(text, self.custom_tokenize, self.char_order)
+        return self.tokens_to_svm(tokens, class_name, chars)
+
+    def tokens_to_svm(self, tokens, class_name=None, chars=None):
+        """
+        Return the features of the tokens *tokens* and, if given, of the
+        characters *chars*, with the index of *class_name* if given.
+        """
+        feat = self._ngrams(tokens, self.ngram_order)
+        if chars:
+            # marked characters never share an n-gram with words, but may
+            # share a hashed feature id, whose counts then add up
+            for j, c in self._ngrams(chars, self.char_order).iteritems():
+                feat[j] = feat.get(j, 0) + c
         if class_name is None:
             return feat
         return feat, self.class_map.to_idx(class_name)
 
-    def convert_text(self, text_src, delimiter, output=None):
-        if not output:
-            output = '%s.svm' % text_src
-        text_src = read_text_src(text_src, delimiter)
-        with open(output, 'w') as w:
-            for line in text_src:
+    def iter_tokens(self, text_src, delimiter, n_jobs=1):
+        """
+        Yield ``(label, tokens, chars)`` for each line of *text_src* in
+        order, where *tokens* and *chars* are as from :meth:`analyze`.
+
+        If *n_jobs* is not 1, the texts are tokenized by a pool of *n_jobs*
+        worker processes (all cores if *n_jobs* is -1). Results come back
+        in input order, so token ids assigned afterwards do not depend on
+        *n_jobs*.
+        """
+        def labelled_texts():
+            for line in read_text_src(text_src, delimiter):
                 try:
                     label, text = line
                 except ValueError:
                     continue
-                feat, label = self.to_svm(text, label)
+                yield label, text
+
+        if n_jobs == 1:
+            for label, text in labelled_texts():
+                tokens, chars = self.analyze(text, self.custom_tokenize, self.char_order)
+                yield label, tokens, chars
+            return
+
+        if n_jobs < 1:
+            n_jobs = cpu_count()
+        if self.custom_tokenize is None:
+            # load the dictionary once so that forked workers share it
+            warmup()
+        pool = Pool(n_jobs, _init_tokenize_worker, (self.custom_tokenize, self.char_order))
+        texts = labelled_texts()
+        try:
+            # Pool.imap drains its input eagerly, so feed it a bounded slice
+            # at a time to keep large files out of memory
+            while True:
+                chunk = list(islice(texts, 256 * 4 * n_jobs))
+                if not chunk:
+                    break
+                for labelled_tokens in pool.imap(_tokenize_worker, chunk, 256):
+                    yield labelled_tokens
+        finally:
+            pool.terminate()
+
+    def iter_svm(self, text_src, delimiter, n_jobs=1):
+        for label, tokens, chars in self.iter_tokens(text_src, delimiter, n_jobs):
+            yield self.tokens_to_svm(tokens, label, chars)
+
+    def convert_text(self, text_src, delimiter, output=None, n_jobs=1):
+        if not output:
+            output = '%s.svm' % text_src
+        with open(output, 'w') as w:
+            for feat, label in self.iter_svm(text_src, delimiter, n_jobs):
                 w.write('%s %s\n' % (label, ''.join(' {0}:{1}'.format(f, feat[f]) for f in sorted(feat))))
 
-    def save(self, dest_dir):
+    def save(self, dest_dir, binary=False):
         config = {
             'text_prep': 'text_prep.config.pickle',
             'feat_gen': 'feat_gen.config.pickle',
             'class_map': 'class_map.config.pickle',
         }
+        if binary:
+            # memory-mapped by load, see _load_arrays
+            config['text_prep'] = 'text_prep.bin'
+            config['feat_gen'] = 'feat_gen.bin'
+        if self.hash_bits:
+            # no vocabulary at all
+            config['text_prep'] = None
+            config['feat_gen'] = 'feat_hash.config.pickle'
         if not os.path.exists(dest_dir):
             os.mkdir(dest_dir)
-        self.text_prep.save(os.path.join(dest_dir, config['text_prep']))
-        self.feat_gen.save(os.path.join(dest_dir, config['feat_gen']))
+        extractor = {'ngram_order': self.ngram_order, 'char_order': self.char_order}
+        cPickle.dump(extractor, open(os.path.join(dest_dir, 'extractor.config.pickle'), 'wb'), -1)
+        if config['text_prep'] is not None:
+            self.text_prep.save(os.path.join(dest_dir, config['text_prep']), binary)
+        self.feat_gen.save(os.path.join(dest_dir, config['feat_gen']), binary)
         self.class_map.save(os.path.join(dest_dir, config['class_map']))
 
     def load(self, src_dir):
@@ -176,7 +815,24 @@ class GroceryTextConverter(object):
             'feat_gen': 'feat_gen.config.pickle',
             'class_map': 'class_map.config.pickle',
         }
-        self.text_prep.load(os.path.join(src_dir, config['text_prep']))
+        if os.path.exists(os.path.join(src_dir, 'text_prep.bin')):
+            config['text_prep'] = 'text_prep.bin'
+            config['feat_gen'] = 'feat_gen.bin'
+        if os.path.exists(os.path.join(src_dir, 'feat_hash.config.pickle')):
+            config['text_prep'] = None
+            config['feat_gen'] = 'feat_hash.config.pickle'
+            self.text_prep = GroceryTextPreProcessor()
+            self.feat_gen = GroceryFeatureHasher()
+        elif self.hash_bits:
+            self.feat_gen = GroceryFeatureGenerator()
+        if config['text_prep'] is not None:
+            self.text_prep.load(os.path.join(src_dir, config['text_prep']))
         self.feat_gen.load(os.path.join(src_dir, config['feat_gen']))
         self.class_map.load(os.path.join(src_dir, config['class_map']))
-        return self
+        # converters saved before the orders were configurable had these
+        extractor = {'ngram_order': 2, 'char_order': 0}
+        if os.path.exists(os.path.join(src_dir, 'extractor.config.pickle')):
+            extractor = cPickle.load(open(os.path.join(src_dir, 'extractor.config.pickle'), 'rb'))
+        self.ngram_order = extractor['ngram_order']
+        self.char_order = extractor['char_order']
+        return self.freeze()
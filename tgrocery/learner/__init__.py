@@ -1,2 +1,3 @@
 from .learner import *
-del learner
+from .online import *
+del learner, online
@@ -2,7 +2,13 @@
 
 from ctypes import *
 from ctypes.util import find_library
+from array import array
+from multiprocessing.pool import ThreadPool
+import imp
+import mmap
+import random
 import sys
+import time
 import os
 from os import path
 import shutil
@@ -18,16 +24,37 @@ else:
     import cPickle
     from itertools import izip
 
+# A CDLL releases the GIL during each call, so reading problems and training
+# run concurrently with other Python threads.
 util = CDLL(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'util.so.1'))
 
 LIBLINEAR_HOME = os.environ.get('LIBLINEAR_HOME') or os.path.dirname(os.path.abspath(__file__)) + '/liblinear'
-sys.path = [LIBLINEAR_HOME, LIBLINEAR_HOME + '/python'] + sys.path
 
-import liblinear
-from liblinearutil import train as liblinear_train, predict as liblinear_predict, save_model as liblinear_save_model, load_model as liblinear_load_model
 
-__all__ = ['LearnerParameter', 'LearnerModel',
-        'train', 'predict_one', 'predict', 'LIBLINEAR_HOME']
+def _load_bundled_liblinear():
+    # The bundled interface is loaded under private names, so that neither
+    # another liblinear module already imported (whose structures lack our
+    # fields) is used instead, nor LIBLINEAR_HOME is put on sys.path.
+    # liblinearutil imports it as liblinear, which is only swapped in
+    # while liblinearutil is loaded.
+    bundled = imp.load_source('_tgrocery_liblinear', path.join(LIBLINEAR_HOME, 'python', 'liblinear.py'))
+    other = sys.modules.get('liblinear')
+    sys.modules['liblinear'] = bundled
+    try:
+        util = imp.load_source('_tgrocery_liblinearutil', path.join(LIBLINEAR_HOME, 'python', 'liblinearutil.py'))
+    finally:
+        if other is None:
+            del sys.modules['liblinear']
+        else:
+            sys.modules['liblinear'] = other
+    return bundled, util
+
+liblinear, _liblinearutil = _load_bundled_liblinear()
+liblinear_train, liblinear_predict = _liblinearutil.train, _liblinearutil.predict
+liblinear_save_model, liblinear_load_model = _liblinearutil.save_model, _liblinearutil.load_model
+
+__all__ = ['LearnerParameter', 'LearnerModel', 'LearnerProblemBuffer', 'LearnerQuantizedWeights',
+        'train', 'grid_search', 'predict_one', 'predict_batch', 'predict_topk', 'predict', 'LIBLINEAR_HOME']
 
 
 def print_debug(src):
@@ -44,6 +71,29 @@ def genFields(names, types):
     return list(zip(names, types))
 
 
+def _int64_typecode():
+    # array has no fixed-size typecodes, so pick the one matching c_int64
+    for typecode in ('l', 'q'):
+        try:
+            if array(typecode).itemsize == sizeof(c_int64):
+                return typecode
+        except ValueError:
+            pass
+    raise TypeError('No array typecode is 64-bit on this platform.')
+
+INT64_TYPECODE = _int64_typecode()
+
+
+def _mmap_array(src, ctype=c_double):
+    # copy-on-write mapping: pages are shared between processes until written
+    size = path.getsize(src)
+    if size == 0:
+        return (ctype * 0)()
+    with open(src, 'rb') as fin:
+        buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_COPY)
+    return (ctype * (size // sizeof(ctype))).from_buffer(buf)
+
+
 # Interface to util
 class SVMProblem(Structure):
     _names = ["prob", "x_space", "n_x_space"]
@@ -74,16 +124,180 @@ def read_SVMProblem(src):
     raise ValueError("Wrong file format in line " + str(status) + ".")
 
 
+def build_SVMProblem(buf, bias=0, bias_index=0):
+    status = c_int64()
+    svmprob = util.build_problem(buf.c_array('y'), buf.c_array('row_ptr'), buf.c_array('index'),
+            buf.c_array('value'), len(buf), bias, bias_index, pointer(status))
+
+    status = status.value
+
+    if status == 0:
+        print_debug('SVMProblem construct:%s'% id(svmprob))
+        return svmprob
+
+    if status == -2:
+        raise MemoryError("Memory Exhausted. Try to restart python.")
+
+    raise ValueError("Feature indices of instance " + str(status) + " are not positive and increasing.")
+
+
+class LearnerProblemBuffer(object):
+    """
+    :class:`LearnerProblemBuffer` collects instances in flat arrays so
+    that a whole problem can be built by one C call instead of one
+    ``feature_node`` array per instance.
+
+    Instances are appended as :class:`dict` mapping feature indices to
+    values, e.g. the output of
+    :meth:`tgrocery.converter.GroceryTextConverter.to_svm`.
+    """
+
+    def __init__(self):
+        self.y = array('d')
+        self.row_ptr = array(INT64_TYPECODE, [0])
+        self.index = array(INT64_TYPECODE)
+        self.value = array('d')
+
+    def __len__(self):
+        return len(self.y)
+
+    def append(self, xi, yi=0):
+        """
+        Append instance *xi* with label *yi*. Feature indices must be
+        positive.
+        """
+        index_range = sorted(xi)
+        if index_range and index_range[0] <= 0:
+            raise ValueError("Feature indices should be positive, got " + str(index_range[0]) + ".")
+        self.index.extend(index_range)
+        self.value.extend([xi[j] for j in index_range])
+        self.row_ptr.append(len(self.index))
+        self.y.append(yi)
+
+    def save(self, dest_file):
+        """
+        Write the instances to *dest_file* in LIBSVM format.
+        """
+        with open(dest_file, 'w') as fout:
+            for i in xrange(len(self.y)):
+                begin, end = self.row_ptr[i], self.row_ptr[i + 1]
+                fout.write('%.17g%s\n' % (self.y[i], ''.join(' %d:%.17g' % (self.index[k], self.value[k])
+                        for k in xrange(begin, end))))
+
+    def c_array(self, name):
+        a = getattr(self, name)
+        ctype = c_double if a.typecode == 'd' else c_int64
+        return (ctype * len(a)).from_buffer(a)
+
+
+class NgramIndex(Structure):
+    _names = ["keys", "vals", "capacity", "size"]
+    _types = [POINTER(c_int64), POINTER(c_int64), c_int64, c_int64]
+    _fields_ = genFields(_names, _types)
+
+
 fillprototype(util.read_problem, SVMProblem, [c_char_p, c_double, POINTER(c_int64)])
+fillprototype(util.build_problem, SVMProblem, [POINTER(c_double), POINTER(c_int64), POINTER(c_int64),
+        POINTER(c_double), c_int64, c_double, c_int64, POINTER(c_int64)])
 fillprototype(util.freeSVMProblem, None, [SVMProblem])
 fillprototype(util.compute_idf, c_double, [POINTER(liblinear.problem), POINTER(c_double)])
-fillprototype(util.normalize, None, [POINTER(liblinear.problem), c_int, c_int, c_int, c_int, POINTER(c_double)])
+fillprototype(util.normalize, None, [POINTER(liblinear.problem), c_int, c_int, c_int, c_int, POINTER(c_double),
+        c_int64])
+fillprototype(util.confusion_update, None, [POINTER(c_int64), c_int64, POINTER(c_int64), POINTER(c_int64), c_int64])
+fillprototype(util.ngram_index_get, c_int64, [POINTER(NgramIndex), c_int64])
+fillprototype(util.ngram_index_set, None, [POINTER(NgramIndex), c_int64, c_int64])
+fillprototype(util.ngram_index_rehash, None, [POINTER(NgramIndex), POINTER(NgramIndex)])
+fillprototype(util.ngram_index_features, c_int64, [POINTER(NgramIndex), POINTER(c_int64), c_int64, c_int64, c_int,
+        c_int64, POINTER(c_int64), POINTER(c_int64), POINTER(c_int64)])
+fillprototype(util.ngram_index_prune_remap, c_int64, [POINTER(NgramIndex), POINTER(c_int64), c_int64])
+fillprototype(util.ngram_index_prune, None, [POINTER(NgramIndex), POINTER(NgramIndex), POINTER(c_int64)])
+fillprototype(util.feature_df, None, [POINTER(c_int64), c_int64, POINTER(c_int64)])
+fillprototype(util.remap_features, c_int64, [POINTER(c_int64), POINTER(c_int64), POINTER(c_double), c_int64,
+        POINTER(c_int64), c_int64])
+fillprototype(util.compact_model, c_int64, [POINTER(liblinear.model), c_double, POINTER(c_int64), POINTER(c_int64),
+        POINTER(c_double)])
+fillprototype(util.predict_topk, c_int64, [POINTER(liblinear.problem), POINTER(c_int64), POINTER(c_int64),
+        POINTER(c_double), c_int64, c_int64, c_int64, POINTER(c_int64), POINTER(c_double)])
+fillprototype(util.hash_features, c_int64, [c_char_p, POINTER(c_int64), c_int64, c_int64, c_int64, POINTER(c_ubyte),
+        POINTER(c_int64), POINTER(c_int64), POINTER(c_int64), POINTER(c_int64)])
+fillprototype(util.predict_quantized, c_int64, [POINTER(POINTER(liblinear.feature_node)), c_int64, c_void_p,
+        POINTER(c_double), c_int64, c_double, c_int64, c_int64, POINTER(c_int64), c_int, POINTER(c_double),
+        POINTER(c_double)])
+fillprototype(util.quantize_float, None, [POINTER(c_double), c_int64, POINTER(c_float)])
+fillprototype(util.quantize_int8, None, [POINTER(c_double), c_int64, c_int64, POINTER(c_byte), POINTER(c_double)])
+fillprototype(util.dequantize, None, [c_void_p, POINTER(c_double), c_int64, c_int64, POINTER(c_double)])
+fillprototype(util.remap_weights, None, [POINTER(c_double), c_int64, c_int64, c_int, POINTER(c_int64), c_int64,
+        POINTER(c_double)])
+fillprototype(util.normalize_one, None, [POINTER(liblinear.feature_node), c_int, c_int, c_int, c_int, POINTER(c_double), c_int64])
+
+
+class LearnerQuantizedWeights(object):
+    """
+    Weights of a :class:`LearnerModel` stored as ``'float32'``, or as
+    ``'int8'`` scaled per label: weight vector k is ``scale[k]`` times
+    signed bytes, with ``scale[k]`` its largest absolute weight over 127.
+    The layout is that of LIBLINEAR's ``double`` weights.
+    """
+
+    _ctypes = {'float32': c_float, 'int8': c_byte}
+
+    def __init__(self, kind, w, scale=None):
+        if kind not in self._ctypes:
+            raise ValueError("The weights should be 'float32' or 'int8'.")
+        self.kind = kind
+        self.w = w
+        self.scale = scale
+
+    @staticmethod
+    def quantize(kind, w, n, nr_w):
+        """
+        Quantize the *n* * *nr_w* ``double`` weights *w*.
+        """
+        if kind == 'float32':
+            q = (c_float * (n * nr_w))()
+            util.quantize_float(w, n * nr_w, q)
+            return LearnerQuantizedWeights(kind, q)
+        if kind == 'int8':
+            q = (c_byte * (n * nr_w))()
+            scale = (c_double * nr_w)()
+            util.quantize_int8(w, n, nr_w, q, scale)
+            return LearnerQuantizedWeights(kind, q, scale)
+        raise ValueError("The weights should be 'float32' or 'int8'.")
+
+    def dequantize(self, nr_w):
+        w = (c_double * len(self.w))()
+        util.dequantize(self.w, self.scale, len(self.w) // nr_w, nr_w, w)
+        return w
+
+    def __getitem__(self, i):
+        if self.scale is None:
+            return self.w[i]
+        return self.w[i] * self.scale[i % len(self.scale)]
+
+    def predict(self, m, x, l, labels, dec_values):
+        """
+        Predict the *l* instances *x*, a ``feature_node`` pointer array,
+        with :class:`LearnerModel` *m* as LIBLINEAR's ``predict_values``.
+        """
+        regression = m.param.solver_type in (liblinear.L2R_L2LOSS_SVR, liblinear.L2R_L1LOSS_SVR_DUAL,
+                liblinear.L2R_L2LOSS_SVR_DUAL)
+        status = util.predict_quantized(x, l, self.w, self.scale, m.nr_feature, m.bias, m._nr_w(), m.nr_class,
+                m.label, regression, labels, dec_values)
+        if status == -2:
+            raise MemoryError("Memory Exhausted. Try to restart python.")
 
 
 class LearnerProblem(liblinear.problem):
     def __init__(self, src):
+        """
+        *src* is the file path of the LIBSVM-format data or a
+        :class:`LearnerProblemBuffer` holding the instances in memory.
+        """
         #svmprob = util.read_problem(src.encode(), 0)  # bias = 0 is required
-        svmprob = read_SVMProblem(src)  # bias = 0 is required
+        if isinstance(src, LearnerProblemBuffer):
+            svmprob = build_SVMProblem(src)  # bias = 0 is required
+        else:
+            svmprob = read_SVMProblem(src)  # bias = 0 is required
         self.x = svmprob.prob.x
         self.y = svmprob.prob.y
         self.l = svmprob.prob.l
@@ -120,44 +334,26 @@ class LearnerProblem(liblinear.problem):
             learner_param.inst_normalization,
             learner_param.term_frequency,
             learner_param.inverse_document_frequency,
-            idf)
+            idf, len(idf) if idf is not None else 0)
 
     @staticmethod
     def normalize_one(xi, learner_param, idf):
         """
-        The maximum index of xi should be less
-        or equal to the weight vector size.
+        Normalize the instance *xi* in place, in the same way as
+        :meth:`normalize` does for every instance of a problem.
+        Only the first ``len(idf)`` features are weighted by *idf*.
         """
-        norm = 0
-        word_count = 0
-        i = 0
-        while xi[i].index != -1:
-            idx = xi[i].index-1
-            if learner_param.binary_feature:
-                xi[i].value = xi[i].value != 0
-
-            word_count += abs(xi[i].value)
-
-            if learner_param.inverse_document_frequency and idx < len(idf):
-                xi[i].value *= idf[idx]
-
-            norm += xi[i].value * xi[i].value
-            i += 1
-
-        norm **= .5
-
-
-        if learner_param.term_frequency:
-            i = 0
-            while xi[i].index != -1:
-                xi[i].value /= word_count
-                i += 1
-
-        if learner_param.inst_normalization:
-            i = 0
-            while xi[i].index != -1:
-                xi[i].value /= norm
-                i += 1
+        n_idf = 0
+        if idf is not None:
+            n_idf = len(idf)
+            if not isinstance(idf, Array):
+                idf = (c_double * n_idf)(*idf)
+        util.normalize_one(xi,
+            learner_param.binary_feature,
+            learner_param.inst_normalization,
+            learner_param.term_frequency,
+            learner_param.inverse_document_frequency,
+            idf, n_idf)
 
     def compute_idf(self):
         idf = (c_double * self.n)()
@@ -180,7 +376,10 @@ class LearnerParameter(liblinear.parameter):
     >>> param = LearnerParameter(['-N', '1', '-T', '1'], ['-c', '2', '-e', '1e-2'])
 
     *liblinear_opts* is LIBLINEAR's parameters. Refer to LIBLINEAR's
-    document for more details. *learner_opts* includes options for feature
+    document for more details. The bundled LIBLINEAR also takes
+    ``-n nr_thread``, which trains the classes of one-vs-rest solvers
+    (all but ``-s 4``) in *nr_thread* threads; the model does not depend
+    on *nr_thread*. *learner_opts* includes options for feature
     representation and instance-wise normalization. The preprocessor of
     LibShortText converts text files to LIBSVM-format data, where the
     features are word counts. All *value* in the options should be either
@@ -303,26 +502,41 @@ class LearnerModel(liblinear.model):
 
         if isinstance(param, LearnerParameter):
             self.param_options = param.raw_options
+            self.learner_param = param
         elif isinstance(param, tuple):
             self.param_options = param
+            self.learner_param = LearnerParameter(param[0], param[1])
         else:
             raise TypeError("param should be a LearnerParameter or a tuple.")
 
-        if idf is not None:
+        if isinstance(idf, Array):
+            # e.g. memory-mapped from a binary model, used as it is
+            self.idf = self.idf_buffer = idf
+        elif idf is not None:
             self.idf = idf[:self.c_model.nr_feature + (self.c_model.bias >= 0)]
+            self.idf_buffer = (c_double * len(self.idf))(*self.idf)
         else:
             self.idf = None
+            self.idf_buffer = None
 
         for attr in c_model._names:
             setattr(self, attr, getattr(c_model, attr))
 
+        # the bias term of test instances, see predict_one
+        self.bias_node = liblinear.feature_node(self.nr_feature + 1, self.bias)
+        # see compact
+        self.compact_weights = None
+        # see quantize
+        self.quantized = None
+
         self._reconstruct_label_idx()
 
     def get_weight(self, j, k):
         """
         Return the weight of feature *j* and label *k*.
         """
-        return self.c_model.w[(j-1)*self.c_model.nr_class + self.labelidx[k]]
+        w = self.c_model.w if self.quantized is None else self.quantized
+        return w[(j-1)*self.c_model.nr_class + self.labelidx[k]]
 
     def get_labels(self):
         """
@@ -330,26 +544,166 @@ class LearnerModel(liblinear.model):
         """
         return self.label[:self.nr_class]
 
+    def _nr_w(self):
+        if self.nr_class == 2 and self.param.solver_type != liblinear.MCSVM_CS:
+            return 1
+        return self.nr_class
+
+    def remap_features(self, remap, nr_feature):
+        """
+        Return a copy of this model whose feature j is feature
+        ``remap[j]`` of *nr_feature* features, as renumbered by
+        :meth:`tgrocery.converter.GroceryFeatureGenerator.prune`. The
+        weights of features mapped to 0 or beyond *nr_feature* are dropped.
+        *remap* must have an element for each feature of this model.
+        """
+        if len(remap) <= self.nr_feature:
+            raise ValueError("remap should cover the %d features of the model." % self.nr_feature)
+        nr_w = self._nr_w()
+        has_bias = self.bias >= 0
+        w = (c_double * ((nr_feature + has_bias) * nr_w))()
+        util.remap_weights(self._dense_c_model().w, self.nr_feature, nr_w, has_bias, remap, nr_feature, w)
+        idf = None
+        if self.idf is not None:
+            idf = [1.0] * (nr_feature + has_bias)
+            for j in xrange(1, min(len(self.idf), self.nr_feature) + 1):
+                if 0 < remap[j] <= nr_feature:
+                    idf[remap[j] - 1] = self.idf[j - 1]
+            if has_bias and len(self.idf) > self.nr_feature:
+                idf[nr_feature] = self.idf[self.nr_feature]
+
+        c_model = liblinear.model()
+        c_model.param = liblinear.parameter()
+        c_model.param.solver_type = self.param.solver_type
+        c_model.nr_class = self.nr_class
+        c_model.nr_feature = nr_feature
+        c_model.bias = self.bias
+        label = (c_int64 * self.nr_class)(*self.get_labels())
+        c_model.label = label
+        c_model.w = cast(w, POINTER(c_double))
+        c_model.buffers = (label, w)  # prevent GC
+        return LearnerModel(c_model, self.param_options, idf)
+
+    def quantize(self, weights='int8'):
+        """
+        Return a copy of this model with the weights stored as *weights*,
+        ``'float32'`` or ``'int8'``, see :class:`LearnerQuantizedWeights`,
+        which all prediction functions use. It holds no ``double`` weights
+        and is saved in binary form by :meth:`save`.
+        """
+        nr_w = self._nr_w()
+        quantized = LearnerQuantizedWeights.quantize(weights, self._dense_c_model().w,
+                self.nr_feature + (self.bias >= 0), nr_w)
+
+        c_model = liblinear.model()
+        c_model.param = liblinear.parameter()
+        c_model.param.solver_type = self.param.solver_type
+        c_model.nr_class = self.nr_class
+        c_model.nr_feature = self.nr_feature
+        c_model.bias = self.bias
+        label = (c_int64 * self.nr_class)(*self.get_labels())
+        c_model.label = label
+        c_model.buffers = (label,)  # prevent GC
+        m = LearnerModel(c_model, self.param_options, self.idf)
+        m.quantized = quantized
+        return m
+
+    def _dense_c_model(self):
+        # a LIBLINEAR model with double weights, dequantized if need be
+        if self.quantized is None:
+            return self.c_model
+        c_model = liblinear.model()
+        for attr in ('param', 'nr_class', 'nr_feature', 'bias', 'label'):
+            setattr(c_model, attr, getattr(self.c_model, attr))
+        w = self.quantized.dequantize(self._nr_w())
+        c_model.w = cast(w, POINTER(c_double))
+        c_model.buffers = (self.c_model.buffers, w)  # prevent GC
+        return c_model
+
+    def compact(self, threshold=1e-3):
+        """
+        Keep the weights whose absolute values exceed *threshold* in
+        compressed sparse rows by feature, which :func:`predict_topk`
+        scores instances against. Return the number of weights kept.
+
+        The compact weights are held in addition to the dense ones, which
+        the other functions still use, and are not saved: compacting
+        costs memory, up to twice that of the dense weights for a dense
+        model, and it does not make a saved model smaller.
+
+        The dropped weights move a decision value by at most *threshold*
+        times the sum of the instance's (normalized) feature values; a
+        larger *threshold* keeps fewer weights and predicts faster.
+        """
+        c_model = self._dense_c_model()
+        row_ptr = (c_int64 * (self.nr_feature + 2))()
+        nnz = util.compact_model(c_model, threshold, row_ptr, None, None)
+        col = (c_int64 * nnz)()
+        val = (c_double * nnz)()
+        util.compact_model(c_model, threshold, row_ptr, col, val)
+        self.compact_weights = (row_ptr, col, val)
+        return nnz
+
     def load(self, model_dir):
         """
         Load the contents from a :class:`TextModel` directory.
         """
 
-        self.c_model = liblinear_load_model(path.join(model_dir,'liblinear_model'))
-
         options_file = path.join(model_dir,'options.pickle')
         self.param_options = cPickle.load(open(options_file,'rb'))
 
+        if path.exists(path.join(model_dir,'model.pickle')):
+            self._load_binary(model_dir)
+            return
+
+        self.c_model = liblinear_load_model(path.join(model_dir,'liblinear_model'))
+
         idf_file = path.join(model_dir,'idf.pickle')
         self.idf = cPickle.load(open(idf_file,'rb'))
 
-        self.__init__(self.c_model, LearnerParameter(self.param_options[0], self.param_options[1]), self.idf)
+        self.__init__(self.c_model, self.param_options, self.idf)
+
+    def _load_binary(self, model_dir):
+        meta = cPickle.load(open(path.join(model_dir,'model.pickle'),'rb'))
+
+        c_model = liblinear.model()
+        c_model.param = liblinear.parameter()
+        c_model.param.solver_type = meta['solver_type']
+        c_model.nr_class = meta['nr_class']
+        c_model.nr_feature = meta['nr_feature']
+        c_model.bias = meta['bias']
+        label = (c_int64 * meta['nr_class'])(*meta['label'])
+        c_model.label = label
+        quantized = None
+        weights = meta.get('weights', 'float64')
+        if weights == 'float64':
+            w = _mmap_array(path.join(model_dir,'weights.bin'))
+            c_model.w = cast(w, POINTER(c_double))
+        else:
+            w = _mmap_array(path.join(model_dir,'weights.%s.bin' % weights), LearnerQuantizedWeights._ctypes[weights])
+            scale = None
+            if meta['scale'] is not None:
+                scale = (c_double * len(meta['scale']))(*meta['scale'])
+            quantized = LearnerQuantizedWeights(weights, w, scale)
+        c_model.buffers = (label, w)  # prevent GC
+
+        self.idf = None
+        if meta['idf']:
+            self.idf = _mmap_array(path.join(model_dir,'idf.bin'))
 
-    def save(self, model_dir, force=False):
+        self.__init__(c_model, self.param_options, self.idf)
+        self.quantized = quantized
+
+    def save(self, model_dir, force=False, binary=False):
         """
         Save the model to a directory. If *force* is set to ``True``,
         the existing directory will be overwritten; otherwise,
         :class:`IOError` will be raised.
+
+        If *binary* is ``True``, the weights and idf are written as raw
+        ``double`` arrays, which :meth:`load` memory-maps instead of
+        parsing. Quantized weights are always written this way, in their
+        own type.
         """
 
         if path.exists(model_dir):
@@ -359,12 +713,40 @@ class LearnerModel(liblinear.model):
                 raise OSError('Please use force option to overwrite the existing files.')
         os.mkdir(model_dir)
 
-        liblinear_save_model(path.join(model_dir,'liblinear_model'), self.c_model)
         options_file = path.join(model_dir,'options.pickle')
         cPickle.dump(self.param_options, open(options_file,'wb'),-1)
 
+        if binary or self.quantized is not None:
+            meta = {
+                'solver_type': self.param.solver_type,
+                'nr_class': self.nr_class,
+                'nr_feature': self.nr_feature,
+                'bias': self.bias,
+                'label': self.label[:self.nr_class],
+                'idf': self.idf is not None,
+                'weights': 'float64',
+            }
+            if self.quantized is not None:
+                meta['weights'] = self.quantized.kind
+                meta['scale'] = self.quantized.scale[:] if self.quantized.scale is not None else None
+            cPickle.dump(meta, open(path.join(model_dir,'model.pickle'),'wb'),-1)
+            if self.quantized is not None:
+                with open(path.join(model_dir,'weights.%s.bin' % self.quantized.kind),'wb') as fout:
+                    fout.write(string_at(self.quantized.w, sizeof(self.quantized.w)))
+            else:
+                w_size = (self.nr_feature + (self.bias >= 0)) * self._nr_w()
+                with open(path.join(model_dir,'weights.bin'),'wb') as fout:
+                    fout.write(string_at(self.w, w_size * sizeof(c_double)))
+            if self.idf is not None:
+                with open(path.join(model_dir,'idf.bin'),'wb') as fout:
+                    fout.write(string_at(self.idf_buffer, len(self.idf_buffer) * sizeof(c_double)))
+            return
+
+        liblinear_save_model(path.join(model_dir,'liblinear_model'), self.c_model)
+
         idf_file = path.join(model_dir,'idf.pickle')
-        cPickle.dump(self.idf, open(idf_file,'wb'),-1)
+        idf = self.idf[:] if self.idf is not None else None
+        cPickle.dump(idf, open(idf_file,'wb'),-1)
 
     def __str__(self):
         if type(self.param_options) is tuple and len(self.param_options) > 0:
@@ -373,17 +755,27 @@ class LearnerModel(liblinear.model):
             return 'empty LearnerModel'
 
 
-def train(data_file_name, learner_opts="", liblinear_opts=""):
+def train(data_file_name, learner_opts="", liblinear_opts="", init_model=None):
     """
     Return a :class:`LearnerModel`.
 
-    *data_file_name* is the file path of the LIBSVM-format data. *learner_opts* is a
+    *data_file_name* is the file path of the LIBSVM-format data, or a
+    :class:`LearnerProblemBuffer` if the data are already in memory. *learner_opts* is a
     :class:`str`. Refer to :ref:`learner_param`. *liblinear_opts* is a :class:`str` of
     LIBLINEAR's parameters. Refer to LIBLINEAR's document.
+
+    If *init_model* is a :class:`LearnerModel`, the solver starts from its
+    weights instead of zero, matched by label and feature index, which
+    usually takes far fewer iterations when the data have only grown.
+    Only the primal solvers (``-s 0``, ``-s 2`` and ``-s 11``) can start
+    from given weights; the others ignore *init_model*.
     """
 
     learner_prob = LearnerProblem(data_file_name)
     learner_param = LearnerParameter(learner_opts, liblinear_opts)
+    if init_model is not None:
+        init_c_model = init_model._dense_c_model()
+        learner_param.init_model = addressof(init_c_model)
 
     idf = None
     if learner_param.inverse_document_frequency:
@@ -392,12 +784,79 @@ def train(data_file_name, learner_opts="", liblinear_opts=""):
     learner_prob.normalize(learner_param, idf)
 
     m = liblinear_train(learner_prob, learner_param)
+    learner_param.init_model = None
     if not learner_param.cross_validation:
         m.x_space = None  # This is required to reduce the memory usage...
         m = LearnerModel(m, learner_param, idf)
     return m
 
 
+def grid_search(data_file_name, learner_opts="", liblinear_opts_list=("",), nr_fold=5, nr_thread=1, seed=0):
+    """
+    Return, for each :class:`str` of LIBLINEAR's parameters in
+    *liblinear_opts_list*, the ``(accuracy, seconds)`` of each of the
+    *nr_fold* folds of a cross validation.
+
+    *data_file_name* and *learner_opts* are as in :func:`train`. The data
+    are read and normalized once and shared by all folds and settings,
+    whose ``nr_fold * len(liblinear_opts_list)`` trainings run in
+    *nr_thread* threads. The folds are the same for every setting and
+    only depend on *seed*.
+    """
+
+    learner_prob = LearnerProblem(data_file_name)
+    learner_params = [LearnerParameter(learner_opts, liblinear_opts) for liblinear_opts in liblinear_opts_list]
+    for learner_param in learner_params:
+        err_msg = liblinear.liblinear.check_parameter(learner_prob, learner_param)
+        if err_msg:
+            raise ValueError('Error: %s' % err_msg)
+
+    idf = None
+    if learner_params[0].inverse_document_frequency:
+        idf = learner_prob.compute_idf()
+    learner_prob.normalize(learner_params[0], idf)
+
+    l = learner_prob.l
+    if not 2 <= nr_fold <= l:
+        raise ValueError("n-fold cross validation: n must be in [2, number of instances]")
+    rows = range(l)
+    random.Random(seed).shuffle(rows)
+    perm = (c_int64 * l)(*rows)
+    fold_start = [i * l // nr_fold for i in range(nr_fold + 1)]
+    targets = [(c_double * l)() for learner_param in learner_params]
+
+    def run_fold(task):
+        k, i = task
+        begin, end = fold_start[i], fold_start[i + 1]
+        start = time.time()
+        liblinear.liblinear.cross_validation_fold(learner_prob, learner_params[k], perm, begin, end, targets[k])
+        seconds = time.time() - start
+        correct = sum(1 for j in rows[begin:end] if targets[k][j] == learner_prob.y[j])
+        return float(correct) / (end - begin), seconds
+
+    results = [[None] * nr_fold for learner_param in learner_params]
+    pool = ThreadPool(nr_thread)
+    try:
+        # settings sharing a bias term run together, since the bias is set on the
+        # shared problem, and so do those sharing -q, since LIBLINEAR's print
+        # function is global
+        groups = sorted(set((learner_param.bias, learner_param.print_func is liblinear.PRINT_NULL)
+                for learner_param in learner_params))
+        for bias, quiet in groups:
+            learner_prob.set_bias(bias)
+            liblinear.liblinear.set_print_string_function(liblinear.PRINT_NULL if quiet
+                    else cast(None, liblinear.PRINT_STRING_FUN))
+            tasks = [(k, i) for k, learner_param in enumerate(learner_params)
+                    if (learner_param.bias, learner_param.print_func is liblinear.PRINT_NULL) == (bias, quiet)
+                    for i in range(nr_fold)]
+            for (k, i), result in zip(tasks, pool.map(run_fold, tasks)):
+                results[k][i] = result
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
 def predict_one(xi, m):
     """
     Return the label and a :class:`c_double` array of decision values of
@@ -424,7 +883,7 @@ def predict_one(xi, m):
     elif not isinstance(xi, POINTER(liblinear.feature_node)):
         raise TypeError("xi should be a test instance")
 
-    learner_param = LearnerParameter(m.param_options[0], m.param_options[1])
+    learner_param = m.learner_param
 
     if m.bias >= 0:
         i = 0
@@ -436,17 +895,113 @@ def predict_one(xi, m):
         if i > 0 and xi[i-1].index == m.nr_feature + 1:
             i -= 1
 
-        xi[i] = liblinear.feature_node(m.nr_feature + 1, m.bias)
+        xi[i] = m.bias_node
         xi[i+1] = liblinear.feature_node(-1, 0)
 
-    LearnerProblem.normalize_one(xi, learner_param, m.idf)
+    LearnerProblem.normalize_one(xi, learner_param, m.idf_buffer)
 
     dec_values = (c_double * m.nr_class)()
+    if m.quantized is not None:
+        label = (c_double * 1)()
+        m.quantized.predict(m, (POINTER(liblinear.feature_node) * 1)(xi), 1, label, dec_values)
+        return label[0], dec_values
     label = liblinear.liblinear.predict_values(m, xi, dec_values)
 
     return label, dec_values
 
 
+def _build_test_problem(xs, m):
+    # the test instances xs in one problem, normalized as in training
+    if not isinstance(xs, LearnerProblemBuffer):
+        buf = LearnerProblemBuffer()
+        for xi in xs:
+            buf.append(xi)
+        xs = buf
+
+    svmprob = build_SVMProblem(xs, m.bias, m.nr_feature + 1)
+    learner_param = m.learner_param
+
+    # features unseen in training are not weighted, as in predict_one
+    idf = m.idf_buffer
+    util.normalize(pointer(svmprob.prob),
+        learner_param.binary_feature,
+        learner_param.inst_normalization,
+        learner_param.term_frequency,
+        learner_param.inverse_document_frequency,
+        idf, len(idf) if idf is not None else 0)
+
+    return svmprob
+
+
+def predict_batch(xs, m, dec_values=False):
+    """
+    Return the labels and, if *dec_values* is ``True``, the decision
+    values of the test instances *xs* using :class:`LearnerModel` *m*.
+
+    *xs* is a :class:`LearnerProblemBuffer` or an iterable of
+    :class:`dict` as accepted by :func:`predict_one`. The instances are
+    stored in one contiguous ``feature_node`` buffer, normalized by a
+    single ``util.normalize`` call and predicted in C.
+
+    The labels are a :class:`c_double` array of length ``l``. The decision
+    values are ``None`` or a :class:`c_double` array of length
+    ``l * m.nr_class``, where the decision value of instance i and class
+    k is ``all_dec_values[i * m.nr_class + k]``.
+    """
+
+    svmprob = _build_test_problem(xs, m)
+    l = svmprob.prob.l
+    labels = (c_double * l)()
+    all_dec_values = None
+    if dec_values:
+        all_dec_values = (c_double * (l * m.nr_class))()
+    if m.quantized is not None:
+        m.quantized.predict(m, svmprob.prob.x, l, labels, all_dec_values)
+    else:
+        liblinear.liblinear.predict_values_batch(m, svmprob.prob, labels, all_dec_values)
+
+    return labels, all_dec_values
+
+
+def predict_topk(xs, m, k=3):
+    """
+    Return the *k* best labels of each test instance in *xs* and their
+    decision values, using :class:`LearnerModel` *m*.
+
+    *xs* is as in :func:`predict_batch`. The instances are scored against
+    the weights of :meth:`LearnerModel.compact` only, which are compacted
+    with the default threshold on first use, so the cost depends on the
+    nonzero weights of their features rather than on the number of
+    labels.
+
+    Both results are arrays of length ``l * k`` (*k* is at most
+    ``m.nr_class``), where the j-th best label of instance i and its
+    decision value are at ``i * k + j``. The labels are a
+    :class:`c_int64` array, the decision values a :class:`c_double` one.
+    The labels rank and score as in :func:`predict_batch`, up to the
+    weights left out by the compaction; e.g. the second label of a
+    two-class one-vs-rest model always scores 0.
+    """
+
+    if m.compact_weights is None:
+        m.compact()
+    row_ptr, col, val = m.compact_weights
+    k = min(k, m.nr_class)
+
+    svmprob = _build_test_problem(xs, m)
+    l = svmprob.prob.l
+    top_idx = (c_int64 * (l * k))()
+    top_val = (c_double * (l * k))()
+    status = util.predict_topk(svmprob.prob, row_ptr, col, val, len(row_ptr) - 1, m.nr_class, k, top_idx, top_val)
+    if status == -2:
+        raise MemoryError("Memory Exhausted. Try to restart python.")
+
+    label = m.label
+    for i in xrange(l * k):
+        top_idx[i] = label[top_idx[i]]
+    return top_idx, top_val
+
+
 def predict(data_file_name, m, liblinear_opts=""):
     """
     Return a quadruple: the predicted labels, the accuracy, the decision values, and the
@@ -465,13 +1020,7 @@ def predict(data_file_name, m, liblinear_opts=""):
     """
 
     learner_prob = LearnerProblem(data_file_name)
-    learner_param = LearnerParameter(m.param_options[0], m.param_options[1])
-
-    idf = None
-    if m.idf:
-        idf = (c_double * len(m.idf))()
-        for i in range(len(m.idf)): idf[i] = m.idf[i]
-    learner_prob.normalize(learner_param, idf)
+    learner_prob.normalize(m.learner_param, m.idf_buffer)
 
     all_dec_values = []
     acc = 0
@@ -479,9 +1028,14 @@ def predict(data_file_name, m, liblinear_opts=""):
     ty = []  # true y
 
     dec_values = (c_double * m.nr_class)()
+    label_buf = (c_double * 1)()
 
     for i in range(learner_prob.l):
-        label = liblinear.liblinear.predict_values(m, learner_prob.x[i], dec_values)
+        if m.quantized is not None:
+            m.quantized.predict(m, pointer(learner_prob.x[i]), 1, label_buf, dec_values)
+            label = label_buf[0]
+        else:
+            label = liblinear.liblinear.predict_values(m, learner_prob.x[i], dec_values)
         all_dec_values += [dec_values[:m.nr_class]]
         py += [label]
         ty += [learner_prob.y[i]]
@@ -44,6 +44,26 @@ static void info(const char *fmt,...)
 static void info(const char *fmt,...) {}
 #endif
 
+// pseudo-random numbers for the solvers' shuffling
+//
+// The state is private to each OpenMP thread and reseeded for each
+// class, so a model does not depend on how classes are spread over
+// threads, nor on what was trained before in the same process.
+static unsigned long long rand_state = 1;
+#pragma omp threadprivate(rand_state)
+
+static void seed_rand(INT64 seed)
+{
+	rand_state = (unsigned long long) seed + 1;
+}
+
+static INT64 next_rand()
+{
+	// 64-bit LCG with Knuth's MMIX constants; the high bits are the random ones
+	rand_state = rand_state * 6364136223846793005ULL + 1442695040888963407ULL;
+	return (INT64) (rand_state >> 33);
+}
+
 class l2r_lr_fun: public function
 {
 public:
@@ -586,7 +606,7 @@ void Solver_MCSVM_CS::Solve(double *w)
 		double stopping = -INF;
 		for(i=0;i<active_size;i++)
 		{
-			INT64 j = i+rand()%(active_size-i);
+			INT64 j = i+next_rand()%(active_size-i);
 			swap(index[i], index[j]);
 		}
 		for(s=0;s<active_size;s++)
@@ -849,7 +869,7 @@ static void solve_l2r_l1l2_svc(
 
 		for (i=0; i<active_size; i++)
 		{
-			INT64 j = i+rand()%(active_size-i);
+			INT64 j = i+next_rand()%(active_size-i);
 			swap(index[i], index[j]);
 		}
 
@@ -1057,7 +1077,7 @@ static void solve_l2r_l1l2_svr(
 
 		for(i=0; i<active_size; i++)
 		{
-			INT64 j = i+rand()%(active_size-i);
+			INT64 j = i+next_rand()%(active_size-i);
 			swap(index[i], index[j]);
 		}
 
@@ -1277,7 +1297,7 @@ void solve_l2r_lr_dual(const problem *prob, double *w, double eps, double Cp, do
 	{
 		for (i=0; i<l; i++)
 		{
-			INT64 j = i+rand()%(l-i);
+			INT64 j = i+next_rand()%(l-i);
 			swap(index[i], index[j]);
 		}
 		INT64 newton_iter = 0;
@@ -1458,7 +1478,7 @@ static void solve_l1r_l2_svc(
 
 		for(j=0; j<active_size; j++)
 		{
-			INT64 i = j+rand()%(active_size-j);
+			INT64 i = j+next_rand()%(active_size-j);
 			swap(index[i], index[j]);
 		}
 
@@ -1833,7 +1853,7 @@ static void solve_l1r_lr(
 
 			for(j=0; j<QP_active_size; j++)
 			{
-				INT64 i = j+rand()%(QP_active_size-j);
+				INT64 i = j+next_rand()%(QP_active_size-j);
 				swap(index[i], index[j]);
 			}
 
@@ -2270,6 +2290,47 @@ static void train_one(const problem *prob, const parameter *param, double *w, do
 	}
 }
 
+// starting point of the problem of class label (one-vs-rest, label
+// positive), or of the regression problem, taken from param->init_model
+//
+// The weights of features and classes the initial model does not have
+// start at zero. Only the primal solvers (-s 0, 2 and 11) start from w;
+// the others reset it.
+static void init_w(const parameter *param, INT64 label, double *w, INT64 w_size, INT64 nr_feature, double bias)
+{
+	const model *init = param->init_model;
+	INT64 j, k = -1;
+	double sign = 1;
+
+	for(j=0;j<w_size;j++)
+		w[j] = 0;
+	if(init == NULL)
+		return;
+
+	INT64 nr_w = init->nr_class;
+	if(init->label == NULL || (init->nr_class == 2 && init->param.solver_type != MCSVM_CS))
+		nr_w = 1;
+	if(init->label == NULL)
+		k = 0;
+	else
+		for(j=0;j<init->nr_class;j++)
+			if(init->label[j] == label)
+				k = j;
+	if(k < 0)
+		return;
+	if(nr_w == 1 && k == 1)
+	{
+		// a binary model keeps only the w of its first label
+		sign = -1;
+		k = 0;
+	}
+
+	for(j=0;j<min(nr_feature, init->nr_feature);j++)
+		w[j] = sign*init->w[j*nr_w+k];
+	if(bias >= 0 && init->bias >= 0)
+		w[nr_feature] = sign*init->w[init->nr_feature*nr_w+k];
+}
+
 //
 // Interface functions
 //
@@ -2286,6 +2347,7 @@ model* train(const problem *prob, const parameter *param)
 	else
 		model_->nr_feature=n;
 	model_->param = *param;
+	model_->param.init_model = NULL;
 	model_->bias = prob->bias;
 
 	if(param->solver_type == L2R_L2LOSS_SVR ||
@@ -2295,6 +2357,8 @@ model* train(const problem *prob, const parameter *param)
 		model_->w = Malloc(double, w_size);
 		model_->nr_class = 2;
 		model_->label = NULL;
+		init_w(param, 0, model_->w, w_size, model_->nr_feature, prob->bias);
+		seed_rand(0);
 		train_one(prob, param, &model_->w[0], 0, 0);
 	}
 	else
@@ -2351,6 +2415,7 @@ model* train(const problem *prob, const parameter *param)
 				for(j=start[i];j<start[i]+count[i];j++)
 					sub_prob.y[j] = i;
 			Solver_MCSVM_CS Solver(&sub_prob, nr_class, weighted_C, param->eps);
+			seed_rand(0);
 			Solver.Solve(model_->w);
 		}
 		else
@@ -2366,31 +2431,43 @@ model* train(const problem *prob, const parameter *param)
 				for(; k<sub_prob.l; k++)
 					sub_prob.y[k] = -1;
 
+				init_w(param, label[0], model_->w, w_size, model_->nr_feature, prob->bias);
+				seed_rand(0);
 				train_one(&sub_prob, param, &model_->w[0], weighted_C[0], weighted_C[1]);
 			}
 			else
 			{
 				model_->w=Malloc(double, w_size*nr_class);
-				double *w=Malloc(double, w_size);
+				INT64 nr_thread = max(param->nr_thread, (INT64)1);
+
+				// one-vs-rest: the classes are independent problems sharing x,
+				// each thread has its own y and w
+#pragma omp parallel for num_threads(nr_thread) schedule(dynamic)
 				for(i=0;i<nr_class;i++)
 				{
 					INT64 si = start[i];
 					INT64 ei = si+count[i];
+					problem class_prob = sub_prob;
+					class_prob.y = Malloc(double,l);
+					double *w=Malloc(double, w_size);
 
-					k=0;
+					INT64 k=0;
 					for(; k<si; k++)
-						sub_prob.y[k] = -1;
+						class_prob.y[k] = -1;
 					for(; k<ei; k++)
-						sub_prob.y[k] = +1;
-					for(; k<sub_prob.l; k++)
-						sub_prob.y[k] = -1;
+						class_prob.y[k] = +1;
+					for(; k<class_prob.l; k++)
+						class_prob.y[k] = -1;
 
-					train_one(&sub_prob, param, w, weighted_C[i], param->C);
+					init_w(param, label[i], w, w_size, model_->nr_feature, prob->bias);
+					seed_rand(i);
+					train_one(&class_prob, param, w, weighted_C[i], param->C);
 
 					for(INT64 j=0;j<w_size;j++)
 						model_->w[j*nr_class+i] = w[j];
+					free(w);
+					free(class_prob.y);
 				}
-				free(w);
 			}
 
 		}
@@ -2407,6 +2484,39 @@ model* train(const problem *prob, const parameter *param)
 	return model_;
 }
 
+void cross_validation_fold(const problem *prob, const parameter *param, const INT64 *perm, INT64 begin, INT64 end, double *target)
+{
+	INT64 j,k;
+	INT64 l = prob->l;
+	struct problem subprob;
+
+	subprob.bias = prob->bias;
+	subprob.n = prob->n;
+	subprob.l = l-(end-begin);
+	subprob.x = Malloc(struct feature_node*,subprob.l);
+	subprob.y = Malloc(double,subprob.l);
+
+	k=0;
+	for(j=0;j<begin;j++)
+	{
+		subprob.x[k] = prob->x[perm[j]];
+		subprob.y[k] = prob->y[perm[j]];
+		++k;
+	}
+	for(j=end;j<l;j++)
+	{
+		subprob.x[k] = prob->x[perm[j]];
+		subprob.y[k] = prob->y[perm[j]];
+		++k;
+	}
+	struct model *submodel = train(&subprob,param);
+	for(j=begin;j<end;j++)
+		target[perm[j]] = predict(submodel,prob->x[perm[j]]);
+	free_and_destroy_model(&submodel);
+	free(subprob.x);
+	free(subprob.y);
+}
+
 void cross_validation(const problem *prob, const parameter *param, INT64 nr_fold, double *target)
 {
 	INT64 i;
@@ -2414,48 +2524,18 @@ void cross_validation(const problem *prob, const parameter *param, INT64 nr_fold
 	INT64 l = prob->l;
 	INT64 *perm = Malloc(INT64,l);
 
+	seed_rand(0);
 	for(i=0;i<l;i++) perm[i]=i;
 	for(i=0;i<l;i++)
 	{
-		INT64 j = i+rand()%(l-i);
+		INT64 j = i+next_rand()%(l-i);
 		swap(perm[i],perm[j]);
 	}
 	for(i=0;i<=nr_fold;i++)
 		fold_start[i]=i*l/nr_fold;
 
 	for(i=0;i<nr_fold;i++)
-	{
-		INT64 begin = fold_start[i];
-		INT64 end = fold_start[i+1];
-		INT64 j,k;
-		struct problem subprob;
-
-		subprob.bias = prob->bias;
-		subprob.n = prob->n;
-		subprob.l = l-(end-begin);
-		subprob.x = Malloc(struct feature_node*,subprob.l);
-		subprob.y = Malloc(double,subprob.l);
-
-		k=0;
-		for(j=0;j<begin;j++)
-		{
-			subprob.x[k] = prob->x[perm[j]];
-			subprob.y[k] = prob->y[perm[j]];
-			++k;
-		}
-		for(j=end;j<l;j++)
-		{
-			subprob.x[k] = prob->x[perm[j]];
-			subprob.y[k] = prob->y[perm[j]];
-			++k;
-		}
-		struct model *submodel = train(&subprob,param);
-		for(j=begin;j<end;j++)
-			target[perm[j]] = predict(submodel,prob->x[perm[j]]);
-		free_and_destroy_model(&submodel);
-		free(subprob.x);
-		free(subprob.y);
-	}
+		cross_validation_fold(prob, param, perm, fold_start[i], fold_start[i+1], target);
 	free(fold_start);
 	free(perm);
 }
@@ -2509,6 +2589,28 @@ double predict_values(const struct model *model_, const struct feature_node *x,
 	}
 }
 
+void predict_values_batch(const struct model *model_, const struct problem *prob, double *labels, double *dec_values)
+{
+	INT64 i;
+	INT64 nr_class=model_->nr_class;
+	double *dec_buf = dec_values;
+
+	// decision values are still needed by predict_values even if
+	// the caller does not keep them
+	if(dec_values == NULL)
+		dec_buf = Malloc(double, nr_class);
+
+	for(i=0;i<prob->l;i++)
+	{
+		if(dec_values != NULL)
+			dec_buf = dec_values + i*nr_class;
+		labels[i] = predict_values(model_, prob->x[i], dec_buf);
+	}
+
+	if(dec_values == NULL)
+		free(dec_buf);
+}
+
 double predict(const model *model_, const feature_node *x)
 {
 	double *dec_values = Malloc(double, model_->nr_class);
@@ -2628,6 +2730,8 @@ struct model *load_model(const char *model_file_name)
 	parameter& param = model_->param;
 
 	model_->label = NULL;
+	param.nr_thread = 1;
+	param.init_model = NULL;
 
 	char *old_locale = strdup(setlocale(LC_ALL, NULL));
 	setlocale(LC_ALL, "C");
@@ -2779,6 +2883,9 @@ const char *check_parameter(const problem *prob, const parameter *param)
 	if(param->p < 0)
 		return "p < 0";
 
+	if(param->nr_thread <= 0)
+		return "nr_thread <= 0";
+
 	if(param->solver_type != L2R_LR
 		&& param->solver_type != L2R_L2LOSS_SVC_DUAL
 		&& param->solver_type != L2R_L2LOSS_SVC
@@ -27,6 +27,8 @@ struct problem
 
 enum { L2R_LR, L2R_L2LOSS_SVC_DUAL, L2R_L2LOSS_SVC, L2R_L1LOSS_SVC_DUAL, MCSVM_CS, L1R_L2LOSS_SVC, L1R_LR, L2R_LR_DUAL, L2R_L2LOSS_SVR = 11, L2R_L2LOSS_SVR_DUAL, L2R_L1LOSS_SVR_DUAL }; /* solver_type */
 
+struct model;
+
 struct parameter
 {
 	INT64 solver_type;
@@ -38,6 +40,8 @@ struct parameter
 	INT64 *weight_label;
 	double* weight;
 	double p;
+	INT64 nr_thread;	/* threads training one-vs-rest classes */
+	const struct model *init_model;	/* warm start of primal solvers, or NULL */
 };
 
 struct model
@@ -52,8 +56,10 @@ struct model
 
 struct model* train(const struct problem *prob, const struct parameter *param);
 void cross_validation(const struct problem *prob, const struct parameter *param, INT64 nr_fold, double *target);
+void cross_validation_fold(const struct problem *prob, const struct parameter *param, const INT64 *perm, INT64 begin, INT64 end, double *target);
 
 double predict_values(const struct model *model_, const struct feature_node *x, double* dec_values);
+void predict_values_batch(const struct model *model_, const struct problem *prob, double *labels, double *dec_values);
 double predict(const struct model *model_, const struct feature_node *x);
 double predict_probability(const struct model *model_, const struct feature_node *x, double* prob_estimates);
 
@@ -19,6 +19,9 @@ for i, s in enumerate(SOLVER_TYPE):
 PRINT_STRING_FUN = CFUNCTYPE(None, c_char_p)
 def print_null(s): 
 	return 
+# liblinear keeps the print function in a global, so a callback passed to
+# it must outlive any model being trained, possibly in another thread
+PRINT_NULL = PRINT_STRING_FUN(print_null)
 
 def genFields(names, types): 
 	return list(zip(names, types))
@@ -105,8 +108,9 @@ class problem(Structure):
 
 
 class parameter(Structure):
-	_names = ["solver_type", "eps", "C", "nr_weight", "weight_label", "weight", "p"]
-	_types = [c_int64, c_double, c_double, c_int64, POINTER(c_int64), POINTER(c_double), c_double]
+	# init_model is a POINTER(model), declared as c_void_p since model embeds parameter
+	_names = ["solver_type", "eps", "C", "nr_weight", "weight_label", "weight", "p", "nr_thread", "init_model"]
+	_types = [c_int64, c_double, c_double, c_int64, POINTER(c_int64), POINTER(c_double), c_double, c_int64, c_void_p]
 	_fields_ = genFields(_names, _types)
 
 	def __init__(self, options = None):
@@ -129,6 +133,8 @@ class parameter(Structure):
 		self.eps = float('inf')
 		self.C = 1
 		self.p = 0.1
+		self.nr_thread = 1
+		self.init_model = None
 		self.nr_weight = 0
 		self.weight_label = (c_int64 * 0)()
 		self.weight = (c_double * 0)()
@@ -166,6 +172,9 @@ class parameter(Structure):
 			elif argv[i] == "-B":
 				i = i + 1
 				self.bias = float(argv[i])
+			elif argv[i] == "-n":
+				i = i + 1
+				self.nr_thread = int(argv[i])
 			elif argv[i] == "-v":
 				i = i + 1
 				self.cross_validation = 1
@@ -179,7 +188,7 @@ class parameter(Structure):
 				weight_label += [int(argv[i-1][2:])]
 				weight += [float(argv[i])]
 			elif argv[i] == "-q":
-				self.print_func = PRINT_STRING_FUN(print_null)
+				self.print_func = PRINT_NULL
 			else :
 				raise ValueError("Wrong options")
 			i += 1
@@ -245,8 +254,10 @@ def toPyModel(model_ptr):
 
 fillprototype(liblinear.train, POINTER(model), [POINTER(problem), POINTER(parameter)])
 fillprototype(liblinear.cross_validation, None, [POINTER(problem), POINTER(parameter), c_int64, POINTER(c_double)])
+fillprototype(liblinear.cross_validation_fold, None, [POINTER(problem), POINTER(parameter), POINTER(c_int64), c_int64, c_int64, POINTER(c_double)])
 
 fillprototype(liblinear.predict_values, c_double, [POINTER(model), POINTER(feature_node), POINTER(c_double)])
+fillprototype(liblinear.predict_values_batch, None, [POINTER(model), POINTER(problem), POINTER(c_double), POINTER(c_double)])
 fillprototype(liblinear.predict, c_double, [POINTER(model), POINTER(feature_node)])
 fillprototype(liblinear.predict_probability, c_double, [POINTER(model), POINTER(feature_node), POINTER(c_double)])
 
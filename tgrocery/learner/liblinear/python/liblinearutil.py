@@ -3,7 +3,8 @@
 import os
 import sys
 
-sys.path = [os.path.dirname(os.path.abspath(__file__))] + sys.path
+if 'liblinear' not in sys.modules:
+	sys.path = [os.path.dirname(os.path.abspath(__file__))] + sys.path
 from liblinear import *
 
 def svm_read_problem(data_file_name):
@@ -123,6 +124,7 @@ def train(arg1, arg2=None, arg3=None):
         -B bias : if bias >= 0, instance x becomes [x; bias]; if < 0, no bias term added (default -1)
         -wi weight: weights adjust the parameter C of different classes (see README for details)
         -v n: n-fold cross validation mode
+        -n nr_thread : train one-vs-rest classes with nr_thread threads (default 1)
         -q : quiet mode (no outputs)
     """
     prob, param = None, None
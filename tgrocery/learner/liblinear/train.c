@@ -49,6 +49,7 @@ void exit_with_help()
 	"-B bias : if bias >= 0, instance x becomes [x; bias]; if < 0, no bias term added (default -1)\n"
 	"-wi weight: weights adjust the parameter C of different classes (see README for details)\n"
 	"-v n: n-fold cross validation mode\n"
+	"-n nr_thread : train one-vs-rest classes with nr_thread threads (default 1)\n"
 	"-q : quiet mode (no outputs)\n"
 	);
 	exit(1);
@@ -186,6 +187,8 @@ void parse_command_line(INT64 argc, char **argv, char *input_file_name, char *mo
 	param.nr_weight = 0;
 	param.weight_label = NULL;
 	param.weight = NULL;
+	param.nr_thread = 1;
+	param.init_model = NULL;
 	flag_cross_validation = 0;
 	bias = -1;
 
@@ -217,6 +220,10 @@ void parse_command_line(INT64 argc, char **argv, char *input_file_name, char *mo
 				bias = atof(argv[i]);
 				break;
 
+			case 'n':
+				param.nr_thread = atoi(argv[i]);
+				break;
+
 			case 'w':
 				++param.nr_weight;
 				param.weight_label = (INT64 *) realloc(param.weight_label,sizeof(INT64)*param.nr_weight);
@@ -75,14 +75,27 @@ void TRON::tron(double *w)
 	double *w_new = new double[n];
 	double *g = new double[n];
 
-	for (i=0; i<n; i++)
-		w[i] = 0;
+	// w is the starting point, zero unless warm-starting. The stopping
+	// condition is relative to the gradient at zero either way, so a
+	// good starting point means fewer iterations.
+	double gnorm1 = -1;
+	for (i=0; i<n && w[i] == 0; i++)
+		;
+	if (i < n)
+	{
+		for (i=0; i<n; i++)
+			w_new[i] = 0;
+		fun_obj->fun(w_new);
+		fun_obj->grad(w_new, g);
+		gnorm1 = dnrm2_(&n, g, &inc);
+	}
 
         f = fun_obj->fun(w);
 	fun_obj->grad(w, g);
 	delta = dnrm2_(&n, g, &inc);
-	double gnorm1 = delta;
-	double gnorm = gnorm1;
+	double gnorm = delta;
+	if (gnorm1 < 0)
+		gnorm1 = gnorm;
 
 	if (gnorm <= eps*gnorm1)
 		search = 0;
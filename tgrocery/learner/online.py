@@ -0,0 +1,169 @@
+from ctypes import *
+from itertools import islice
+
+from .learner import liblinear, util, print_debug, fillprototype, build_SVMProblem, LearnerModel, LearnerParameter, LearnerProblemBuffer
+
+__all__ = ['LearnerOnlineTrainer', 'train_online']
+
+
+fillprototype(util.online_update, c_int64, [POINTER(liblinear.problem), POINTER(c_double), POINTER(c_double),
+        c_int64, c_double, c_double])
+fillprototype(util.online_resize, None, [POINTER(c_double), c_int64, c_int64, POINTER(c_double), c_int64])
+
+
+def _iter_svm_file(src):
+    with open(src) as fin:
+        for line in fin:
+            fields = line.split()
+            if not fields:
+                continue
+            xi = dict((int(j), float(v)) for j, v in (field.split(':') for field in fields[1:]))
+            yield xi, int(float(fields[0]))
+
+
+class LearnerOnlineTrainer(object):
+    """
+    :class:`LearnerOnlineTrainer` trains a multiclass linear model by
+    passive-aggressive updates (PA-I), a mini-batch of instances at a
+    time, so that the data never have to be held in memory as a whole.
+    Memory grows with the number of features and labels only.
+
+    *learner_opts* and *liblinear_opts* are as in :func:`train`, except
+    that idf (``-I 1``) needs the whole data and is not supported. Of
+    LIBLINEAR's parameters only the aggressiveness ``-c`` and the bias
+    ``-B`` are used.
+
+    If *init_model* is a :class:`LearnerModel` with one weight vector per
+    label, e.g. a model returned by :meth:`model`, training continues from
+    its weights.
+    """
+
+    def __init__(self, learner_opts='', liblinear_opts='', init_model=None):
+        self.learner_param = LearnerParameter(learner_opts, liblinear_opts)
+        if self.learner_param.inverse_document_frequency:
+            raise ValueError('Online training does not support idf.')
+        self.C = self.learner_param.C
+        self.bias = self.learner_param.bias
+        self.labels = []
+        self.label2idx = {}
+        self.nr_feature = 0
+        self.w = (c_double * 0)()
+        self.b = (c_double * 0)()
+        if init_model is not None:
+            self._init_from(init_model)
+
+    def _init_from(self, m):
+        if m._nr_w() != m.nr_class:
+            raise ValueError('The model should have one weight vector per label.')
+        if m.idf is not None:
+            raise ValueError('Online training does not support idf.')
+        nr_class = m.nr_class
+        self.labels = m.get_labels()
+        self.label2idx = dict((label, k) for k, label in enumerate(self.labels))
+        c_model = m._dense_c_model()
+        w = c_model.w
+        self._reserve(m.nr_feature, nr_class)
+        memmove(self.w, w, sizeof(c_double) * m.nr_feature * nr_class)
+        self.nr_feature = m.nr_feature
+        if m.bias >= 0 and self.bias >= 0:
+            self.b[:] = w[m.nr_feature * nr_class:(m.nr_feature + 1) * nr_class]
+
+    def _reserve(self, nr_feature, nr_class):
+        # the weights of a new label are interleaved with the others, so
+        # adding one copies them all; features grow geometrically
+        capacity = len(self.w) // len(self.b) if len(self.b) else 0
+        if nr_class == len(self.b) and nr_feature <= capacity:
+            return
+        if nr_feature > capacity:
+            capacity = max(nr_feature, 2 * capacity, 1024)
+        w = (c_double * (capacity * nr_class))()
+        util.online_resize(self.w, self.nr_feature, len(self.b), w, nr_class)
+        b = (c_double * nr_class)()
+        b[:len(self.b)] = self.b[:]
+        self.w, self.b = w, b
+
+    def _label_idx(self, label):
+        idx = self.label2idx.get(label)
+        if idx is None:
+            idx = self.label2idx[label] = len(self.labels)
+            self.labels.append(label)
+        return idx
+
+    def update(self, instances):
+        """
+        Update the weights with the ``(xi, yi)`` pairs of *instances*, in
+        order, where *xi* is a :class:`dict` of features as accepted by
+        :class:`LearnerProblemBuffer` and *yi* an integer label. Return the
+        number of instances that were predicted wrong before their update.
+        """
+        buf = LearnerProblemBuffer()
+        for xi, yi in instances:
+            buf.append(xi, self._label_idx(yi))
+        if len(buf) == 0:
+            return 0
+
+        svmprob = build_SVMProblem(buf, -1)
+        self._reserve(max(self.nr_feature, svmprob.prob.n), len(self.labels))
+        self.nr_feature = max(self.nr_feature, svmprob.prob.n)
+        learner_param = self.learner_param
+        util.normalize(pointer(svmprob.prob),
+            learner_param.binary_feature,
+            learner_param.inst_normalization,
+            learner_param.term_frequency,
+            0,
+            None, 0)
+        nr_error = util.online_update(svmprob.prob, self.w, self.b, len(self.labels), self.bias, self.C)
+        if nr_error == -2:
+            raise MemoryError("Memory Exhausted. Try to restart python.")
+        print_debug('online update: %d instances, %d errors' % (len(buf), nr_error))
+        return nr_error
+
+    def model(self):
+        """
+        Return a :class:`LearnerModel` holding a copy of the current
+        weights, which can be used, saved and loaded as a model from
+        :func:`train`.
+        """
+        nr_class, nr_feature = len(self.labels), self.nr_feature
+        w_size = nr_feature * nr_class
+        w = (c_double * (w_size + (nr_class if self.bias >= 0 else 0)))()
+        memmove(w, self.w, sizeof(c_double) * w_size)
+        if self.bias >= 0:
+            w[w_size:] = self.b[:]
+        label = (c_int64 * nr_class)(*self.labels)
+
+        c_model = liblinear.model()
+        c_model.param = liblinear.parameter()
+        # one weight vector per label, whatever the number of labels
+        c_model.param.solver_type = liblinear.MCSVM_CS
+        c_model.param.C = self.C
+        c_model.nr_class = nr_class
+        c_model.nr_feature = nr_feature
+        c_model.bias = self.bias
+        c_model.label = label
+        c_model.w = cast(w, POINTER(c_double))
+        c_model.buffers = (label, w)  # prevent GC
+        return LearnerModel(c_model, self.learner_param, None)
+
+
+def train_online(data, learner_opts="", liblinear_opts="", init_model=None, batch_size=10000):
+    """
+    Return a :class:`LearnerModel` trained by one pass of
+    :class:`LearnerOnlineTrainer` over *data*, *batch_size* instances at
+    a time.
+
+    *data* is the file path of LIBSVM-format data or an iterable of
+    ``(xi, yi)`` pairs, e.g. from
+    :meth:`tgrocery.converter.GroceryTextConverter.iter_svm`, and is read
+    as a stream. The other arguments are as in :class:`LearnerOnlineTrainer`.
+    """
+    if isinstance(data, str):
+        data = _iter_svm_file(data)
+    data = iter(data)
+    trainer = LearnerOnlineTrainer(learner_opts, liblinear_opts, init_model)
+    while True:
+        batch = list(islice(data, batch_size))
+        if not batch:
+            break
+        trainer.update(batch)
+    return trainer.model()
@@ -8,27 +8,6 @@
 #define Malloc(type,n) (type *)malloc((n)*sizeof(type))
 
 
-static char *line = NULL;
-static INT64 max_line_len;
-
-static char* readline(FILE *input)
-{
-	INT64 len;
-	
-	if(fgets(line,max_line_len,input) == NULL)
-		return NULL;
-
-	while(strrchr(line,'\n') == NULL)
-	{
-		max_line_len *= 2;
-		line = (char *) realloc(line,max_line_len);
-		len = (INT64) strlen(line);
-		if(fgets(line+len,max_line_len-len,input) == NULL)
-			break;
-	}
-	return line;
-}
-
 typedef struct {
 	struct problem prob;
 	struct feature_node* x_space;
@@ -43,14 +22,168 @@ void freeSVMProblem(SVMProblem svmprob) {
 }
 
 
+// hand-written number parsers for read_problem
+//
+// Both return a pointer past the number, or NULL if there is none.
+// parse_double handles plain decimals of at most 15 significant digits
+// itself: the digits and the power of ten are then exact doubles, so one
+// division rounds correctly and the result equals strtod's. Anything
+// else (exponents, inf, long mantissas) is left to strtod.
+static const double pow10_table[] = {
+	1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11,
+	1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22
+};
+
+static char* parse_index(char *p, INT64 *index)
+{
+	INT64 v = 0;
+
+	if(*p < '0' || *p > '9')
+		return NULL;
+	for(; *p >= '0' && *p <= '9'; p++)
+	{
+		if(v > (INT64_MAX - 9) / 10)
+			return NULL;
+		v = v * 10 + (*p - '0');
+	}
+	*index = v;
+	return p;
+}
+
+static char* parse_double(char *p, double *val)
+{
+	char *start = p, *endptr;
+	uint64_t mantissa = 0;
+	int digits = 0, frac_digits = 0, negative = 0;
+
+	if(*p == '-' || *p == '+')
+		negative = *p++ == '-';
+	for(; *p >= '0' && *p <= '9'; p++, digits++)
+		mantissa = mantissa * 10 + (*p - '0');
+	if(*p == '.')
+		for(p++; *p >= '0' && *p <= '9'; p++, digits++, frac_digits++)
+			mantissa = mantissa * 10 + (*p - '0');
+
+	if(digits > 0 && digits <= 15 && *p != 'e' && *p != 'E')
+	{
+		*val = (double) mantissa / pow10_table[frac_digits];
+		if(negative)
+			*val = -*val;
+		return p;
+	}
+
+	errno = 0;
+	*val = strtod(start, &endptr);
+	if(endptr == start || errno != 0)
+		return NULL;
+	return endptr;
+}
+
+#define is_blank(c) ((c) == ' ' || (c) == '\t' || (c) == '\r')
+
+typedef struct {
+	double *y;
+	INT64 *row_ptr;
+	INT64 l, max_l;
+	struct feature_node *x_space;
+	INT64 elements, max_elements;
+	INT64 max_index;
+	double bias;
+} ProblemReader;
+
+// grow the array *ptr of *capacity elements to hold at least size ones
+static int reserve(void **ptr, INT64 *capacity, INT64 size, size_t elem_size)
+{
+	INT64 new_capacity = *capacity;
+	void *new_ptr;
+
+	if(size <= *capacity)
+		return 0;
+	while(new_capacity < size)
+		new_capacity = new_capacity > 0 ? new_capacity * 2 : 1;
+	new_ptr = realloc(*ptr, new_capacity * elem_size);
+	if(new_ptr == NULL)
+		return -1;
+	*ptr = new_ptr;
+	*capacity = new_capacity;
+	return 0;
+}
+
+// parse one NUL-terminated instance and append it to the reader
+//
+// Return 0 on success, 1 on a format error and -2 if memory is exhausted.
+static int read_instance(ProblemReader *reader, char *p)
+{
+	INT64 inst_max_index = 0, index;
+	struct feature_node *node;
+	double value;
+
+	if(reader->l == reader->max_l)
+	{
+		INT64 max_l = reader->max_l, max_row = reader->max_l;
+		if(reserve((void **) &reader->y, &max_l, reader->l + 1, sizeof(double)) ||
+				reserve((void **) &reader->row_ptr, &max_row, reader->l + 1, sizeof(INT64)))
+			return -2;
+		reader->max_l = max_l;
+	}
+
+	while(is_blank(*p))
+		p++;
+	p = parse_double(p, &reader->y[reader->l]);
+	if(p == NULL || !(is_blank(*p) || *p == '\0'))
+		return 1;
+	reader->row_ptr[reader->l] = reader->elements;
+
+	while(1)
+	{
+		while(is_blank(*p))
+			p++;
+		if(*p == '\0')
+			break;
+
+		p = parse_index(p, &index);
+		if(p == NULL || *p != ':' || index <= inst_max_index)
+			return 1;
+		inst_max_index = index;
+		p = parse_double(p + 1, &value);
+		if(p == NULL || !(is_blank(*p) || *p == '\0'))
+			return 1;
+
+		// leave room for the bias term and the terminator
+		if(reserve((void **) &reader->x_space, &reader->max_elements, reader->elements + 3, sizeof(struct feature_node)))
+			return -2;
+		node = &reader->x_space[reader->elements++];
+		node->index = index;
+		node->value = value;
+	}
+
+	if(reserve((void **) &reader->x_space, &reader->max_elements, reader->elements + 2, sizeof(struct feature_node)))
+		return -2;
+	if(reader->bias >= 0)
+	{
+		// the index is set once max_index is known
+		reader->x_space[reader->elements++].value = reader->bias;
+	}
+	reader->x_space[reader->elements++].index = -1;
+
+	if(inst_max_index > reader->max_index)
+		reader->max_index = inst_max_index;
+	reader->l++;
+	return 0;
+}
+
 // read in a problem (in libsvm format)
+//
+// The file is read once, in blocks, and x_space grows geometrically, so
+// the whole read costs one pass over the data. All buffers belong to the
+// call, so concurrent readers do not share any state.
 SVMProblem read_problem(const char *filename, double bias, INT64 *error_code)
 {
-	INT64 max_index, inst_max_index, i;
-	INT64 elements, j;
+	INT64 i, buf_len = 0, max_buf_len = 1 << 20, pos, want, got;
+	int eof = 0, status = 0;
+	char *buf, *nl;
 	FILE *fp = fopen(filename,"r");
-	char *endptr;
-	char *idx, *val, *label;
+	ProblemReader reader;
 	struct problem prob;
 	SVMProblem svmprob;
 
@@ -63,6 +196,7 @@ SVMProblem read_problem(const char *filename, double bias, INT64 *error_code)
 	 * -2	memory exhausted
 	 */
 	*error_code = 0;
+	memset(&svmprob, 0, sizeof(svmprob));
 
 	if(fp == NULL)
 	{
@@ -70,38 +204,144 @@ SVMProblem read_problem(const char *filename, double bias, INT64 *error_code)
 		return svmprob;
 	}
 
-	prob.l = 0;
-	elements = 0;
-	max_line_len = 1024;
-	line = Malloc(char,max_line_len);
-	while(readline(fp)!=NULL)
+	memset(&reader, 0, sizeof(reader));
+	reader.bias = bias;
+	reader.max_l = 1024;
+	reader.max_elements = 1024;
+	reader.y = Malloc(double, reader.max_l);
+	reader.row_ptr = Malloc(INT64, reader.max_l);
+	reader.x_space = Malloc(struct feature_node, reader.max_elements);
+	buf = Malloc(char, max_buf_len + 1);  // + 1 for the NUL after the last line
+
+	if(reader.y == NULL || reader.row_ptr == NULL || reader.x_space == NULL || buf == NULL)
+		status = -2;
+
+	while(status == 0 && !eof)
 	{
-		char *p = strtok(line," \t"); // label
+		want = max_buf_len - buf_len;
+		got = (INT64) fread(buf + buf_len, 1, want, fp);
+		buf_len += got;
+		eof = got < want;
 
-		// features
-		while(1)
+		pos = 0;
+		while(status == 0 && (nl = (char *) memchr(buf + pos, '\n', buf_len - pos)) != NULL)
 		{
-			p = strtok(NULL," \t");
-			if(p == NULL || *p == '\n') // check '\n' as ' ' may be after the last feature
-				break;
-			elements++;
+			*nl = '\0';
+			status = read_instance(&reader, buf + pos);
+			pos = nl - buf + 1;
+		}
+		if(status == 0 && eof && pos < buf_len)
+		{
+			// the last line has no newline
+			buf[buf_len] = '\0';
+			status = read_instance(&reader, buf + pos);
+		}
+
+		memmove(buf, buf + pos, buf_len - pos);
+		buf_len -= pos;
+		if(buf_len == max_buf_len)
+		{
+			// a line longer than the buffer
+			char *new_buf = (char *) realloc(buf, max_buf_len * 2 + 1);
+			if(new_buf == NULL)
+				status = -2;
+			else
+			{
+				buf = new_buf;
+				max_buf_len *= 2;
+			}
 		}
-		prob.l++;
 	}
-	rewind(fp);
 
-	prob.bias=bias;
+	fclose(fp);
+	free(buf);
+
+	prob.x = NULL;
+	if(status == 0)
+	{
+		prob.x = Malloc(struct feature_node *, reader.l);
+		if(prob.x == NULL && reader.l > 0)
+			status = -2;
+	}
+	if(status != 0)
+	{
+		free(reader.y);
+		free(reader.row_ptr);
+		free(reader.x_space);
+		*error_code = status > 0 ? reader.l + 1 : status;
+		return svmprob;
+	}
+
+	prob.l = reader.l;
+	prob.y = reader.y;
+	prob.bias = bias;
+	for(i = 0; i < prob.l; i++)
+		prob.x[i] = &reader.x_space[reader.row_ptr[i]];
+	if(prob.bias >= 0)
+	{
+		prob.n = reader.max_index + 1;
+		for(i = 1; i < prob.l; i++)
+			(prob.x[i]-2)->index = prob.n;
+		if(prob.l > 0)
+			reader.x_space[reader.elements-2].index = prob.n;
+	}
+	else
+		prob.n = reader.max_index;
+	free(reader.row_ptr);
+
+	svmprob.prob = prob;
+	svmprob.x_space = reader.x_space;
+	svmprob.len_x_space = reader.elements;
+
+	return svmprob;
+}
+
+
+// build a problem from instances already held in memory
+//
+// The l instances are given in compressed sparse row form: the features
+// of instance i are index[row_ptr[i]..row_ptr[i+1]) and
+// value[row_ptr[i]..row_ptr[i+1]). The layout of the result is the same
+// as read_problem's, so both can be used interchangeably. If bias_index
+// is positive, the bias term (bias >= 0) is put at that index instead of
+// at max_index+1, which is what a trained model expects; features of
+// larger indices, e.g. unseen in training, follow it so that each row
+// stays sorted.
+SVMProblem build_problem(const double *y, const INT64 *row_ptr, const INT64 *index, const double *value, INT64 l, double bias, INT64 bias_index, INT64 *error_code)
+{
+	INT64 max_index, inst_max_index, i, k;
+	INT64 elements, j;
+	int has_bias;
+	struct problem prob;
+	SVMProblem svmprob;
+
+	/**
+	 * error_code:
+	 * 0	no error
+	 * > 0	feature indices of this instance (1-based) are not
+	 * 	positive and increasing.
+	 * -2	memory exhausted
+	 *
+	 * On error the problem is zeroed, so that freeSVMProblem is a no-op.
+	 */
+	*error_code = 0;
+	memset(&svmprob, 0, sizeof(svmprob));
+
+	prob.l = l;
+	prob.bias = bias;
+	elements = row_ptr[l];
 	if(prob.bias >= 0) elements += prob.l;
 
 	errno = 0;
 	prob.y = Malloc(double,prob.l);
 	prob.x = Malloc(struct feature_node *,prob.l);
 	struct feature_node* x_space = Malloc(struct feature_node,elements+prob.l);
-	
+
 	if(errno == ENOMEM)
 	{
-		free(line);
-		fclose(fp);
+		free(prob.y);
+		free(prob.x);
+		free(x_space);
 		*error_code = -2;
 		return svmprob;
 	}
@@ -110,83 +350,60 @@ SVMProblem read_problem(const char *filename, double bias, INT64 *error_code)
 	j=0;
 	for(i=0;i<prob.l;i++)
 	{
-		inst_max_index = 0; // strtol gives 0 if wrong format
-		readline(fp);
+		inst_max_index = 0;
 		prob.x[i] = &x_space[j];
-		label = strtok(line," \t\n");
-		if(label == NULL) // empty line
-		{	
-			free(line);
-			fclose(fp);
-			*error_code = i+1;
-			return svmprob;
-		}
+		prob.y[i] = y[i];
 
-		prob.y[i] = strtod(label,&endptr);
-		if(endptr == label || *endptr != '\0')
+		has_bias = 0;
+		for(k=row_ptr[i];k<row_ptr[i+1];k++)
 		{
-			free(line);
-			fclose(fp);
-			*error_code = i+1;
-			return svmprob;
-		}
-
-		while(1)
-		{
-			idx = strtok(NULL,":");
-			val = strtok(NULL," \t");
-
-			if(val == NULL)
-				break;
-
-			errno = 0;
-			x_space[j].index = (INT64)strtoll(idx,&endptr,10);
-			if(endptr == idx || errno != 0 || *endptr != '\0' || x_space[j].index <= inst_max_index)
-			{	
-				free(line);
-				fclose(fp);
+			if(index[k] <= inst_max_index)
+			{
+				free(prob.y);
+				free(prob.x);
+				free(x_space);
 				*error_code = i+1;
 				return svmprob;
 			}
-			else
-				inst_max_index = x_space[j].index;
-
-			errno = 0;
-			x_space[j].value = strtod(val,&endptr);
-			//if(binary) x_space[j].value = x_space[j].value != 0;
-			if(endptr == val || errno != 0 || (*endptr != '\0' && !isspace(*endptr)))
-			{	
-				free(line);
-				fclose(fp);
-				*error_code = i+1;
-				return svmprob;
+			if(prob.bias >= 0 && bias_index > 0 && !has_bias && index[k] > bias_index)
+			{
+				x_space[j].index = bias_index;
+				x_space[j++].value = prob.bias;
+				has_bias = 1;
 			}
-
+			inst_max_index = index[k];
+			x_space[j].index = index[k];
+			x_space[j].value = value[k];
 			++j;
 		}
 
 		if(inst_max_index > max_index)
 			max_index = inst_max_index;
 
-		if(prob.bias >= 0)
+		if(prob.bias >= 0 && !has_bias)
+		{
+			// the index of the bias term is only known at the end
+			// without bias_index, see below
+			x_space[j].index = bias_index;
 			x_space[j++].value = prob.bias;
+		}
 
 		x_space[j++].index = -1;
 	}
 
-	if(prob.bias >= 0)
+	if(prob.bias >= 0 && bias_index > 0)
+		prob.n = bias_index > max_index ? bias_index : max_index;
+	else if(prob.bias >= 0)
 	{
-		prob.n=max_index+1;
+		prob.n = max_index+1;
 		for(i=1;i<prob.l;i++)
-			(prob.x[i]-2)->index = prob.n; 
-		x_space[j-2].index = prob.n;
+			(prob.x[i]-2)->index = prob.n;
+		if(j >= 2)
+			x_space[j-2].index = prob.n;
 	}
 	else
 		prob.n=max_index;
 
-	fclose(fp);
-	free(line);
-
 	svmprob.prob = prob;
 	svmprob.x_space = x_space;
 	svmprob.len_x_space = j;
@@ -222,74 +439,83 @@ double* compute_idf(const struct problem *prob, double *idf_val)
 	return idf_val;
 }
 
-void normalize(struct problem *prob, int binary, int norm, int tf, int idf, double* idf_val)
+// normalize one instance xi, terminated by index -1
+//
+// Only the first n_idf features are weighted by idf; the others,
+// e.g. the features unseen in training, are kept as they are.
+void normalize_one(struct feature_node *xi, int binary, int norm, int tf, int idf, const double* idf_val, INT64 n_idf)
 {
-	INT64 i;
+	struct feature_node* x;
 
-	for(i = 0; i < prob->l; ++i)
+	if(binary)
 	{
-		struct feature_node* xi;
-
-		if(binary)
+		x = xi;
+		while(x->index != -1)
 		{
-			xi = prob->x[i];
-			while(xi->index != -1)
-			{
-				xi->value = xi->value != 0;
-				++xi;
-			}
+			x->value = x->value != 0;
+			++x;
 		}
+	}
 
-		if(tf)
+	if(tf)
+	{
+		double norm = 0;
+		x = xi;
+		while(x->index != -1)
 		{
-			double norm = 0;
-			xi = prob->x[i];
-			while(xi->index != -1)
+			norm += x->value;
+			++x;
+		}
+
+		x = xi;
+		if(norm != 0)
+			while(x->index != -1)
 			{
-				norm += xi->value;
-				++xi;
+				x->value /= norm;
+				++x;
 			}
+	}
 
-			xi = prob->x[i];
-			if(norm != 0)
-				while(xi->index != -1)
-				{
-					xi->value /= norm;
-					++xi;
-				}
+	if(idf)
+	{
+		x = xi;
+		while(x->index != -1)
+		{
+			if(x->index <= n_idf)
+				x->value *= idf_val[x->index-1];
+			++x;
 		}
+	}
 
-		if(idf)
+	if(norm)
+	{
+		double norm = 0;
+		x = xi;
+		while(x->index != -1)
 		{
-			xi = prob->x[i];
-			while(xi->index != -1)
-			{
-				xi->value *= idf_val[xi->index-1];
-				++xi;
-			}
+			norm += x->value * x->value;
+			++x;
 		}
 
-		if(norm)
-		{
-			double norm = 0;
-			xi = prob->x[i];
-			while(xi->index != -1)
+		norm = sqrt(norm);
+
+		x = xi;
+		if(norm != 0)
+			while(x->index != -1)
 			{
-				norm += xi->value * xi->value;
-				++xi;
+				x->value /= norm;
+				++x;
 			}
+	}
+}
 
-			norm = sqrt(norm);
+// normalize every instance of prob as normalize_one, with n_idf idf values
+void normalize(struct problem *prob, int binary, int norm, int tf, int idf, double* idf_val, INT64 n_idf)
+{
+	INT64 i;
 
-			xi = prob->x[i];
-			if(norm != 0)
-				while(xi->index != -1)
-				{
-					xi->value /= norm;
-					++xi;
-				}
-		}
-	}
+	for(i = 0; i < prob->l; ++i)
+		normalize_one(prob->x[i], binary, norm, tf, idf, idf_val, n_idf);
 }
 
 
@@ -390,3 +616,656 @@ void merge_problems(const char *srcs[], const int num_srcs, INT64* offsets, cons
 }
 
 
+
+// add l (true, predicted) pairs of label indices to a confusion matrix
+// whose row i starts at matrix[i * stride]
+void confusion_update(INT64 *matrix, INT64 stride, const INT64 *true_idx, const INT64 *predicted_idx, INT64 l)
+{
+	INT64 i;
+
+	for(i = 0; i < l; i++)
+		matrix[true_idx[i] * stride + predicted_idx[i]]++;
+}
+
+
+
+// open-addressing hash table from n-gram keys to feature ids
+//
+// An n-gram g + (x,) is keyed by fidx(g) << 32 | x, where fidx(()) = 0,
+// so keys are positive integers and looking an n-gram up allocates
+// nothing. Empty slots hold the key -1, which is never found nor set. The
+// caller owns keys/vals, keeps capacity a power of 2 and the table at
+// most half full.
+typedef struct {
+	INT64 *keys;
+	INT64 *vals;
+	INT64 capacity;
+	INT64 size;
+} NgramIndex;
+
+// finalizer of MurmurHash3, to spread the bits of a key
+static uint64_t mix64(uint64_t h)
+{
+	h ^= h >> 33;
+	h *= 0xff51afd7ed558ccdULL;
+	h ^= h >> 33;
+	h *= 0xc4ceb9fe1a85ec53ULL;
+	h ^= h >> 33;
+	return h;
+}
+
+static INT64 ngram_index_slot(const NgramIndex *index, INT64 key)
+{
+	INT64 mask = index->capacity - 1;
+	INT64 i;
+
+	i = (INT64)(mix64((uint64_t)key) & (uint64_t)mask);
+	while(index->keys[i] != -1 && index->keys[i] != key)
+		i = (i+1) & mask;
+	return i;
+}
+
+INT64 ngram_index_get(const NgramIndex *index, INT64 key)
+{
+	INT64 i;
+
+	// would match an empty slot
+	if(key == -1)
+		return -1;
+	i = ngram_index_slot(index, key);
+	return index->keys[i] == key ? index->vals[i] : -1;
+}
+
+void ngram_index_set(NgramIndex *index, INT64 key, INT64 val)
+{
+	INT64 i;
+
+	if(key == -1)
+		return;
+	i = ngram_index_slot(index, key);
+	if(index->keys[i] == -1)
+	{
+		index->keys[i] = key;
+		index->size++;
+	}
+	index->vals[i] = val;
+}
+
+// insert all entries of src into dest, e.g. a larger table
+void ngram_index_rehash(const NgramIndex *src, NgramIndex *dest)
+{
+	INT64 i;
+	for(i = 0; i < src->capacity; ++i)
+		if(src->keys[i] != -1)
+			ngram_index_set(dest, src->keys[i], src->vals[i]);
+}
+
+static int compare_int64(const void *a, const void *b)
+{
+	INT64 x = *(const INT64 *)a, y = *(const INT64 *)b;
+	return (x > y) - (x < y);
+}
+
+// sort the nr_feat feature ids feat_idx, and keep each once with its
+// count in feat_cnt; return the number of distinct ids
+static INT64 count_features(INT64 *feat_idx, INT64 nr_feat, INT64 *feat_cnt)
+{
+	INT64 i, nr_uniq = 0;
+
+	qsort(feat_idx, nr_feat, sizeof(INT64), compare_int64);
+
+	for(i = 0; i < nr_feat; ++i)
+	{
+		if(nr_uniq > 0 && feat_idx[nr_uniq-1] == feat_idx[i])
+			feat_cnt[nr_uniq-1]++;
+		else
+		{
+			feat_idx[nr_uniq] = feat_idx[i];
+			feat_cnt[nr_uniq++] = 1;
+		}
+	}
+
+	return nr_uniq;
+}
+
+// count the 1..order-grams of the n token ids toks
+//
+// New n-grams get the next feature ids (size+1, ...) in the order
+// unigrams, bigrams, ... unless frozen is set, in which case they are
+// dropped. Negative token ids (unseen tokens) never form an n-gram. If
+// max_fidx is positive, n-grams of larger ids, e.g. prefixes kept by
+// ngram_index_prune, are indexed but are not features.
+// prefix is scratch space of n elements, feat_idx of n*order elements.
+// The distinct feature ids, sorted, and their counts are written to
+// feat_idx and feat_cnt; their number is returned.
+INT64 ngram_index_features(NgramIndex *index, const INT64 *toks, INT64 n, INT64 order, int frozen,
+		INT64 max_fidx, INT64 *prefix, INT64 *feat_idx, INT64 *feat_cnt)
+{
+	INT64 i, k, fidx, nr_feat = 0;
+
+	for(i = 0; i < n; ++i)
+		prefix[i] = 0;
+
+	for(k = 1; k <= order; ++k)
+	{
+		for(i = 0; i + k <= n; ++i)
+		{
+			INT64 tok = toks[i+k-1];
+			INT64 key;
+			if(prefix[i] < 0 || tok < 0)
+			{
+				prefix[i] = -1;
+				continue;
+			}
+
+			key = prefix[i] << 32 | tok;
+			fidx = ngram_index_get(index, key);
+			if(fidx < 0 && !frozen)
+			{
+				fidx = index->size + 1;
+				ngram_index_set(index, key, fidx);
+			}
+			prefix[i] = fidx;
+			if(fidx >= 0 && (max_fidx <= 0 || fidx <= max_fidx))
+				feat_idx[nr_feat++] = fidx;
+		}
+	}
+
+	return count_features(feat_idx, nr_feat, feat_cnt);
+}
+
+// number the n-grams to keep after pruning
+//
+// remap has size+1 elements, and remap[fidx] is the new feature id
+// (1..nr_kept) of feature fidx, or 0 to drop it. The prefixes of kept
+// n-grams are needed to index them, so the dropped ones among them are
+// numbered from nr_kept+1 in remap. Return the number of n-grams kept in
+// all, or -2 if memory is exhausted.
+INT64 ngram_index_prune_remap(const NgramIndex *index, INT64 *remap, INT64 nr_kept)
+{
+	INT64 i, fidx, nr_ngram = nr_kept;
+	INT64 *key_of = Malloc(INT64, index->size+1);
+
+	if(key_of == NULL)
+		return -2;
+	for(i = 0; i < index->capacity; ++i)
+		if(index->keys[i] != -1)
+			key_of[index->vals[i]] = index->keys[i];
+
+	for(fidx = 1; fidx <= index->size; ++fidx)
+	{
+		INT64 p;
+		if(remap[fidx] <= 0 || remap[fidx] > nr_kept)
+			continue;
+		for(p = key_of[fidx] >> 32; p != 0 && remap[p] == 0; p = key_of[p] >> 32)
+			remap[p] = ++nr_ngram;
+	}
+
+	free(key_of);
+	return nr_ngram;
+}
+
+// insert the n-grams of src numbered by ngram_index_prune_remap into
+// dest, with their prefixes renumbered in their keys
+void ngram_index_prune(const NgramIndex *src, NgramIndex *dest, const INT64 *remap)
+{
+	INT64 i;
+
+	for(i = 0; i < src->capacity; ++i)
+	{
+		INT64 key = src->keys[i];
+		if(key == -1 || remap[src->vals[i]] == 0)
+			continue;
+		ngram_index_set(dest, remap[key >> 32] << 32 | (key & 0xffffffff), remap[src->vals[i]]);
+	}
+}
+
+// document frequencies of the features of a problem in compressed sparse
+// row form: df[j] is the number of the nnz indices equal to j
+void feature_df(const INT64 *index, INT64 nnz, INT64 *df)
+{
+	INT64 k;
+
+	for(k = 0; k < nnz; ++k)
+		df[index[k]]++;
+}
+
+// renumber the features of l instances in compressed sparse row form in
+// place, index[k] to remap[index[k]], dropping those mapped to 0 or
+// beyond max_fidx; remap must keep the order of the features kept.
+// Return the number of features left.
+INT64 remap_features(INT64 *row_ptr, INT64 *index, double *value, INT64 l, const INT64 *remap, INT64 max_fidx)
+{
+	INT64 i, k, nnz = 0;
+
+	for(i = 0; i < l; ++i)
+	{
+		INT64 begin = row_ptr[i];
+		row_ptr[i] = nnz;
+		for(k = begin; k < row_ptr[i+1]; ++k)
+		{
+			INT64 fidx = remap[index[k]];
+			if(fidx == 0 || fidx > max_fidx)
+				continue;
+			index[nnz] = fidx;
+			value[nnz++] = value[k];
+		}
+	}
+	row_ptr[l] = nnz;
+
+	return nnz;
+}
+
+// count the 1..order-grams of n tokens by feature hashing
+//
+// Token i is blob[offsets[i]..offsets[i+1]). The n-gram g + (x,) hashes
+// to h(g) * 0x100000001b3 ^ h(x), where h(x) is the FNV-1a hash of x, so
+// no vocabulary is needed; its feature id is 1 plus the low nr_bits bits
+// of the mixed hash. If seen is not NULL, it is a bitmap of the feature
+// ids used so far, updated with those of this text, and *nr_used counts
+// the ones new to it. prefix is scratch space of n elements. The result
+// is as with ngram_index_features.
+INT64 hash_features(const char *blob, const INT64 *offsets, INT64 n, INT64 order, INT64 nr_bits,
+		unsigned char *seen, INT64 *nr_used, INT64 *prefix, INT64 *feat_idx, INT64 *feat_cnt)
+{
+	INT64 i, k, j, nr_feat = 0;
+	uint64_t mask = ((uint64_t)1 << nr_bits) - 1;
+	uint64_t *h = (uint64_t *)prefix;
+
+	for(i = 0; i < n; ++i)
+		h[i] = 0;
+
+	for(k = 1; k <= order; ++k)
+	{
+		for(i = 0; i + k <= n; ++i)
+		{
+			uint64_t tok = 0xcbf29ce484222325ULL;
+			INT64 fidx;
+			for(j = offsets[i+k-1]; j < offsets[i+k]; ++j)
+				tok = (tok ^ (unsigned char)blob[j]) * 0x100000001b3ULL;
+
+			h[i] = h[i] * 0x100000001b3ULL ^ tok;
+			fidx = (INT64)(mix64(h[i]) & mask);
+			if(seen != NULL && !(seen[fidx >> 3] & (1 << (fidx & 7))))
+			{
+				seen[fidx >> 3] |= (unsigned char)(1 << (fidx & 7));
+				(*nr_used)++;
+			}
+			feat_idx[nr_feat++] = fidx + 1;
+		}
+	}
+
+	return count_features(feat_idx, nr_feat, feat_cnt);
+}
+
+
+
+// multiclass passive-aggressive (PA-I) updates, one instance at a time
+//
+// w holds the weight of feature j and class k at w[(j-1)*nr_class+k], as
+// in a LIBLINEAR model, for every feature index of prob; b holds the
+// weights of the bias term bias (if >= 0) and prob->y the class
+// indices. Each instance moves the weights of its class and of the best
+// scoring other class just enough to separate them by a margin of 1, by
+// at most C. Return the number of instances scored wrong before their
+// update, or -2 if memory is exhausted.
+INT64 online_update(const struct problem *prob, double *w, double *b, INT64 nr_class, double bias, double C)
+{
+	INT64 i, k, y, r, nr_error = 0;
+	double *scores = Malloc(double, nr_class);
+	struct feature_node *x;
+
+	if(scores == NULL)
+		return -2;
+
+	for(i = 0; i < prob->l; i++)
+	{
+		double sq_norm, loss, tau;
+
+		for(k = 0; k < nr_class; k++)
+			scores[k] = bias >= 0 ? bias * b[k] : 0;
+		sq_norm = bias >= 0 ? bias * bias : 0;
+		for(x = prob->x[i]; x->index != -1; x++)
+		{
+			double *wj = &w[(x->index-1)*nr_class];
+			for(k = 0; k < nr_class; k++)
+				scores[k] += wj[k] * x->value;
+			sq_norm += x->value * x->value;
+		}
+
+		y = (INT64)prob->y[i];
+		r = -1;
+		for(k = 0; k < nr_class; k++)
+			if(k != y && (r < 0 || scores[k] > scores[r]))
+				r = k;
+		if(r < 0)
+			continue;
+		if(scores[r] >= scores[y])
+			nr_error++;
+
+		loss = 1 - (scores[y] - scores[r]);
+		if(loss <= 0 || sq_norm == 0)
+			continue;
+		tau = loss / (2 * sq_norm);
+		if(tau > C)
+			tau = C;
+
+		for(x = prob->x[i]; x->index != -1; x++)
+		{
+			double *wj = &w[(x->index-1)*nr_class];
+			wj[y] += tau * x->value;
+			wj[r] -= tau * x->value;
+		}
+		if(bias >= 0)
+		{
+			b[y] += tau * bias;
+			b[r] -= tau * bias;
+		}
+	}
+
+	free(scores);
+	return nr_error;
+}
+
+// copy the weights of nr_feature features from a layout of nr_class to
+// one of new_nr_class classes, see online_update
+void online_resize(const double *w, INT64 nr_feature, INT64 nr_class, double *new_w, INT64 new_nr_class)
+{
+	INT64 j;
+
+	for(j = 0; j < nr_feature; j++)
+		memcpy(&new_w[j*new_nr_class], &w[j*nr_class], sizeof(double) * (nr_class < new_nr_class ? nr_class : new_nr_class));
+}
+
+
+
+// compressed sparse rows of the weights of a model, one row per feature
+//
+// The weights of feature j (and of the bias term, as feature
+// nr_feature+1) whose absolute values exceed threshold are the columns
+// (class indices) col[row_ptr[j-1]..row_ptr[j]) with values val[...]. A
+// model with a single weight vector w, i.e. a binary one-vs-rest model,
+// only has column 0: class 1 scores 0, as in the decision values of
+// predict_values.
+// row_ptr has nr_feature+2 elements; if col is NULL, only row_ptr is
+// filled. Return the number of weights kept.
+INT64 compact_model(const struct model *model_, double threshold, INT64 *row_ptr, INT64 *col, double *val)
+{
+	INT64 n = model_->nr_feature + (model_->bias >= 0);
+	INT64 nr_w, j, k, nnz = 0;
+
+	if(model_->nr_class == 2 && model_->param.solver_type != MCSVM_CS)
+		nr_w = 1;
+	else
+		nr_w = model_->nr_class;
+
+	row_ptr[0] = 0;
+	for(j = 0; j < n; j++)
+	{
+		for(k = 0; k < nr_w; k++)
+		{
+			double v = model_->w[j*nr_w+k];
+			if(fabs(v) <= threshold)
+				continue;
+			if(col != NULL)
+			{
+				col[nnz] = k;
+				val[nnz] = v;
+			}
+			nnz++;
+		}
+		row_ptr[j+1] = nnz;
+	}
+	if(model_->bias < 0)
+		row_ptr[n+1] = nnz;
+
+	return nnz;
+}
+
+// whether class c scoring s ranks before class c2 scoring s2, as in
+// predict: ties go to the smaller class index, except with two classes,
+// where a decision value of 0 predicts class 1
+static int topk_before(INT64 nr_class, INT64 c, double s, INT64 c2, double s2)
+{
+	if(s != s2)
+		return s > s2;
+	return nr_class == 2 ? c > c2 : c < c2;
+}
+
+// insert class c scoring s into the *nr_top <= k best so far, best first
+static void topk_insert(INT64 *idx, double *dec, INT64 *nr_top, INT64 k, INT64 nr_class, INT64 c, double s)
+{
+	INT64 r;
+
+	if(*nr_top == k && !topk_before(nr_class, c, s, idx[k-1], dec[k-1]))
+		return;
+	r = *nr_top < k ? (*nr_top)++ : k - 1;
+	for(; r > 0 && topk_before(nr_class, c, s, idx[r-1], dec[r-1]); r--)
+	{
+		idx[r] = idx[r-1];
+		dec[r] = dec[r-1];
+	}
+	idx[r] = c;
+	dec[r] = s;
+}
+
+// the k best classes of each instance of prob and their decision values,
+// scoring only the nonzero weights of a model compacted by compact_model
+//
+// The result of instance i is top_idx[i*k..(i+1)*k) and top_val[...],
+// best first; k must not exceed nr_class. Features beyond nr_row rows
+// are ignored. Return 0, or -2 if memory is exhausted.
+INT64 predict_topk(const struct problem *prob, const INT64 *row_ptr, const INT64 *col, const double *val,
+	INT64 nr_row, INT64 nr_class, INT64 k, INT64 *top_idx, double *top_val)
+{
+	INT64 i, c, p, nnz, nr_touched, nr_top;
+	double *scores = Malloc(double, nr_class);
+	INT64 *touched = Malloc(INT64, nr_class);
+	char *seen = Malloc(char, nr_class);
+	struct feature_node *x;
+
+	if(scores == NULL || touched == NULL || seen == NULL)
+	{
+		free(scores);
+		free(touched);
+		free(seen);
+		return -2;
+	}
+	memset(scores, 0, sizeof(double) * nr_class);
+	memset(seen, 0, nr_class);
+
+	for(i = 0; i < prob->l; i++)
+	{
+		INT64 *idx = &top_idx[i*k];
+		double *dec = &top_val[i*k];
+
+		nnz = 0;
+		for(x = prob->x[i]; x->index != -1; x++)
+			if(x->index <= nr_row)
+				nnz += row_ptr[x->index] - row_ptr[x->index-1];
+
+		nr_top = 0;
+		if(nnz >= nr_class)
+		{
+			// many weights: scatter them all, then scan every class
+			for(x = prob->x[i]; x->index != -1; x++)
+			{
+				if(x->index > nr_row)
+					continue;
+				for(p = row_ptr[x->index-1]; p < row_ptr[x->index]; p++)
+					scores[col[p]] += val[p] * x->value;
+			}
+			for(c = 0; c < nr_class; c++)
+			{
+				topk_insert(idx, dec, &nr_top, k, nr_class, c, scores[c]);
+				scores[c] = 0;
+			}
+			continue;
+		}
+
+		// few weights: rank the classes scored, then the first k others,
+		// which all score 0
+		nr_touched = 0;
+		for(x = prob->x[i]; x->index != -1; x++)
+		{
+			if(x->index > nr_row)
+				continue;
+			for(p = row_ptr[x->index-1]; p < row_ptr[x->index]; p++)
+			{
+				c = col[p];
+				if(!seen[c])
+				{
+					seen[c] = 1;
+					touched[nr_touched++] = c;
+				}
+				scores[c] += val[p] * x->value;
+			}
+		}
+		for(p = 0; p < nr_touched; p++)
+			topk_insert(idx, dec, &nr_top, k, nr_class, touched[p], scores[touched[p]]);
+		for(c = 0, p = 0; c < nr_class && p < k; c++)
+			if(!seen[c])
+			{
+				topk_insert(idx, dec, &nr_top, k, nr_class, c, 0);
+				p++;
+			}
+		for(p = 0; p < nr_touched; p++)
+		{
+			scores[touched[p]] = 0;
+			seen[touched[p]] = 0;
+		}
+	}
+
+	free(scores);
+	free(touched);
+	free(seen);
+	return 0;
+}
+
+
+
+// predict the l instances x with quantized weights, as predict_values
+//
+// w is laid out as the weights of a LIBLINEAR model, nr_w per feature,
+// either as floats (scale is NULL) or as signed chars standing for
+// scale[k] times their value in weight vector k. bias >= 0 if the model
+// has a bias term. The labels go to labels[i], and the decision values
+// to dec_values[i*nr_class..] unless dec_values is NULL. If regression
+// is set, the label is the decision value. Return 0, or -2 if memory is
+// exhausted.
+INT64 predict_quantized(struct feature_node **x, INT64 l, const void *w, const double *scale, INT64 nr_feature,
+		double bias, INT64 nr_w, INT64 nr_class, const INT64 *label, int regression, double *labels, double *dec_values)
+{
+	INT64 i, k, n = bias >= 0 ? nr_feature + 1 : nr_feature;
+	const float *wf = (const float *)w;
+	const signed char *wq = (const signed char *)w;
+	double *dec = dec_values;
+
+	if(dec_values == NULL && (dec = Malloc(double, nr_class)) == NULL)
+		return -2;
+
+	for(i = 0; i < l; i++)
+	{
+		const struct feature_node *lx;
+		if(dec_values != NULL)
+			dec = dec_values + i*nr_class;
+		for(k = 0; k < nr_w; k++)
+			dec[k] = 0;
+
+		for(lx = x[i]; lx->index != -1; lx++)
+		{
+			// the dimension of testing data may exceed that of training
+			if(lx->index > n)
+				continue;
+			if(scale == NULL)
+				for(k = 0; k < nr_w; k++)
+					dec[k] += wf[(lx->index-1)*nr_w+k] * lx->value;
+			else
+				for(k = 0; k < nr_w; k++)
+					dec[k] += wq[(lx->index-1)*nr_w+k] * lx->value;
+		}
+		if(scale != NULL)
+			for(k = 0; k < nr_w; k++)
+				dec[k] *= scale[k];
+
+		if(nr_class == 2)
+		{
+			if(regression)
+				labels[i] = dec[0];
+			else
+				labels[i] = dec[0] > 0 ? label[0] : label[1];
+		}
+		else
+		{
+			INT64 dec_max_idx = 0;
+			for(k = 1; k < nr_class; k++)
+				if(dec[k] > dec[dec_max_idx])
+					dec_max_idx = k;
+			labels[i] = label[dec_max_idx];
+		}
+	}
+
+	if(dec_values == NULL)
+		free(dec);
+	return 0;
+}
+
+// round the n weights w to floats f, see predict_quantized
+void quantize_float(const double *w, INT64 n, float *f)
+{
+	INT64 j;
+
+	for(j = 0; j < n; j++)
+		f[j] = (float)w[j];
+}
+
+// quantize the n*nr_w weights w, nr_w per feature, to signed chars q:
+// weight vector k is scaled by scale[k], its largest absolute value over 127
+void quantize_int8(const double *w, INT64 n, INT64 nr_w, signed char *q, double *scale)
+{
+	INT64 j, k;
+
+	for(k = 0; k < nr_w; k++)
+		scale[k] = 0;
+	for(j = 0; j < n; j++)
+		for(k = 0; k < nr_w; k++)
+			if(fabs(w[j*nr_w+k]) > scale[k])
+				scale[k] = fabs(w[j*nr_w+k]);
+	for(k = 0; k < nr_w; k++)
+		scale[k] = scale[k] > 0 ? scale[k] / 127 : 1;
+	for(j = 0; j < n; j++)
+		for(k = 0; k < nr_w; k++)
+			q[j*nr_w+k] = (signed char)lround(w[j*nr_w+k] / scale[k]);
+}
+
+// the n*nr_w weights quantized as in predict_quantized, back as doubles
+void dequantize(const void *w, const double *scale, INT64 n, INT64 nr_w, double *out)
+{
+	INT64 j, k;
+
+	for(j = 0; j < n; j++)
+		for(k = 0; k < nr_w; k++)
+			out[j*nr_w+k] = scale == NULL ? ((const float *)w)[j*nr_w+k]
+				: ((const signed char *)w)[j*nr_w+k] * scale[k];
+}
+
+// move the weights of feature j of a model to row remap[j] of new_w, for
+// remap[j] in 1..new_nr_feature, and drop the others; the bias row, if any,
+// goes last. new_w must be zeroed and hold new_nr_feature+bias rows.
+void remap_weights(const double *w, INT64 nr_feature, INT64 nr_w, int has_bias, const INT64 *remap,
+		INT64 new_nr_feature, double *new_w)
+{
+	INT64 j, k;
+
+	for(j = 1; j <= nr_feature; j++)
+	{
+		INT64 new_j = remap[j];
+		if(new_j <= 0 || new_j > new_nr_feature)
+			continue;
+		for(k = 0; k < nr_w; k++)
+			new_w[(new_j-1)*nr_w+k] = w[(j-1)*nr_w+k];
+	}
+	if(has_bias)
+		for(k = 0; k < nr_w; k++)
+			new_w[new_nr_feature*nr_w+k] = w[nr_feature*nr_w+k];
+}
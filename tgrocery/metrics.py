@@ -0,0 +1,142 @@
+from array import array
+from ctypes import c_int64
+
+from .learner.learner import INT64_TYPECODE, util
+
+__all__ = ['GroceryConfusionMatrix']
+
+
+def _c_int64s(a):
+    return (c_int64 * len(a)).from_buffer(a)
+
+
+class GroceryConfusionMatrix(object):
+    """
+    Counts of (true label, predicted label) pairs.
+
+    Labels are mapped to dense ints the first time they are seen, and the
+    counts live in one flat integer :class:`array`, the count of true
+    label i predicted as j at ``i * stride + j``. The stride doubles when
+    the labels outgrow it. An update costs two dict lookups per
+    prediction whatever the number of labels, and every metric is derived
+    from the matrix on demand.
+
+    If *top_k* is positive, :meth:`update` also takes the rank of the
+    true label among the decision values of each prediction, for
+    :meth:`top_k_accuracy`.
+    """
+
+    def __init__(self, labels=(), top_k=0):
+        self.labels = []
+        self.label2idx = {}
+        self.stride = 0
+        self.matrix = array(INT64_TYPECODE)
+        # top_k_hits[r] is the number of predictions ranking the true label r + 1th
+        self.top_k_hits = array(INT64_TYPECODE, [0] * top_k)
+        for label in labels:
+            self._add_label(label)
+
+    def _add_label(self, label):
+        n = len(self.labels)
+        if n == self.stride:
+            stride = max(2 * self.stride, 16)
+            matrix = array(INT64_TYPECODE, [0]) * (stride * stride)
+            for i in xrange(n):
+                matrix[i * stride:i * stride + n] = self.matrix[i * n:(i + 1) * n]
+            self.matrix = matrix
+            self.stride = stride
+        self.labels.append(label)
+        self.label2idx[label] = n
+        return n
+
+    def _idx(self, label):
+        idx = self.label2idx.get(label)
+        if idx is None:
+            idx = self._add_label(label)
+        return idx
+
+    def update(self, true_y, predicted_y, ranks=None):
+        """
+        Count the pairs of *true_y* and *predicted_y*. *ranks*, if given,
+        are the 1-based ranks of the true labels by decision value.
+        """
+        lookup = self.label2idx.__getitem__
+        try:
+            true_idx, predicted_idx = map(lookup, true_y), map(lookup, predicted_y)
+        except KeyError:
+            # new labels may grow the matrix
+            for label in set(true_y).union(predicted_y):
+                self._idx(label)
+            true_idx, predicted_idx = map(lookup, true_y), map(lookup, predicted_y)
+        l = min(len(true_idx), len(predicted_idx))
+        if l > 0:
+            util.confusion_update(_c_int64s(self.matrix), self.stride,
+                    _c_int64s(array(INT64_TYPECODE, true_idx)), _c_int64s(array(INT64_TYPECODE, predicted_idx)), l)
+        if ranks is not None:
+            hits = self.top_k_hits
+            for rank in ranks:
+                if rank <= len(hits):
+                    hits[rank - 1] += 1
+        return self
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, true_predicted):
+        """Return the count of a ``(true label, predicted label)`` pair."""
+        true_label, predicted_label = true_predicted
+        if true_label not in self.label2idx or predicted_label not in self.label2idx:
+            return 0
+        return self.matrix[self.label2idx[true_label] * self.stride + self.label2idx[predicted_label]]
+
+    def nr_instance(self):
+        return sum(self.matrix)
+
+    def nr_correct(self):
+        return sum(self.matrix[::self.stride + 1]) if self.stride else 0
+
+    def true_counts(self):
+        n, stride = len(self.labels), self.stride
+        return [sum(self.matrix[i * stride:i * stride + n]) for i in xrange(n)]
+
+    def predicted_counts(self):
+        return [sum(self.matrix[j::self.stride]) for j in xrange(len(self.labels))]
+
+    def accuracy(self):
+        nr_instance = self.nr_instance()
+        return self.nr_correct() / float(nr_instance) if nr_instance else float(0)
+
+    def _per_label(self, counts):
+        n = self.stride + 1
+        return dict((label, float(self.matrix[i * n]) / counts[i] if counts[i] else float(0))
+                for i, label in enumerate(self.labels))
+
+    def precision(self):
+        return self._per_label(self.predicted_counts())
+
+    def recall(self):
+        return self._per_label(self.true_counts())
+
+    def f1(self):
+        precision, recall = self.precision(), self.recall()
+        return dict((label, 2 * precision[label] * recall[label] / (precision[label] + recall[label])
+                if precision[label] + recall[label] else float(0)) for label in self.labels)
+
+    def macro_average(self):
+        """Return the unweighted means of precision, recall and F1 over the labels."""
+        n = float(len(self.labels)) or 1
+        return tuple(sum(d.itervalues()) / n for d in (self.precision(), self.recall(), self.f1()))
+
+    def micro_average(self):
+        """
+        Return precision, recall and F1 pooled over all predictions. With
+        one label per instance they all equal the accuracy.
+        """
+        accuracy = self.accuracy()
+        return accuracy, accuracy, accuracy
+
+    def top_k_accuracy(self, k):
+        if k > len(self.top_k_hits):
+            raise ValueError('Ranks were counted up to {0} only.'.format(len(self.top_k_hits)))
+        nr_instance = self.nr_instance()
+        return sum(self.top_k_hits[:k]) / float(nr_instance) if nr_instance else float(0)
@@ -0,0 +1,254 @@
+"""
+A prediction server around a saved :class:`tgrocery.Grocery` model::
+
+    python -m tgrocery.serve <model_name> [--port 8000 | --unix-socket PATH]
+                             [--max-batch-size 64] [--max-wait 0.005]
+                             [--cache-size 0] [--cache-ttl SECONDS]
+
+``POST /predict`` with a JSON body ``{"text": "..."}`` returns
+``{"label": "..."}``, and with ``{"texts": [...]}`` returns
+``{"labels": [...]}``. ``GET /stats`` returns the latency percentiles and
+throughput counters of :class:`GroceryServeStats`, and the statistics of
+the prediction cache if ``--cache-size`` is given.
+
+Concurrent requests are coalesced by a :class:`GroceryBatcher` into
+micro-batches predicted by one :meth:`tgrocery.Grocery.predict_batch`
+call, in a worker thread which releases the GIL while in C.
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from Queue import Queue, Empty
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from collections import deque
+
+from . import Grocery, warmup
+
+__all__ = ['GroceryServeStats', 'GroceryBatcher', 'serve']
+
+
+class GroceryServeStats(object):
+    def __init__(self, window=10000):
+        """
+        Counters of a :class:`GroceryBatcher`. Latency percentiles are
+        over the last *window* requests, from submission to result.
+        """
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.nr_request = 0
+        self.nr_text = 0
+        self.nr_batch = 0
+        self.nr_error = 0
+        self.latencies = deque(maxlen=window)
+
+    def update(self, latencies, nr_text, nr_error=0):
+        with self.lock:
+            self.nr_request += len(latencies)
+            self.nr_text += nr_text
+            self.nr_batch += 1
+            self.nr_error += nr_error
+            self.latencies.extend(latencies)
+
+    def percentile(self, p):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))]
+
+    def to_dict(self):
+        seconds = time.time() - self.start_time
+        return {
+            'requests': self.nr_request,
+            'texts': self.nr_text,
+            'batches': self.nr_batch,
+            'errors': self.nr_error,
+            'mean_batch_size': float(self.nr_text) / (self.nr_batch or 1),
+            'requests_per_second': self.nr_request / seconds,
+            'texts_per_second': self.nr_text / seconds,
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+        }
+
+    def __str__(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+
+class _Job(object):
+    def __init__(self, texts):
+        self.texts = texts
+        self.submit_time = time.time()
+        self.done = threading.Event()
+        self.labels = None
+        self.error = None
+
+
+class GroceryBatcher(object):
+    def __init__(self, grocery, max_batch_size=64, max_wait=0.005):
+        """
+        Predict the texts submitted from any thread with *grocery* in
+        batches: a batch is sent once it has *max_batch_size* texts or its
+        first text has waited *max_wait* seconds.
+        """
+        self.grocery = grocery
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = GroceryServeStats()
+        self.queue = Queue()
+        self.worker = threading.Thread(target=self._run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def predict(self, texts):
+        """
+        Return the labels of *texts*, blocking until their batch is done.
+        """
+        job = _Job(texts)
+        self.queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.labels
+
+    def _next_batch(self):
+        jobs = [self.queue.get()]
+        nr_text = len(jobs[0].texts)
+        deadline = jobs[0].submit_time + self.max_wait
+        while nr_text < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                job = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except Empty:
+                break
+            jobs.append(job)
+            nr_text += len(job.texts)
+        return jobs, nr_text
+
+    def _run(self):
+        while True:
+            jobs, nr_text = self._next_batch()
+            texts = [text for job in jobs for text in job.texts]
+            nr_error = 0
+            try:
+                labels = self.grocery.predict_batch(texts).predicted_y
+                i = 0
+                for job in jobs:
+                    job.labels = labels[i:i + len(job.texts)]
+                    i += len(job.texts)
+            except Exception:
+                # e.g. a text that is not a string: each job alone tells which
+                for job in jobs:
+                    try:
+                        job.labels = self.grocery.predict_batch(job.texts).predicted_y
+                    except Exception as e:
+                        job.error = e
+                        nr_error += 1
+            now = time.time()
+            for job in jobs:
+                job.done.set()
+            self.stats.update([now - job.submit_time for job in jobs], nr_text, nr_error)
+
+
+class _PredictHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, code, obj):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._reply(404, {'error': 'not found'})
+        stats = self.server.batcher.stats.to_dict()
+        stats['cache'] = self.server.batcher.grocery.cache_stats()
+        self._reply(200, stats)
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self._reply(404, {'error': 'not found'})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))
+            single = 'text' in request
+            texts = [request['text']] if single else list(request['texts'])
+        except (ValueError, KeyError, TypeError):
+            return self._reply(400, {'error': 'expected {"text": ...} or {"texts": [...]}'})
+        try:
+            labels = self.server.batcher.predict(texts)
+        except Exception as e:
+            return self._reply(400, {'error': str(e)})
+        self._reply(200, {'label': labels[0]} if single else {'labels': labels})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        # as HTTPServer.server_bind, needed by BaseHTTPRequestHandler
+        self.server_name, self.server_port = socket.gethostname(), 0
+
+
+def serve(grocery, host='127.0.0.1', port=8000, unix_socket=None, max_batch_size=64, max_wait=0.005):
+    """
+    Serve predictions of the trained or loaded *grocery* over HTTP on
+    *host*:*port*, or on the Unix socket *unix_socket* if given, until
+    interrupted. See the module documentation.
+
+    jieba is loaded before serving, so that the first request does not
+    pay for it, unless *grocery* has a custom tokenizer.
+    """
+    if grocery.custom_tokenize is None:
+        warmup()
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _ThreadingUnixHTTPServer(unix_socket, _PredictHandler)
+    else:
+        server = _ThreadingHTTPServer((host, port), _PredictHandler)
+    server.batcher = GroceryBatcher(grocery, max_batch_size, max_wait)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        print server.batcher.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m tgrocery.serve',
+                                     description='Serve the predictions of a saved Grocery model.')
+    parser.add_argument('model_name')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', help='listen on this Unix socket instead of host:port')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait', type=float, default=0.005, help='in seconds')
+    parser.add_argument('--cache-size', type=int, default=0, help='number of texts whose predictions are cached')
+    parser.add_argument('--cache-ttl', type=float, help='in seconds')
+    args = parser.parse_args()
+
+    grocery = Grocery(args.model_name, cache_size=args.cache_size, cache_ttl=args.cache_ttl)
+    grocery.load()
+    serve(grocery, args.host, args.port, args.unix_socket, args.max_batch_size, args.max_wait)
+
+
+if __name__ == '__main__':
+    main()